@@ -3,7 +3,7 @@ from sanic import Sanic
 from sanic.request import Request
 from sanic.response import text, HTTPResponse
 from sanic_session import InMemorySessionInterface
-from sanic_oauth.blueprint import oauth_blueprint, login_required
+from sanic_oauth.blueprint import oauth_blueprint, login_required, configure_oauth
 
 app = Sanic('example-oauth')
 app.blueprint(oauth_blueprint)
@@ -13,6 +13,7 @@ app.config.OAUTH_REDIRECT_URI = 'http://127.0.0.1:8888/oauth'
 app.config.OAUTH_SCOPE = 'email'
 app.config.OAUTH_CLIENT_ID = 'insert-you-credentials'
 app.config.OAUTH_CLIENT_SECRET = 'insert-you-credentials'
+configure_oauth(app)
 
 
 @app.listener('before_server_start')
@@ -4,7 +4,7 @@ from sanic import Sanic
 from sanic.request import Request
 from sanic.response import text, HTTPResponse, html
 from sanic_session import InMemorySessionInterface
-from sanic_oauth.blueprint import oauth_blueprint, login_required
+from sanic_oauth.blueprint import oauth_blueprint, login_required, configure_oauth
 
 app = Sanic('example-oauth')
 app.blueprint(oauth_blueprint)
@@ -24,6 +24,7 @@ GITLAB_PROVIDER['SCOPE'] = "read_user"
 GITLAB_PROVIDER['CLIENT_ID'] = 'insert-you-credentials'
 GITLAB_PROVIDER['CLIENT_SECRET'] = 'insert-you-credentials'
 app.config.OAUTH_PROVIDERS['default'] = DISCORD_PROVIDER
+configure_oauth(app)
 
 @app.listener('before_server_start')
 async def init_aiohttp_session(sanic_app, _loop) -> None:
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+import typing
+
+from .core import OAuth2Client
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+TokenKey = typing.Tuple[str, str, typing.Optional[str]]
+
+
+class AppTokenCache:
+
+    """Application tokens from client credentials grant, shared by all coroutines.
+
+    Tokens are cached per client id, token endpoint and scope. Within
+    ``refresh_margin`` seconds of expiration the cached token is still
+    returned while one background call renews it; only expired or missing
+    tokens make callers wait, and concurrent callers wait for the same call.
+    """
+
+    def __init__(self, refresh_margin: float = 60.0, default_ttl: float = 3600.0) -> None:
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self._tokens: typing.Dict[TokenKey, typing.Tuple[str, float]] = {}
+        self._renewals: typing.Dict[TokenKey, asyncio.Task] = {}
+
+    @staticmethod
+    def _key(client: OAuth2Client, scope: typing.Optional[str]) -> TokenKey:
+        return client.client_id, client.access_token_url, scope
+
+    async def _renew(self, key: TokenKey, client: OAuth2Client, scope: typing.Optional[str]) -> str:
+        try:
+            token, data = await client.get_client_credentials_token(scope)
+            expires_in = data.get('expires_in')
+            self._tokens[key] = (token, time.monotonic() + (float(expires_in) if expires_in else self.default_ttl))
+            return token
+        finally:
+            del self._renewals[key]
+
+    def _renewal(self, key: TokenKey, client: OAuth2Client, scope: typing.Optional[str]) -> asyncio.Task:
+        task = self._renewals.get(key)
+        if task is None:
+            task = self._renewals[key] = asyncio.ensure_future(self._renew(key, client, scope))
+            task.add_done_callback(self._log_failure)
+        return task
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            _log.warning("Application token renewal failed: %s", task.exception())
+
+    async def get(self, client: OAuth2Client, scope: str = None) -> str:
+        """Return valid application token for the provider of ``client``."""
+        key = self._key(client, scope)
+        cached = self._tokens.get(key)
+        now = time.monotonic()
+        if cached is not None and cached[1] > now:
+            if cached[1] - now <= self.refresh_margin:
+                self._renewal(key, client, scope)
+            return cached[0]
+        # shield: a cancelled caller must not cancel the call other callers wait for
+        return await asyncio.shield(self._renewal(key, client, scope))
+
+    def invalidate(self, client: OAuth2Client, scope: str = None) -> None:
+        """Forget token rejected by provider, the next ``get`` requests a new one."""
+        self._tokens.pop(self._key(client, scope), None)
+
+    async def authorize(self, client: OAuth2Client, scope: str = None) -> OAuth2Client:
+        """Attach application token to ``client`` and return it."""
+        client.access_token = await self.get(client, scope)
+        return client
+
+    async def stop(self) -> None:
+        for task in list(self._renewals.values()):
+            task.cancel()
@@ -1,14 +1,30 @@
-import importlib
+import asyncio
 import logging
+import math
 from functools import partial
 import re
+import time
 import typing
 
+from aiohttp import ClientError, ClientSession
 from aiohttp.web_exceptions import HTTPBadRequest
 from sanic import Blueprint, Sanic
 from sanic.request import Request
 from sanic.response import HTTPResponse, redirect
-from .core import UserInfo
+from .apptoken import AppTokenCache
+from .config import OAuthConfig, ProviderConfig, build_runtime, compile_oauth_config
+from .core import (
+    BACKGROUND, DEFAULT_RETRY_AFTER, INTERACTIVE, OAuth1Client, OAuthConfigurationException, ProviderOverloaded,
+    ProviderUnavailable, RateLimitExceeded, UserInfo
+)
+from .events import DEFAULT_EVENTS, AuthEventLogger
+from .oauth1 import RequestTokenPool, RequestTokenSecrets
+from .policy import Policy
+from .revalidate import UserInfoRevalidator, user_info_record
+from .revocation import RevocationList
+from .store import AuthStateStore, MemoryStore, token_key, user_key
+from .transport import AiohttpTransport
+from .warmup import ProviderWarmup
 
 __author__ = "Bogdan Gladyshev"
 __copyright__ = "Copyright 2017, Bogdan Gladyshev"
@@ -24,262 +40,624 @@ _log = logging.getLogger(__name__)
 oauth_blueprint = Blueprint('OAuth_Configuration')  # pylint: disable=invalid-name
 
 
-class OAuthConfigurationException(Exception):
-    pass
+def service_unavailable(retry_after: float) -> HTTPResponse:
+    return HTTPResponse(status=503, headers={'Retry-After': str(math.ceil(retry_after))})
 
 
-async def oauth(request: Request) -> HTTPResponse:
+def forbidden() -> HTTPResponse:
+    return HTTPResponse(status=403)
+
+
+def get_provider_config(request: Request, provider: str = None, tenant: str = None) -> ProviderConfig:
+    """Return provider settings from tenant registry or from application config."""
+    if tenant is not None:
+        return request.app.ctx.oauth_tenants.get(tenant, provider)
+    return request.app.ctx.oauth_config.provider(provider)
+
+
+def provider_retry_after(request: Request, provider: str = None, tenant: str = None) -> typing.Optional[float]:
+    """Return seconds until provider circuit closes, ``None`` when provider is available."""
+    factory_args = {}
+    if provider:
+        factory_args['provider'] = provider
+    if tenant is not None:
+        factory_args['tenant'] = tenant
+    breaker = request.app.ctx.oauth_factory(**factory_args).circuit_breaker
+    if breaker is None or breaker.available:
+        return None
+    return breaker.retry_after
+
+
+def get_store(request: Request) -> typing.Optional[AuthStateStore]:
+    return getattr(request.app.ctx, 'oauth_store', None)
+
+
+def _forget_session(session) -> None:
+    for key in ('token', 'oauth_token_secret', 'user_info', 'user_info_fetched_at', 'oauth_memberships'):
+        if key in session:
+            del session[key]
+
+
+def get_events(sanic_app: Sanic) -> AuthEventLogger:
+    return getattr(sanic_app.ctx, 'oauth_events', None) or DEFAULT_EVENTS
+
+
+def get_revocations(request: Request) -> typing.Optional[RevocationList]:
+    return getattr(request.app.ctx, 'oauth_revocations', None)
+
+
+async def revoke_token(sanic_app: Sanic, token: str = None, digest: str = None) -> None:
+    """Revoke access token (or its SHA-256 hex ``digest``) on every worker and node.
+
+    Token state is removed from shared store and the revocation is broadcast
+    to ``app.ctx.oauth_revocations`` of all workers, so sessions holding the
+    token are logged out on their next request.
+    """
+    if digest is None:
+        digest = RevocationList.digest(token)
+    store = getattr(sanic_app.ctx, 'oauth_store', None)
+    if store is not None:
+        index = await store.get(f'token_user:{digest}')
+        if index is not None:
+            await store.index_remove(index, digest)
+        for kind in ('token', 'user_info', 'memberships', 'token_user'):
+            await store.delete(f'{kind}:{digest}')
+    revocations = getattr(sanic_app.ctx, 'oauth_revocations', None)
+    if revocations is not None:
+        await revocations.revoke_digest(digest)
+    get_events(sanic_app).event('token.revoked', digest=digest)
+
+
+async def logout_everywhere(sanic_app: Sanic, provider: str, user_id: typing.Any, tenant: str = None) -> int:
+    """Revoke every token issued to the user, e.g. when deprovisioning, and return their count.
+
+    ``provider`` is provider client name (e.g. ``'github'``); tokens are found
+    in the index kept in ``app.ctx.oauth_store`` without scanning sessions.
+    """
+    store = getattr(sanic_app.ctx, 'oauth_store', None)
+    if store is None:
+        raise OAuthConfigurationException("You should configure app.ctx.oauth_store to logout users everywhere")
+    key = user_key(provider, user_id, tenant)
+    digests = await store.index_members(key)
+    await asyncio.gather(*(revoke_token(sanic_app, digest=digest) for digest in digests))
+    await store.delete(key)
+    get_events(sanic_app).event('user.logged_out_everywhere', provider=provider, user_id=user_id, tenant=tenant, tokens=len(digests))
+    return len(digests)
+
+
+async def logout(request: Request) -> None:
+    """Forget current user tokens, on every node when shared store or revocation list is configured."""
+    token = request.ctx.session.get('token')
+    if token is not None:
+        await revoke_token(request.app, token)
+    _forget_session(request.ctx.session)
+
+
+async def oauth(request: Request) -> HTTPResponse:  # pylint: disable=too-many-return-statements
+    oauth_config: OAuthConfig = request.app.ctx.oauth_config
     provider = request.ctx.session.get('oauth_provider', None)
-    provider_confs = request.app.config.get('OAUTH_PROVIDERS', {})
-    if provider is None and 'default' in provider_confs:
+    tenant = request.ctx.session.get('oauth_tenant', None)
+    if provider is None and tenant is None and 'default' in oauth_config.providers:
         provider = 'default'
-    if provider:
-        if provider not in provider_confs:
-            return HTTPResponse(status=404)
-        provider_conf = provider_confs[provider]
-        use_scope = provider_conf['SCOPE']
-        use_redirect_uri = provider_conf['REDIRECT_URI']
-        use_after_auth_default_redirect = \
-            provider_conf['AFTER_AUTH_DEFAULT_REDIRECT']
-    else:
-        use_scope = request.app.config.OAUTH_SCOPE
-        use_redirect_uri = request.app.config.OAUTH_REDIRECT_URI
-        use_after_auth_default_redirect = \
-            request.app.config.OAUTH_AFTER_AUTH_DEFAULT_REDIRECT
-    client = request.app.ctx.oauth_factory(provider=provider)
+    if provider and tenant is None and provider not in oauth_config.providers:
+        return HTTPResponse(status=404)
+    try:
+        provider_conf = get_provider_config(request, provider, tenant)
+    except OAuthConfigurationException:
+        return HTTPResponse(status=404)
+    client = request.app.ctx.oauth_factory(provider=provider, tenant=tenant)
+    breaker = client.circuit_breaker
+    if breaker is not None and not breaker.available:
+        # token exchange would fail anyway, do not send user to provider
+        return service_unavailable(breaker.retry_after)
+    if isinstance(client, OAuth1Client):
+        return await oauth1(request, client, provider, tenant, provider_conf)
     if 'code' not in request.args:
         return redirect(client.get_authorize_url(
-            scope=use_scope,
-            redirect_uri=use_redirect_uri
+            scope=provider_conf.scope,
+            redirect_uri=provider_conf.redirect_uri
         ))
 
-    token, _data = await client.get_access_token(
-        request.args.get('code'),
-        redirect_uri=use_redirect_uri
-    )
-    request.ctx.session['token'] = token
+    try:
+        token, _data = await client.get_access_token(
+            request.args.get('code'),
+            redirect_uri=provider_conf.redirect_uri
+        )
+    except (ProviderOverloaded, RateLimitExceeded, ProviderUnavailable) as exc:
+        return service_unavailable(exc.retry_after)
+    except (ClientError, asyncio.TimeoutError):
+        return service_unavailable(DEFAULT_RETRY_AFTER)
+    return await complete_login(request, provider, tenant, provider_conf, token, _data)
+
+
+async def oauth1(  # pylint: disable=too-many-arguments,too-many-return-statements
+        request: Request, client: OAuth1Client, provider: typing.Optional[str],
+        tenant: typing.Optional[str], provider_conf: ProviderConfig) -> HTTPResponse:
+    """OAuth 1.0a flow: redirect with request token, then exchange it for access token."""
+    secrets: RequestTokenSecrets = request.app.ctx.oauth_request_tokens
+    session = request.ctx.session
+    if 'oauth_verifier' not in request.args:
+        if 'denied' in request.args:
+            # user refused access on provider side
+            if request.args.get('denied') == session.pop('oauth_request_token', None):
+                await secrets.pop(request.args.get('denied'))
+            return forbidden()
+        pool: typing.Optional[RequestTokenPool] = getattr(request.app.ctx, 'oauth_request_token_pool', None)
+        try:
+            if pool is not None:
+                request_token, secret = await pool.take(
+                    (provider, tenant),
+                    lambda priority: request.app.ctx.oauth_factory(provider=provider, tenant=tenant, priority=priority),
+                    provider_conf.redirect_uri
+                )
+            else:
+                request_token, secret, _data = await client.get_request_token(oauth_callback=provider_conf.redirect_uri)
+        except (ProviderOverloaded, RateLimitExceeded, ProviderUnavailable) as exc:
+            return service_unavailable(exc.retry_after)
+        except (ClientError, asyncio.TimeoutError):
+            return service_unavailable(DEFAULT_RETRY_AFTER)
+        await secrets.put(request_token, secret)
+        # callback is accepted only in the session that started the login
+        session['oauth_request_token'] = request_token
+        return redirect(client.get_authorize_url(request_token))
+
+    request_token = request.args.get('oauth_token')
+    if not request_token or request_token != session.get('oauth_request_token'):
+        return HTTPResponse(status=400)
+    del session['oauth_request_token']
+    secret = await secrets.pop(request_token)
+    if secret is None:
+        # unknown, expired or already used request token
+        return HTTPResponse(status=400)
+    client.oauth_token, client.oauth_token_secret = request_token, secret
+    try:
+        token, token_secret, _data = await client.get_access_token(request.args.get('oauth_verifier'), request_token)
+    except (ProviderOverloaded, RateLimitExceeded, ProviderUnavailable) as exc:
+        return service_unavailable(exc.retry_after)
+    except (ClientError, asyncio.TimeoutError):
+        return service_unavailable(DEFAULT_RETRY_AFTER)
+    return await complete_login(request, provider, tenant, provider_conf, token, _data, token_secret)
+
+
+async def complete_login(  # pylint: disable=too-many-arguments
+        request: Request, provider: typing.Optional[str], tenant: typing.Optional[str],
+        provider_conf: ProviderConfig, token: str, data: typing.Mapping, token_secret: str = None) -> HTTPResponse:
+    """Remember obtained access token and send user back where login started."""
+    oauth_config: OAuthConfig = request.app.ctx.oauth_config
+    session = request.ctx.session
+    # identity of a previous login in this session must not be reused
+    _forget_session(session)
+    session['token'] = token
+    if token_secret is not None:
+        session['oauth_token_secret'] = token_secret
     if provider:
         # remember provider
-        request.ctx.session['oauth_provider'] = provider
-    elif 'oauth_provider' in request.ctx.session:
+        session['oauth_provider'] = provider
+    elif 'oauth_provider' in session:
         # forget remembered provider
-        del request.ctx.session['oauth_provider']
-    return redirect(request.ctx.session.get('after_auth_redirect',
-                                           use_after_auth_default_redirect))
-
-
-async def fetch_user_info(request, provider, oauth_endpoint_path, local_email_regex) -> UserInfo:
-    try:
-        user_info = request.ctx.session['user_info']
-        user = UserInfo(**user_info)
-    except KeyError:
-        factory_args = {'access_token': request.ctx.session['token']}
-        oauth_provider = request.ctx.session.get('oauth_provider', provider)
-        if oauth_provider:
-            factory_args['provider'] = provider
-        client = request.app.ctx.oauth_factory(**factory_args)
-        print(client)
-        print(factory_args)
-        try:
-            user, _info = await client.user_info()
-        except (KeyError, HTTPBadRequest) as exc:
-            _log.exception(exc)
+        del session['oauth_provider']
+    store = get_store(request)
+    if store is not None:
+        expires_in = data.get('expires_in')
+        token_ttl = float(expires_in) if expires_in else oauth_config.token_ttl
+        await store.set(token_key('token', token), {
+            'provider': provider, 'tenant': tenant, 'refresh_token': data.get('refresh_token'),
+            'expires_at': time.time() + token_ttl if token_ttl else None,
+        }, ttl=token_ttl)
+        # indexes the token by user now, so logout everywhere finds sessions that never load user info
+        user = await fetch_user_info(request, provider, provider_conf.endpoint_path or oauth_config.endpoint_path, None)
+        if isinstance(user, HTTPResponse):
+            await logout(request)
+            return user
+    get_events(request.app).event('login.completed', provider=provider, tenant=tenant, token=token)
+    return redirect(session.get('after_auth_redirect', provider_conf.after_auth_default_redirect))
+
+
+def _user_info_store(request: Request) -> typing.Optional[AuthStateStore]:
+    revalidator = getattr(request.app.ctx, 'oauth_revalidator', None)
+    return revalidator.store if revalidator is not None else get_store(request)
+
+
+def _as_user_info(user_info) -> UserInfo:
+    return user_info if isinstance(user_info, UserInfo) else UserInfo(**user_info)
+
+
+def _factory_args(session, provider) -> typing.Dict[str, typing.Any]:
+    factory_args = {'access_token': session['token']}
+    if 'oauth_token_secret' in session:
+        factory_args['access_token_secret'] = session['oauth_token_secret']
+    oauth_provider = session.get('oauth_provider', provider)
+    if oauth_provider:
+        factory_args['provider'] = provider
+    if 'oauth_tenant' in session:
+        factory_args['tenant'] = session['oauth_tenant']
+    return factory_args
+
+
+async def _index_token(request: Request, token: str, index: str) -> None:
+    store = get_store(request)
+    if store is None:
+        return
+    token_ttl = await store.ttl(token_key('token', token)) or request.app.ctx.oauth_config.token_ttl
+    await store.index_add(index, RevocationList.digest(token), token_ttl)
+    # lets logout drop the token from the index instead of leaving it there until it expires
+    await store.set(token_key('token_user', token), index, ttl=token_ttl)
+
+
+def _email_denied(user, local_email_regex) -> bool:
+    return bool(local_email_regex and user.email and not local_email_regex.match(user.email))
+
+
+async def _stored_user_info(request: Request, oauth_endpoint_path: str, local_email_regex):
+    """Return stored user info record of the session token, taken into session when newer than its copy.
+
+    Redirects when the token was revoked or the stored email is not allowed.
+    """
+    store = _user_info_store(request)
+    record = await store.get(token_key('user_info', request.ctx.session['token'])) if store is not None else None
+    if record is None:
+        return None
+    if record.get('revoked'):
+        await logout(request)
+        return redirect(oauth_endpoint_path)
+    session = request.ctx.session
+    if session.get('user_info') is None or record['fetched_at'] > session.get('user_info_fetched_at', 0):
+        user_info = UserInfo(**record['user_info'])
+        if _email_denied(user_info, local_email_regex):
             return redirect(oauth_endpoint_path)
-
-        if local_email_regex and user.email:
-            if not local_email_regex.match(user.email):
-                return redirect(oauth_endpoint_path)
-
-        request.ctx.session['user_info'] = user
+        session['user_info'], session['user_info_fetched_at'] = user_info, record['fetched_at']
+    return record
+
+
+def _may_serve_stored(request: Request, factory_args: typing.Mapping, fetched_at: float) -> bool:
+    """Check if stored user info is fresh, or stale within hard TTL and scheduled for background revalidation."""
+    oauth_config: OAuthConfig = request.app.ctx.oauth_config
+    soft_ttl, hard_ttl = oauth_config.user_info_soft_ttl, oauth_config.user_info_hard_ttl
+    age = time.time() - fetched_at
+    if soft_ttl is None or age < soft_ttl:
+        return True
+    revalidator = getattr(request.app.ctx, 'oauth_revalidator', None)
+    # background revalidation knows access tokens only, OAuth1 ones need their secret too
+    if revalidator is None or 'access_token_secret' in factory_args or (hard_ttl is not None and age >= hard_ttl):
+        return False
+    revalidator.schedule(factory_args['access_token'], factory_args.get('provider'), factory_args.get('tenant'))
+    return True
+
+
+def _degraded_user_info(request: Request, exc: Exception, user_info, fetched_at: float) -> typing.Union[UserInfo, HTTPResponse]:
+    """Serve previously validated identity within degraded grace while provider is unavailable, 503 otherwise."""
+    grace = request.app.ctx.oauth_config.degraded_grace
+    if user_info is not None and grace is not None and time.time() - fetched_at < grace:
+        # keep previously validated identity instead of redirect loop
+        _log.warning("Provider unavailable, serving user info in degraded mode: %s", exc)
+        request.ctx.oauth_degraded = True
+        return _as_user_info(user_info)
+    return service_unavailable(getattr(exc, 'retry_after', DEFAULT_RETRY_AFTER))
+
+
+async def _request_user_info(request: Request, client, record, oauth_endpoint_path: str):
+    """Return user info with its validators from provider, stored copy when not modified, or response to answer with."""
+    try:
+        user, _info, validators = await client.conditional_user_info(
+            record.get('validators') if record is not None and 'user_info' in record else None
+        )
+    except (ProviderOverloaded, RateLimitExceeded, ProviderUnavailable, ClientError, asyncio.TimeoutError) as exc:
+        session = request.ctx.session
+        return _degraded_user_info(request, exc, session.get('user_info'), session.get('user_info_fetched_at', 0))
+    except (KeyError, HTTPBadRequest) as exc:
+        _log.exception(exc)
+        return redirect(oauth_endpoint_path)
+    if user is None:
+        # not modified since the stored copy was fetched
+        user = UserInfo(**record['user_info'])
+    return user, validators
+
+
+async def _save_user_info(request: Request, user: UserInfo, validators, index: typing.Optional[str]) -> None:
+    """Remember user info in session and store, index the token by user when ``index`` is given."""
+    session = request.ctx.session
+    record = user_info_record(user, validators)
+    store = _user_info_store(request)
+    if store is not None:
+        await store.set(token_key('user_info', session['token']), record, ttl=request.app.ctx.oauth_config.user_info_ttl)
+        if index is not None:
+            await _index_token(request, session['token'], index)
+    session['user_info'], session['user_info_fetched_at'] = user, record['fetched_at']
+
+
+async def fetch_user_info(request, provider, oauth_endpoint_path, local_email_regex) -> typing.Union[UserInfo, HTTPResponse]:
+    """Return user information, fresh or stale within soft TTL while it is revalidated in background."""
+    session = request.ctx.session
+    soft_ttl = request.app.ctx.oauth_config.user_info_soft_ttl
+    if session.get('user_info') is not None and (
+            soft_ttl is None or time.time() - session.get('user_info_fetched_at', 0) < soft_ttl):
+        return _as_user_info(session['user_info'])
+
+    record = await _stored_user_info(request, oauth_endpoint_path, local_email_regex)
+    if isinstance(record, HTTPResponse):
+        return record
+    user_info = session.get('user_info')
+    factory_args = _factory_args(session, provider)
+    if user_info is not None and _may_serve_stored(request, factory_args, session.get('user_info_fetched_at', 0)):
+        return _as_user_info(user_info)
+
+    client = request.app.ctx.oauth_factory(**factory_args)
+    get_events(request.app).event(
+        'user_info.fetch', logging.DEBUG,
+        provider=factory_args.get('provider'), tenant=factory_args.get('tenant'), token=factory_args['access_token']
+    )
+    fetched = await _request_user_info(request, client, record, oauth_endpoint_path)
+    if not isinstance(fetched, tuple):
+        return fetched
+    user, validators = fetched
+    if _email_denied(user, local_email_regex):
+        return redirect(oauth_endpoint_path)
+    index = None
+    if user_info is None and get_store(request) is not None:
+        # first identity seen for this token, normally at login
+        index = user_key(client.name, user.id, factory_args.get('tenant'))
+    await _save_user_info(request, user, validators, index)
     return user
 
 
-def login_required(async_handler=None, provider=None, add_user_info=True, email_regex=None):
+async def fetch_memberships(request, provider, ttl: float) -> typing.Optional[typing.List[str]]:
+    """Return groups / organizations of the user, cached in session and shared store for ``ttl`` seconds."""
+    session = request.ctx.session
+    key = token_key('memberships', session['token'])
+    cached = session.get('oauth_memberships')
+    if cached is not None and cached[2] == key and time.time() - cached[1] < ttl:
+        return cached[0]
+    store = _user_info_store(request)
+    record = await store.get(key) if store is not None else None
+    if record is None or time.time() - record['fetched_at'] >= ttl:
+        client = request.app.ctx.oauth_factory(**_factory_args(session, provider))
+        try:
+            record = {'memberships': await client.memberships(), 'fetched_at': time.time()}
+        except (ProviderOverloaded, RateLimitExceeded, ProviderUnavailable, ClientError, asyncio.TimeoutError):
+            # provider is down or busy, login_required answers 503 instead of denying the user
+            raise
+        except HTTPBadRequest as exc:
+            _log.warning("Failed to load user memberships: %s", exc)
+            return record['memberships'] if record is not None else None
+        if store is not None:
+            await store.set(key, record, ttl=ttl)
+    session['oauth_memberships'] = [record['memberships'], record['fetched_at'], key]
+    return record['memberships']
+
+
+async def _token_active(request: Request, token: str) -> bool:
+    """Check if token was neither revoked nor logged out, from memory when the revocation list is configured."""
+    revocations, store = get_revocations(request), get_store(request)
+    if revocations is not None:
+        return await revocations.is_active(token, store)
+    # every request asks the store, NearCache keeps the answers local
+    return store is None or await store.get(token_key('token', token)) is not None
+
+
+def login_required(async_handler=None, provider=None, add_user_info=True, email_regex=None, tenant=None, policy=None):
     """
     auth decorator
     call function(request, user: <sanic_oauth UserInfo object>)
+    tenant is optional callable(request) -> tenant key in app.ctx.oauth_tenants
+    policy is optional Policy (or its keyword arguments) checked on every request, 403 when it denies
     """
 
     if async_handler is None:
-        return partial(login_required, provider=provider, add_user_info=add_user_info, email_regex=email_regex)
+        return partial(
+            login_required, provider=provider, add_user_info=add_user_info,
+            email_regex=email_regex, tenant=tenant, policy=policy
+        )
 
     if email_regex is not None:
         email_regex = re.compile(email_regex)
+    policy = Policy.compile(policy)
 
     async def wrapped(request, **kwargs):
         nonlocal provider
-        oauth_endpoint_path = None
-        oauth_email_regex = None
-        provider_confs = request.app.config.get('OAUTH_PROVIDERS', {})
-        if provider is None and 'default' in provider_confs:
+        oauth_config: OAuthConfig = request.app.ctx.oauth_config
+        tenant_key = tenant(request) if tenant is not None else None
+        if provider is None and 'default' in oauth_config.providers:
             provider = 'default'
-        if provider:
-            try:
-                provider_config = provider_confs[provider]
-            except KeyError:
-                if provider == "default" and provider_confs:
-                    provider_config = next(iter(provider_confs.values()))
-                else:
-                    raise OAuthConfigurationException(
-                        "No provider named {} configured".format(provider))
-            oauth_endpoint_path = provider_config.get('ENDPOINT_PATH', None)
-            oauth_email_regex = provider_config.get('EMAIL_REGEX', None)
-        if not oauth_endpoint_path:
-            oauth_endpoint_path = request.app.config.OAUTH_ENDPOINT_PATH
-        if not oauth_email_regex:
-            oauth_email_regex = request.app.config.OAUTH_EMAIL_REGEX
+        provider_config = get_provider_config(request, provider, tenant_key)
+        oauth_endpoint_path = provider_config.endpoint_path or oauth_config.endpoint_path
+        oauth_email_regex = provider_config.email_regex
+        request.ctx.oauth_degraded = False
         # Do core oauth authentication once per session
         if 'token' not in request.ctx.session:
+            retry_after = provider_retry_after(request, provider, tenant_key)
+            if retry_after is not None:
+                return service_unavailable(retry_after)
             if provider:
                 request.ctx.session['oauth_provider'] = provider
+            if tenant_key is not None:
+                request.ctx.session['oauth_tenant'] = tenant_key
+            request.ctx.session['after_auth_redirect'] = request.path
+            return redirect(oauth_endpoint_path)
+
+        if not await _token_active(request, request.ctx.session['token']):
+            # token revoked, expired or user logged out on another node
+            _forget_session(request.ctx.session)
             request.ctx.session['after_auth_redirect'] = request.path
             return redirect(oauth_endpoint_path)
 
         # Shortcircuit out if we don't care about user info
-        if not add_user_info:
+        if not add_user_info and policy is None:
             return await async_handler(request, **kwargs)
 
         # Otherwise retrieve the user info once per session
-        user = await fetch_user_info(
+        user_info = fetch_user_info(
             request, provider, oauth_endpoint_path,
             email_regex or oauth_email_regex
         )
+        memberships: typing.Optional[typing.List[str]] = []
+        if policy is not None and policy.memberships:
+            # both are cached after the first request, so only login waits for the provider
+            try:
+                user, memberships = await asyncio.gather(user_info, fetch_memberships(request, provider, policy.ttl))
+            except (ProviderOverloaded, RateLimitExceeded, ProviderUnavailable, ClientError, asyncio.TimeoutError) as exc:
+                return service_unavailable(getattr(exc, 'retry_after', DEFAULT_RETRY_AFTER))
+        else:
+            user = await user_info
+        if isinstance(user, HTTPResponse):
+            return user
+        if policy is not None and not policy.allows(user, memberships):
+            get_events(request.app).event('login.denied', provider=provider, tenant=tenant_key, user_id=user.id)
+            return forbidden()
+        if not add_user_info:
+            return await async_handler(request, **kwargs)
         return await async_handler(request, user, **kwargs)
 
+    if policy is not None and policy.memberships and tenant is None:
+        # checked against provider settings at server start, see check_membership_policies
+        wrapped.oauth_membership_provider = provider
     return wrapped
 
 
+async def app_client(
+        sanic_app: Sanic, provider: str = None, scope: str = None,
+        tenant: str = None, priority: int = BACKGROUND):
+    """Return provider client authorized with shared application token (client credentials grant)."""
+    client = sanic_app.ctx.oauth_factory(provider=provider, priority=priority, tenant=tenant)
+    if isinstance(client, OAuth1Client):
+        raise OAuthConfigurationException(f"{type(client).__name__} is OAuth1 provider, it has no client credentials grant")
+    return await sanic_app.ctx.oauth_app_tokens.authorize(client, scope)
+
+
 @oauth_blueprint.listener('after_server_start')
 async def configuration_check(sanic_app: Sanic, _loop) -> None:
-    if not hasattr(sanic_app.ctx, 'async_session'):
+    if not hasattr(sanic_app.ctx, 'async_session') and not hasattr(sanic_app.ctx, 'oauth_transport'):
         raise OAuthConfigurationException("You should configure async_session with aiohttp.ClientSession")
     if not hasattr(sanic_app.ctx, 'session_interface'):
         raise OAuthConfigurationException("You should configure session_interface from sanic-session")
+    from .sharedmemory import SharedMemoryStore
+    if isinstance(getattr(sanic_app.ctx, 'oauth_store', None), SharedMemoryStore):
+        # evicted token would look like a logout
+        raise OAuthConfigurationException("SharedMemoryStore evicts entries, use it as NearCache(store, local=...) tier only")
 
 
-def setup_providers(  # pylint: disable=too-many-locals
-        providers_conf: typing.Dict, oauth_redirect_uri: str,
-        oauth_scope: str, oauth_endpoint_path: str) -> typing.Dict:
-    from .core import Client
+def configure_oauth(sanic_app: Sanic) -> OAuthConfig:
+    """Compile OAuth settings and register the oauth route.
 
-    providers = {}
-    for provider_name, provider_conf in providers_conf.items():
-        provider_conf.setdefault('AFTER_AUTH_DEFAULT_REDIRECT', '/')
-        p_class_link = provider_conf.pop('PROVIDER_CLASS', None)
-        if p_class_link is None:
-            raise OAuthConfigurationException("Provider config must have PROVIDER_CLASS set.")
-        redirect_uri = provider_conf.pop('REDIRECT_URI', oauth_redirect_uri)
-        if redirect_uri is None:
-            raise OAuthConfigurationException("Provider config must have REDIRECT_URI set when there is no global OAUTH_REDIRECT_URI set.")
-        scope = provider_conf.pop('SCOPE', oauth_scope)
-        if scope is None:
-            raise OAuthConfigurationException("Provider config must have SCOPE set when there is no global OAUTH_SCOPE set.")
-        endpoint_path = provider_conf.pop('ENDPOINT_PATH', oauth_endpoint_path)
-        p_module_path, p_class_name = p_class_link.rsplit('.', 1)
-        module_obj = importlib.import_module(p_module_path)
-        if module_obj is None:
-            raise OAuthConfigurationException(
-                f"Cannot find module {p_module_path} to import OAuth provider")
-        p_class = getattr(module_obj, p_class_name, None)
-        if p_class is None:
-            raise OAuthConfigurationException(
-                f"Cannot find class {p_class_name} in module {p_module_path}")
-        if not issubclass(p_class, Client):
-            raise OAuthConfigurationException(
-                f"Class must be a child of sanic_oauth.core.Client class")
-        provider_listing = {'provider_class': p_class}
-        provider_setting = {k.lower(): v for k, v in provider_conf.items()}
-        provider_listing['provider_setting'] = provider_setting
-        provider_conf['PROVIDER_CLASS'] = p_class_link
-        provider_conf['REDIRECT_URI'] = redirect_uri
-        provider_conf['SCOPE'] = scope
-        provider_conf['ENDPOINT_PATH'] = endpoint_path
-        providers[provider_name] = provider_listing
-    return providers
-
-
-def legacy_oauth_configuration(
-        sanic_app: Sanic, provider_class_link: str,
-        oauth_redirect_uri: str, oauth_scope: str):
-    from .core import Client
+    Call it while building the application, before the server starts: the
+    compiled snapshot is then shared by all workers forked from the main
+    process and the route exists before serving begins. Application config
+    itself is never modified.
+    """
+    oauth_config = getattr(sanic_app.ctx, 'oauth_config', None)
+    if oauth_config is None:
+        oauth_config = compile_oauth_config(sanic_app.config)
+        sanic_app.ctx.oauth_config = oauth_config
+        sanic_app.add_route(oauth, oauth_config.endpoint_path)
+    return oauth_config
 
-    client_setting = {
-        config_key[6:].lower(): sanic_app.config.get(config_key)
-        for config_key in sanic_app.config.keys() if config_key.startswith('OAUTH')
-    }
 
-    if provider_class_link is None:
-        raise OAuthConfigurationException("You should setup OAUTH_PROVIDER setting for app")
-    if oauth_redirect_uri is None:
-        raise OAuthConfigurationException("You should setup OAUTH_REDIRECT_URI setting for app")
-    if oauth_scope is None:
-        raise OAuthConfigurationException("You should setup OAUTH_SCOPE setting for app")
-    if provider_class_link:
-        provider_module_path, provider_class_name = provider_class_link.rsplit('.', 1)
-        module_object = importlib.import_module(provider_module_path)
-        if module_object is None:
-            raise OAuthConfigurationException(f"Cannot find module {provider_module_path} to import OAuth provider")
-        provider_class = getattr(module_object, provider_class_name, None)
-        if provider_class is None:
-            raise OAuthConfigurationException(f"Cannot find class {provider_class_name} in module {provider_module_path}")
-        if not issubclass(provider_class, Client):
-            raise OAuthConfigurationException("Class must be a child of sanic_oauth.core.Client class")
-    return client_setting, provider_class
+def check_membership_policies(sanic_app: Sanic, oauth_config: OAuthConfig) -> None:
+    """Reject routes with membership policy whose provider cannot report memberships."""
+    for route in getattr(getattr(sanic_app, 'router', None), 'routes', ()):
+        if hasattr(route.handler, 'oauth_membership_provider'):
+            provider_class = oauth_config.provider(route.handler.oauth_membership_provider).provider_class
+            if not provider_class.membership_url:
+                raise OAuthConfigurationException(
+                    f"{provider_class.__name__} does not report memberships, route {route.path} policy cannot check them"
+                )
 
 
 @oauth_blueprint.listener('after_server_start')
 async def create_oauth_factory(sanic_app: Sanic, _loop) -> None:
     from .core import Client
 
-    sanic_app.config.setdefault('OAUTH_AFTER_AUTH_DEFAULT_REDIRECT', '/')
-    oauth_redirect_uri: str = sanic_app.config.pop('OAUTH_REDIRECT_URI', None)
-    oauth_scope: str = sanic_app.config.pop('OAUTH_SCOPE', None)
-    oauth_endpoint_path: str = sanic_app.config.pop('OAUTH_ENDPOINT_PATH', '/oauth')
-    oauth_email_regex: str = sanic_app.config.pop('OAUTH_EMAIL_REGEX', None)
-    providers_conf = sanic_app.config.pop('OAUTH_PROVIDERS', {})
-    providers: typing.Optional[typing.Dict] = None
-    if providers_conf:
-        providers = setup_providers(
-            providers_conf, oauth_redirect_uri,
-            oauth_scope, oauth_endpoint_path
-        )
-        _, p_listing = next(iter(providers.items()))
-        provider_class = p_listing['provider_class']
-        client_setting = p_listing['provider_setting']
-    else:
-        provider_class_link: str = sanic_app.config.pop('OAUTH_PROVIDER', None)
-        client_setting, provider_class = legacy_oauth_configuration(
-            sanic_app, provider_class_link,
-            oauth_redirect_uri, oauth_scope
-        )
+    oauth_config = configure_oauth(sanic_app)
+    check_membership_policies(sanic_app, oauth_config)
+    runtimes = {
+        provider_conf.name: build_runtime(provider_conf.runtime_options)
+        for provider_conf in [*oauth_config.providers.values(), oauth_config.default]
+    }
 
-    def oauth_factory(access_token: str = None, provider=None) -> Client:
-        if provider is not None:
-            if providers is None:
-                raise OAuthConfigurationException("You can use provider mark only when multiple providers are configured")
-            provider_listing = providers[provider]
-            use_provider_class = provider_listing['provider_class']
-            use_client_setting = provider_listing['provider_setting']
+    pool_monitor = getattr(sanic_app.ctx, 'oauth_pool_monitor', None)
+    # transport replacing the aiohttp session for provider requests, e.g. InMemoryTransport in tests
+    session = getattr(sanic_app.ctx, 'oauth_transport', None) or sanic_app.ctx.async_session
+
+    def oauth_factory(  # pylint: disable=too-many-arguments
+            access_token: str = None, provider=None, priority: int = INTERACTIVE, tenant: str = None,
+            access_token_secret: str = None) -> Client:
+        if tenant is not None:
+            client = sanic_app.ctx.oauth_tenants.create_client(
+                session, tenant, provider,
+                access_token=access_token, priority=priority, access_token_secret=access_token_secret
+            )
         else:
-            use_provider_class = provider_class
-            use_client_setting = client_setting
-        result = use_provider_class(
-            sanic_app.ctx.async_session,
-            access_token=access_token,
-            **use_client_setting
-        )
-        return result
-
+            if provider is not None and not oauth_config.providers:
+                raise OAuthConfigurationException("You can use provider mark only when multiple providers are configured")
+            provider_conf = oauth_config.provider(provider)
+            client = provider_conf.create_client(
+                session, runtimes[provider_conf.name],
+                access_token=access_token, priority=priority, access_token_secret=access_token_secret
+            )
+        if pool_monitor is not None:
+            client.pool_monitor = pool_monitor
+        return client
+
+    events = getattr(sanic_app.ctx, 'oauth_events', None)
+    if events is not None:
+        events.start()
     sanic_app.ctx.oauth_factory = oauth_factory
-    sanic_app.config.OAUTH_REDIRECT_URI = oauth_redirect_uri
-    sanic_app.config.OAUTH_SCOPE = oauth_scope
-    sanic_app.config.OAUTH_ENDPOINT_PATH = oauth_endpoint_path
-    if providers_conf:
-        sanic_app.config.OAUTH_PROVIDERS = providers_conf
-
-    if oauth_email_regex:
-        sanic_app.config.OAUTH_EMAIL_REGEX = re.compile(oauth_email_regex)
-    else:
-        sanic_app.config.OAUTH_EMAIL_REGEX = None
-
-    sanic_app.add_route(oauth, oauth_endpoint_path)
+    store = getattr(sanic_app.ctx, 'oauth_store', None)
+    sanic_app.ctx.oauth_request_tokens = RequestTokenSecrets(store, ttl=oauth_config.request_token_ttl)
+    if store is None and getattr(getattr(sanic_app, 'state', None), 'workers', 1) > 1 and any(
+            issubclass(provider_conf.provider_class, OAuth1Client)
+            for provider_conf in [*oauth_config.providers.values(), oauth_config.default]):
+        _log.warning(
+            "OAuth1 request token secrets are kept per worker without app.ctx.oauth_store, "
+            "provider callbacks reaching another worker fail"
+        )
+    if oauth_config.request_token_pool:
+        sanic_app.ctx.oauth_request_token_pool = RequestTokenPool(
+            oauth_config.request_token_pool, oauth_config.request_token_ttl
+        )
+    revocations = getattr(sanic_app.ctx, 'oauth_revocations', None)
+    if revocations is not None:
+        if store is None:
+            # broadcast reaches running workers only, later ones find revoked tokens missing from the store
+            raise OAuthConfigurationException("You should configure app.ctx.oauth_store to use oauth_revocations")
+        await revocations.start()
+    sanic_app.ctx.oauth_app_tokens = AppTokenCache()
+    if pool_monitor is not None:
+        pool_monitor.start()
+
+    # warm-up opens pooled aiohttp connections, other transports have none to warm
+    warmup_session = session.session if isinstance(session, AiohttpTransport) else session
+    if oauth_config.warmup_connections and isinstance(warmup_session, ClientSession):
+        sanic_app.ctx.oauth_warmup = ProviderWarmup.for_providers(
+            warmup_session,
+            oauth_config.providers.values() or [oauth_config.default],
+            connections=oauth_config.warmup_connections, interval=oauth_config.warmup_interval
+        )
+        sanic_app.ctx.oauth_warmup.start()
+    elif oauth_config.warmup_connections:
+        _log.warning("OAUTH_WARMUP_CONNECTIONS is ignored, provider requests do not go through aiohttp.ClientSession")
+
+    if oauth_config.user_info_soft_ttl is not None:
+        sanic_app.ctx.oauth_revalidator = UserInfoRevalidator(
+            oauth_factory, store or MemoryStore(),
+            user_info_ttl=oauth_config.user_info_ttl
+        )
+        sanic_app.ctx.oauth_revalidator.start()
+
+    tenants = getattr(sanic_app.ctx, 'oauth_tenants', None)
+    if tenants is not None:
+        await tenants.reload()
+        tenants.start()
+
+
+@oauth_blueprint.listener('before_server_stop')
+async def stop_background_tasks(sanic_app: Sanic, _loop) -> None:
+    for name in (
+            'oauth_warmup', 'oauth_tenants', 'oauth_revalidator', 'oauth_app_tokens', 'oauth_pool_monitor',
+            'oauth_request_token_pool', 'oauth_events',
+    ):
+        task_owner = getattr(sanic_app.ctx, name, None)
+        if task_owner is not None:
+            await task_owner.stop()
+    store = getattr(sanic_app.ctx, 'oauth_store', None)
+    if store is not None:
+        await store.close()
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+import typing
+
+from .core import BACKGROUND, Client, RateLimitExceeded, UserInfo
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+BulkResult = typing.Tuple[str, typing.Union[UserInfo, Exception]]
+BulkCall = typing.Callable[[Client, str], typing.Awaitable[typing.Any]]
+
+
+async def _user_info(client: Client, _token: str) -> UserInfo:
+    user, _info = await client.user_info()
+    return user
+
+
+class _ProviderSlot:  # pylint: disable=too-few-public-methods
+
+    """Concurrency and rate-limit pause state of one provider during a bulk run."""
+
+    def __init__(self, concurrency: int) -> None:
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0.0
+
+    async def wait_resume(self) -> None:
+        delay = self.resume_at - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.resume_at - time.monotonic()
+
+    def pause(self, retry_after: float) -> None:
+        self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+
+
+async def _fetch(  # pylint: disable=too-many-arguments
+        oauth_factory: typing.Callable[..., Client], slot: _ProviderSlot,
+        provider: typing.Optional[str], token: str, max_retries: int, call: BulkCall) -> typing.Any:
+    factory_args = {'access_token': token}
+    if provider is not None:
+        factory_args['provider'] = provider
+    attempt = 0
+    while True:
+        async with slot.semaphore:
+            await slot.wait_resume()
+            try:
+                client = oauth_factory(**factory_args)
+                client.priority = BACKGROUND
+                return await call(client, token)
+            except RateLimitExceeded as exc:
+                slot.pause(exc.retry_after)
+                if attempt >= max_retries:
+                    return exc
+            except Exception as exc:  # pylint: disable=broad-except
+                return exc
+        attempt += 1
+        _log.debug("Provider %s rate limited, retry %s of %s", provider, attempt, max_retries)
+
+
+class _Worker:  # pylint: disable=too-few-public-methods
+
+    """Fetches one pair of a bulk run within its provider slot and queues the result."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, oauth_factory: typing.Callable[..., Client], results: asyncio.Queue,
+            concurrency: int, max_retries: int, call: BulkCall) -> None:
+        self.oauth_factory = oauth_factory
+        self.results = results
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.call = call
+        self.slots: typing.Dict[typing.Optional[str], _ProviderSlot] = {}
+
+    async def run(self, provider: typing.Optional[str], token: str) -> None:
+        slot = self.slots.get(provider)
+        if slot is None:
+            slot = self.slots[provider] = _ProviderSlot(self.concurrency)
+        await self.results.put((token, await _fetch(self.oauth_factory, slot, provider, token, self.max_retries, self.call)))
+
+
+async def bulk_user_info(
+        oauth_factory: typing.Callable[..., Client],
+        pairs: typing.AsyncIterable[typing.Tuple[typing.Optional[str], str]],
+        concurrency: int = 8, max_pending: int = 256,
+        max_retries: int = 3, call: BulkCall = _user_info) -> typing.AsyncIterator[BulkResult]:
+    """Fetch user information for many (provider, token) pairs.
+
+    Results are yielded as ``(token, UserInfo | exception)`` in completion order.
+    At most ``concurrency`` calls are in flight per provider and at most
+    ``max_pending`` pairs are read ahead from ``pairs``. A provider that answers
+    with rate-limit headers is paused for the announced time and the call retried.
+    Calls are made with background priority, so interactive logins win the quota.
+    All clients are built with ``oauth_factory`` so they share its connection pool.
+    ``call(client, token)`` replaces the default ``user_info`` call when given.
+    """
+    pending = asyncio.Semaphore(max_pending)
+    results: asyncio.Queue = asyncio.Queue()
+    worker = _Worker(oauth_factory, results, concurrency, max_retries, call)
+    tasks: typing.Set[asyncio.Task] = set()
+    done = object()
+
+    async def produce() -> None:
+        try:
+            async for provider, token in pairs:
+                await pending.acquire()
+                task = asyncio.ensure_future(worker.run(provider, token))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(set(tasks))
+        finally:
+            await results.put(done)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await results.get()
+            if item is done:
+                break
+            pending.release()
+            yield item
+        await producer
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
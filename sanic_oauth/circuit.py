@@ -0,0 +1,72 @@
+import time
+import typing
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+
+    """Availability state of one provider.
+
+    After ``failure_threshold`` consecutive failures (transport errors and
+    ``5xx`` answers) the circuit opens and calls fail fast for
+    ``reset_timeout`` seconds. Then a single probe call is let through: its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: typing.Optional[float] = None
+
+    @property
+    def available(self) -> bool:
+        """Whether provider is expected to answer, without taking the probe."""
+        return self.state == CLOSED or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    @property
+    def retry_after(self) -> float:
+        if self.state == CLOSED:
+            return 0.0
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 1.0)
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and (self.probe_started_at is None or now - self.probe_started_at >= self.reset_timeout):
+            # a probe that never reported back does not block the circuit forever
+            self.probe_started_at = now
+            return True
+        return False
+
+    def release(self) -> None:
+        """Give back the probe taken by ``allow`` for a call that was never sent."""
+        if self.state == HALF_OPEN:
+            self.probe_started_at = None
+
+    def record(self, success: bool) -> None:
+        self.probe_started_at = None
+        if success:
+            self.state, self.failures = CLOSED, 0
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state, self.opened_at = OPEN, time.monotonic()
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+import typing
+
+from .core import BACKGROUND, DEFAULT_RETRY_AFTER, INTERACTIVE, ProviderOverloaded
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+
+class ConcurrencyLimiter:  # pylint: disable=too-many-instance-attributes
+
+    """Adaptive (AIMD) limit of in-flight calls to one provider.
+
+    The limit grows by one per window of calls answered within ``tolerance``
+    times the best observed latency and shrinks by ``backoff`` when calls get
+    slower or fail. Callers above the limit wait in a queue of at most
+    ``max_queue`` entries for up to ``queue_timeout`` seconds; everybody else is
+    rejected with ``ProviderOverloaded`` right away.
+
+    Interactive calls are always served before queued background ones, and
+    background calls hold at most ``background_share`` of the limit, so the
+    remaining slots stay free for logins.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 100,
+            max_queue: int = 50, queue_timeout: float = 5.0,
+            tolerance: float = 2.0, backoff: float = 0.9, smoothing: float = 0.1,
+            background_share: float = 0.8) -> None:
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.background_share = background_share
+        self.in_flight = 0
+        self.background_in_flight = 0
+        self.min_latency: typing.Optional[float] = None
+        self.latency: typing.Optional[float] = None
+        self._waiters: typing.Dict[int, typing.Deque[asyncio.Future]] = {
+            INTERACTIVE: collections.deque(), BACKGROUND: collections.deque(),
+        }
+
+    @property
+    def retry_after(self) -> float:
+        """Estimated seconds until the queue drains."""
+        if self.latency is None:
+            return DEFAULT_RETRY_AFTER
+        queued = sum(len(waiters) for waiters in self._waiters.values())
+        return max(DEFAULT_RETRY_AFTER, self.latency * (queued + 1) / self.limit)
+
+    def _admits(self, priority: int) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        return priority == INTERACTIVE or self.background_in_flight < max(1, int(self.limit * self.background_share))
+
+    def _take(self, priority: int) -> None:
+        self.in_flight += 1
+        if priority != INTERACTIVE:
+            self.background_in_flight += 1
+
+    async def acquire(self, priority: int = INTERACTIVE) -> None:
+        """Take a slot for one call or raise ``ProviderOverloaded``."""
+        waiters = self._waiters[priority]
+        # interactive calls never queue behind background ones
+        queued = waiters or (priority != INTERACTIVE and self._waiters[INTERACTIVE])
+        if not queued and self._admits(priority):
+            self._take(priority)
+            return
+        if len(waiters) >= self.max_queue:
+            raise ProviderOverloaded(self.retry_after)
+        waiter = asyncio.get_event_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError as exc:
+            if waiter.done() and not waiter.cancelled():
+                return
+            waiter.cancel()
+            raise ProviderOverloaded(self.retry_after) from exc
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(priority=priority)
+            waiter.cancel()
+            raise
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+
+    def release(self, latency: float = None, success: bool = True, priority: int = INTERACTIVE) -> None:
+        """Return the slot and adapt the limit to the observed call latency."""
+        self.in_flight -= 1
+        if priority != INTERACTIVE:
+            self.background_in_flight -= 1
+        if latency is not None:
+            self._adapt(latency, success)
+        for waiting_priority in (INTERACTIVE, BACKGROUND):
+            waiters = self._waiters[waiting_priority]
+            while waiters and self._admits(waiting_priority):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self._take(waiting_priority)
+                    waiter.set_result(None)
+
+    def _adapt(self, latency: float, success: bool) -> None:
+        if success:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            else:
+                # let the baseline follow lasting latency shifts slowly
+                self.min_latency += (latency - self.min_latency) * self.smoothing / 10
+            self.latency = latency if self.latency is None else self.latency + (latency - self.latency) * self.smoothing
+        if success and latency <= self.min_latency * self.tolerance:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        else:
+            self.limit = max(float(self.min_limit), self.limit * self.backoff)
@@ -0,0 +1,221 @@
+from types import MappingProxyType
+import re
+import typing
+
+from .circuit import CircuitBreaker
+from .concurrency import ConcurrencyLimiter
+from .core import INTERACTIVE, Client, OAuth1Client, OAuth2Client, OAuthConfigurationException
+from .hedge import Hedger
+from .ratelimit import RateLimiter
+from .registry import resolve_provider_class
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+# settings that tune provider calls instead of being passed to provider constructor
+RUNTIME_OPTIONS = (
+    'RATE_LIMIT', 'RATE_LIMIT_BURST', 'MAX_CONCURRENCY', 'MAX_QUEUE', 'CIRCUIT_FAILURES', 'CIRCUIT_RESET',
+    'HEDGE_PERCENTILE', 'HEDGE_MAX_RATIO', 'BACKGROUND_SHARE',
+)
+# settings consumed by the blueprint itself
+BLUEPRINT_OPTIONS = (
+    'PROVIDER', 'PROVIDERS', 'PROVIDER_CLASS', 'REDIRECT_URI', 'SCOPE', 'ENDPOINT_PATH',
+    'EMAIL_REGEX', 'AFTER_AUTH_DEFAULT_REDIRECT', 'WARMUP_CONNECTIONS', 'WARMUP_INTERVAL',
+    'TOKEN_TTL', 'USER_INFO_TTL', 'USER_INFO_SOFT_TTL', 'USER_INFO_HARD_TTL', 'DEGRADED_GRACE',
+    'REQUEST_TOKEN_POOL', 'REQUEST_TOKEN_TTL',
+) + RUNTIME_OPTIONS
+
+
+class ProviderConfig(typing.NamedTuple):
+
+    """Validated settings of one provider."""
+
+    name: typing.Optional[str]
+    provider_class: typing.Type[Client]
+    settings: typing.Mapping[str, typing.Any]
+    redirect_uri: str
+    scope: str
+    endpoint_path: str
+    after_auth_default_redirect: str
+    email_regex: typing.Optional[typing.Pattern]
+    runtime_options: typing.Mapping[str, typing.Any]
+    # urlencoded authorize and token parameters, clients are built per request
+    queries: typing.Mapping[str, typing.Any] = MappingProxyType({})
+
+    def create_client(  # pylint: disable=too-many-arguments
+            self, session, runtime: typing.Mapping[str, typing.Any],
+            access_token: str = None, priority: int = INTERACTIVE, access_token_secret: str = None) -> Client:
+        """Build provider client bound to shared per-provider runtime objects."""
+        if issubclass(self.provider_class, OAuth1Client):
+            client = self.provider_class(
+                session, oauth_token=access_token, oauth_token_secret=access_token_secret, **self.settings
+            )
+        else:
+            client = self.provider_class(session, access_token=access_token, **self.settings)
+        for attr, value in [*runtime.items(), *self.queries.items()]:
+            setattr(client, attr, value)
+        client.priority = priority
+        return client
+
+
+class OAuthConfig(typing.NamedTuple):
+
+    """Frozen snapshot of all ``OAUTH_*`` settings of an application."""
+
+    providers: typing.Mapping[str, ProviderConfig]
+    default: ProviderConfig
+    endpoint_path: str
+    email_regex: typing.Optional[typing.Pattern]
+    warmup_connections: int
+    warmup_interval: typing.Optional[float]
+    token_ttl: float
+    user_info_ttl: float
+    user_info_soft_ttl: typing.Optional[float]
+    user_info_hard_ttl: typing.Optional[float]
+    degraded_grace: typing.Optional[float]
+    request_token_pool: int
+    request_token_ttl: float
+
+    def provider(self, name: typing.Optional[str]) -> ProviderConfig:
+        """Return provider settings by name, ``None`` means the default provider."""
+        if name is None:
+            return self.default
+        try:
+            return self.providers[name]
+        except KeyError as exc:
+            if name == 'default' and self.providers:
+                return self.default
+            raise OAuthConfigurationException(f"No provider named {name} configured") from exc
+
+
+def _compile_regex(pattern) -> typing.Optional[typing.Pattern]:
+    if not pattern:
+        return None
+    if isinstance(pattern, str):
+        return re.compile(pattern)
+    return pattern
+
+
+def compile_provider(  # pylint: disable=too-many-arguments
+        name: typing.Optional[str], provider_conf: typing.Mapping, redirect_uri: str = None,
+        scope: str = None, endpoint_path: str = '/oauth', after_auth_default_redirect: str = '/',
+        email_regex: typing.Pattern = None, runtime_defaults: typing.Mapping = None) -> ProviderConfig:
+    """Validate settings of one provider given without ``OAUTH_`` prefix."""
+    class_link = provider_conf.get('PROVIDER_CLASS')
+    if class_link is None:
+        raise OAuthConfigurationException("Provider config must have PROVIDER_CLASS set.")
+    redirect_uri = provider_conf.get('REDIRECT_URI', redirect_uri)
+    if redirect_uri is None:
+        raise OAuthConfigurationException("Provider config must have REDIRECT_URI set when there is no global OAUTH_REDIRECT_URI set.")
+    scope = provider_conf.get('SCOPE', scope)
+    if scope is None:
+        raise OAuthConfigurationException("Provider config must have SCOPE set when there is no global OAUTH_SCOPE set.")
+    runtime_options = {key: provider_conf.get(key, (runtime_defaults or {}).get(key)) for key in RUNTIME_OPTIONS}
+    provider_class = resolve_provider_class(class_link)
+    settings = MappingProxyType({
+        key.lower(): value for key, value in provider_conf.items() if key not in BLUEPRINT_OPTIONS
+    })
+    queries = {}
+    if issubclass(provider_class, OAuth2Client):
+        try:
+            queries = provider_class(None, **settings).prepared_queries(scope, redirect_uri)
+        except TypeError:
+            # e.g. client_id missing, building the client reports it on first use
+            pass
+    return ProviderConfig(
+        name=name,
+        provider_class=provider_class,
+        settings=settings,
+        redirect_uri=redirect_uri,
+        scope=scope,
+        endpoint_path=provider_conf.get('ENDPOINT_PATH', endpoint_path),
+        after_auth_default_redirect=provider_conf.get('AFTER_AUTH_DEFAULT_REDIRECT', after_auth_default_redirect),
+        email_regex=_compile_regex(provider_conf.get('EMAIL_REGEX')) or email_regex,
+        runtime_options=MappingProxyType(runtime_options),
+        queries=MappingProxyType(queries),
+    )
+
+
+def provider_defaults(config: typing.Mapping) -> typing.Dict[str, typing.Any]:
+    """Return global ``OAUTH_*`` settings as ``compile_provider`` keyword arguments."""
+    return {
+        'redirect_uri': config.get('OAUTH_REDIRECT_URI'),
+        'scope': config.get('OAUTH_SCOPE'),
+        'endpoint_path': config.get('OAUTH_ENDPOINT_PATH') or '/oauth',
+        'after_auth_default_redirect': config.get('OAUTH_AFTER_AUTH_DEFAULT_REDIRECT', '/'),
+        'email_regex': _compile_regex(config.get('OAUTH_EMAIL_REGEX')),
+        'runtime_defaults': {key: config.get(f'OAUTH_{key}') for key in RUNTIME_OPTIONS},
+    }
+
+
+def compile_oauth_config(config: typing.Mapping) -> OAuthConfig:
+    """Validate application ``OAUTH_*`` settings without modifying them."""
+    defaults = provider_defaults(config)
+    providers_conf = config.get('OAUTH_PROVIDERS') or {}
+    if providers_conf:
+        providers = {
+            name: compile_provider(name, provider_conf, **defaults)
+            for name, provider_conf in providers_conf.items()
+        }
+        default = providers.get('default', next(iter(providers.values())))
+    else:
+        providers = {}
+        if config.get('OAUTH_PROVIDER') is None:
+            raise OAuthConfigurationException("You should setup OAUTH_PROVIDER setting for app")
+        if defaults['redirect_uri'] is None:
+            raise OAuthConfigurationException("You should setup OAUTH_REDIRECT_URI setting for app")
+        if defaults['scope'] is None:
+            raise OAuthConfigurationException("You should setup OAUTH_SCOPE setting for app")
+        legacy_conf = {key[6:]: value for key, value in config.items() if key.startswith('OAUTH_')}
+        legacy_conf['PROVIDER_CLASS'] = config['OAUTH_PROVIDER']
+        default = compile_provider(None, legacy_conf, **defaults)
+    return OAuthConfig(
+        providers=MappingProxyType(providers),
+        default=default,
+        endpoint_path=defaults['endpoint_path'],
+        email_regex=defaults['email_regex'],
+        warmup_connections=config.get('OAUTH_WARMUP_CONNECTIONS') or 0,
+        warmup_interval=config.get('OAUTH_WARMUP_INTERVAL'),
+        token_ttl=config.get('OAUTH_TOKEN_TTL', 86400),
+        user_info_ttl=config.get('OAUTH_USER_INFO_TTL', 300),
+        user_info_soft_ttl=config.get('OAUTH_USER_INFO_SOFT_TTL'),
+        user_info_hard_ttl=config.get('OAUTH_USER_INFO_HARD_TTL'),
+        degraded_grace=config.get('OAUTH_DEGRADED_GRACE'),
+        request_token_pool=config.get('OAUTH_REQUEST_TOKEN_POOL') or 0,
+        request_token_ttl=config.get('OAUTH_REQUEST_TOKEN_TTL', 300),
+    )
+
+
+def build_runtime(options: typing.Mapping) -> typing.Dict:
+    """Create shared per-provider objects that are attached to every client."""
+    limiter_args = {}
+    if options.get('MAX_CONCURRENCY') is not None:
+        limiter_args['max_limit'] = options['MAX_CONCURRENCY']
+    if options.get('MAX_QUEUE') is not None:
+        limiter_args['max_queue'] = options['MAX_QUEUE']
+    rate_limiter_args = {}
+    if options.get('BACKGROUND_SHARE') is not None:
+        # background calls get this share of both connections and provider quota
+        limiter_args['background_share'] = options['BACKGROUND_SHARE']
+        rate_limiter_args['reserve'] = 1 - options['BACKGROUND_SHARE']
+    breaker_args = {}
+    if options.get('CIRCUIT_FAILURES') is not None:
+        breaker_args['failure_threshold'] = options['CIRCUIT_FAILURES']
+    if options.get('CIRCUIT_RESET') is not None:
+        breaker_args['reset_timeout'] = options['CIRCUIT_RESET']
+    hedger_args = {}
+    if options.get('HEDGE_MAX_RATIO') is not None:
+        hedger_args['max_ratio'] = options['HEDGE_MAX_RATIO']
+    return {
+        'rate_limiter': RateLimiter(options.get('RATE_LIMIT'), options.get('RATE_LIMIT_BURST'), **rate_limiter_args),
+        'concurrency_limiter': ConcurrencyLimiter(**limiter_args),
+        'circuit_breaker': CircuitBreaker(**breaker_args),
+        # hedging is opt-in: it trades extra provider load for shorter tail latency
+        'hedger': Hedger(options['HEDGE_PERCENTILE'], **hedger_args) if options.get('HEDGE_PERCENTILE') is not None else None,
+    }
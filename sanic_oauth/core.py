@@ -1,17 +1,23 @@
 import abc
+import asyncio
 import base64
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
 import logging
 from urllib.parse import urlencode, urljoin, quote, parse_qsl, urlsplit
 from hashlib import sha1
-from typing import Dict, Tuple
+from typing import AsyncIterator, Dict, List, Mapping, NamedTuple, Optional, Tuple
 import hmac
 import random
 import time
 
-from aiohttp import ClientResponse, ClientSession
-from aiohttp.web import HTTPBadRequest
+from aiohttp import ClientError, ClientResponse, ClientSession
+from aiohttp.web_exceptions import HTTPBadRequest
 import yarl
 
+from .events import redact
+from .transport import AiohttpTransport, Transport
+
 __author__ = "Bogdan Gladyshev"
 __copyright__ = "Copyright 2017, Bogdan Gladyshev"
 __credits__ = ["Bogdan Gladyshev"]
@@ -24,6 +30,150 @@ __status__ = "Production"
 
 _log = logging.getLogger(__name__)
 
+DEFAULT_RETRY_AFTER = 1.0
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+FORM_HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
+}
+
+_LIMIT_HEADERS = ('x-ratelimit-limit', 'x-rate-limit-limit', 'ratelimit-limit')
+_REMAINING_HEADERS = ('x-ratelimit-remaining', 'x-rate-limit-remaining', 'ratelimit-remaining')
+_RESET_HEADERS = ('x-ratelimit-reset', 'x-rate-limit-reset', 'ratelimit-reset')
+
+
+def _first_header(headers: Dict[str, str], names: Tuple[str, ...]) -> Optional[float]:
+    for name in names:
+        if name in headers:
+            try:
+                return float(headers[name])
+            except ValueError:
+                return None
+    return None
+
+
+def parse_rate_limit(headers: Mapping[str, str]) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """Return (limit, remaining, seconds until reset) announced by provider rate-limit headers."""
+    headers = {key.lower(): value for key, value in headers.items()}
+    limit = _first_header(headers, _LIMIT_HEADERS)
+    remaining = _first_header(headers, _REMAINING_HEADERS)
+    reset_after = _first_header(headers, ('x-ratelimit-reset-after',))
+    if reset_after is None:
+        reset = _first_header(headers, _RESET_HEADERS)
+        if reset is not None:
+            reset_after = reset - time.time()
+    if reset_after is not None:
+        reset_after = max(reset_after, 0.0)
+    return limit, remaining, reset_after
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Return seconds to wait before the next call according to provider rate-limit headers."""
+    retry_after = next((value for key, value in headers.items() if key.lower() == 'retry-after'), None)
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                return None
+    _limit, remaining, reset_after = parse_rate_limit(headers)
+    if remaining is None or remaining > 0:
+        return None
+    return reset_after
+
+
+def response_validators(headers: Mapping[str, str]) -> Dict[str, str]:
+    """Return cache validators (ETag, Last-Modified) sent with provider response."""
+    validators = {}
+    for name, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+        value = headers.get(header)
+        if value:
+            validators[name] = value
+    return validators
+
+
+def next_page_url(headers: Mapping[str, str]) -> Optional[str]:
+    """Return URL of the next page from ``Link`` header of paginated provider answer."""
+    for link in (headers.get('Link') or '').split(','):
+        target, _, params = link.partition(';')
+        if 'rel="next"' in params.replace(' ', ''):
+            return target.strip().strip('<>')
+    return None
+
+
+def conditional_headers(validators: Mapping[str, str]) -> Dict[str, str]:
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def encode_query(static: Dict, dynamic: Dict = None) -> str:
+    """Urlencode parameters, ``dynamic`` ones (e.g. ``state``, ``code``) last."""
+    query = urlencode(static)
+    if dynamic:
+        query = query + '&' + urlencode(dynamic) if query else urlencode(dynamic)
+    return query
+
+
+class PreparedQuery(NamedTuple):
+
+    """Query of parameters fixed by provider configuration, urlencoded once.
+
+    It stands for a call made with exactly ``arguments``, see
+    ``OAuth2Client.prepared_queries``.
+    """
+
+    arguments: Mapping[str, Optional[str]]
+    query: str
+
+    def extend(self, dynamic: Dict) -> str:
+        return self.query + '&' + urlencode(dynamic) if dynamic else self.query
+
+
+class RateLimitExceeded(HTTPBadRequest):
+
+    """Provider refused the call because the application quota is exhausted."""
+
+    def __init__(self, retry_after: float = DEFAULT_RETRY_AFTER, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.retry_after = retry_after
+
+
+class ProviderUnavailable(HTTPBadRequest):
+
+    """Provider is down: it answered with server error or its circuit is open."""
+
+    def __init__(self, retry_after: float = DEFAULT_RETRY_AFTER, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.retry_after = retry_after
+
+
+class TokenRejected(HTTPBadRequest):
+
+    """Provider answered that the access token is not valid (anymore)."""
+
+
+class OAuthConfigurationException(Exception):
+    pass
+
+
+class ProviderOverloaded(Exception):
+
+    """Call was rejected locally because too many calls to the provider are already waiting."""
+
+    def __init__(self, retry_after: float = DEFAULT_RETRY_AFTER) -> None:
+        super().__init__(f'Too many calls to provider in flight, retry after {retry_after:.1f}s')
+        self.retry_after = retry_after
+
 
 class UserInfo:  # pylint: disable=too-few-public-methods
 
@@ -104,13 +254,28 @@ class Client(abc.ABC):
     base_url: str = None
     name: str = None
     user_info_url: str = None
+    # additional profile endpoints merged into provider data by key, when user_info_extra_needed
+    user_info_extra_urls: Mapping[str, str] = {}
+    # groups / organizations of the user, checked by authorization policies
+    membership_url: str = None
+    # per-provider runtime state, attached by the blueprint oauth_factory
+    priority: int = INTERACTIVE
+    rate_limiter = None
+    concurrency_limiter = None
+    circuit_breaker = None
+    pool_monitor = None
+    hedger = None
 
     def __init__(
             self, aiohttp_session: ClientSession, base_url: str = None, authorize_url: str = None, access_token_key: str = None,
             access_token_url: str = None, user_info_url: str = None) -> None:
-        """Initialize the client."""
+        """Initialize the client.
+
+        ``aiohttp_session`` may also be ``Transport`` to send requests through.
+        """
         self.base_url = base_url or self.base_url
         self.aiohttp_session = aiohttp_session
+        self.transport = aiohttp_session if isinstance(aiohttp_session, Transport) else AiohttpTransport(aiohttp_session)
         self.authorize_url = authorize_url or self.authorize_url
         self.access_token_key = access_token_key or self.access_token_key
         self.access_token_url = access_token_url or self.access_token_url
@@ -136,19 +301,201 @@ class Client(abc.ABC):
             headers: Dict[str, str] = None, **aio_kwargs) -> ClientResponse:
         pass
 
+    async def _acquire_limits(self) -> None:
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(self.priority)
+            if self.concurrency_limiter is not None:
+                await self.concurrency_limiter.acquire(self.priority)
+        except BaseException:
+            # rejected or cancelled before sending, the half-open probe goes to the next call
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.release()
+            raise
+
+    async def _send(self, method: str, url: str, **aio_kwargs) -> ClientResponse:
+        """Send prepared request to provider through the client transport."""
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            raise ProviderUnavailable(breaker.retry_after, reason='Provider circuit is open')
+        await self._acquire_limits()
+        limiter = self.concurrency_limiter
+        try:
+            if limiter is None:
+                response = await self.transport.request(method, url, **aio_kwargs)
+            else:
+                started = time.monotonic()
+                try:
+                    response = await self.transport.request(method, url, **aio_kwargs)
+                except asyncio.CancelledError:
+                    # e.g. the losing hedged request, tells nothing about provider latency
+                    limiter.release(priority=self.priority)
+                    raise
+                except BaseException:
+                    limiter.release(time.monotonic() - started, False, self.priority)
+                    raise
+                limiter.release(time.monotonic() - started, response.status < 500, self.priority)
+        except (ClientError, asyncio.TimeoutError):
+            if breaker is not None:
+                breaker.record(False)
+            raise
+        if breaker is not None:
+            breaker.record(response.status < 500)
+        if self.pool_monitor is not None:
+            self.pool_monitor.acquired(response, method, url)
+        if self.rate_limiter is not None:
+            self.rate_limiter.update(response.headers)
+        return response
+
+    def _release(self, response: ClientResponse) -> None:
+        response.release()
+        if self.pool_monitor is not None:
+            self.pool_monitor.released(response)
+
+    @asynccontextmanager
+    async def managed_request(
+            self, method: str, url: str, hedged: bool = False, **kwargs) -> AsyncIterator[ClientResponse]:
+        """Make a request and give its connection back to the pool on every path.
+
+        ``hedged`` requests are sent through ``hedger`` when the provider has
+        one, use it only for idempotent requests.
+        """
+        if hedged and self.hedger is not None:
+            response = await self.hedger.run(lambda: self.request(method, url, **kwargs), self._release)
+        else:
+            response = await self.request(method, url, **kwargs)
+        try:
+            yield response
+        finally:
+            self._release(response)
+
     async def user_info(self, **kwargs) -> Tuple[UserInfo, Dict]:
         """Load user information from provider."""
-        if not self.user_info_url:
-            raise NotImplementedError('The provider doesnt support user_info method.')
+        user, data, _validators = await self.conditional_user_info(**kwargs)
+        return user, data
+
+    async def _user_info_part(
+            self, url: str, validators: Mapping[str, str],
+            **kwargs) -> Tuple[Optional[Dict], Dict[str, str]]:
+        """Load one profile endpoint, ``None`` data means not modified."""
+        validators = dict(validators)
+        headers = conditional_headers(validators)
+        if headers:
+            kwargs['headers'] = dict(kwargs.get('headers') or {'Accept': 'application/json'}, **headers)
+        async with self.managed_request('GET', url, hedged=True, **kwargs) as response:
+            if response.status == 304:
+                validators.update(response_validators(response.headers))
+                return None, validators
+            self._check_part_status(response)
+            return await response.json(), response_validators(response.headers)
 
-        response: ClientResponse = await self.request('GET', self.user_info_url, **kwargs)
+    @staticmethod
+    def _check_part_status(response: ClientResponse) -> None:
         if response.status != 200:
+            retry_after = parse_retry_after(response.headers)
+            if response.status == 429 or (response.status == 403 and retry_after is not None):
+                raise RateLimitExceeded(
+                    retry_after if retry_after is not None else DEFAULT_RETRY_AFTER,
+                    reason=f'Provider rate limit exceeded. HTTP status code: {response.status}'
+                )
+            if response.status >= 500:
+                raise ProviderUnavailable(
+                    retry_after if retry_after is not None else DEFAULT_RETRY_AFTER,
+                    reason=f'Provider is unavailable. HTTP status code: {response.status}'
+                )
+            if response.status == 401:
+                raise TokenRejected(reason='Provider rejected the access token. HTTP status code: 401')
             raise HTTPBadRequest(
                 reason=f'Failed to obtain User information. HTTP status code: {response.status}'
             )
-        data = await response.json()
+
+    async def _user_info_extra(self, key: str, validators: Mapping[str, str]) -> Tuple[Optional[Dict], Dict[str, str]]:
+        try:
+            return await self._user_info_part(self.user_info_extra_urls[key], validators)
+        except (RateLimitExceeded, ProviderUnavailable, TokenRejected):
+            raise
+        except HTTPBadRequest as exc:
+            # e.g. scope needed for this endpoint was not granted
+            _log.debug("Optional user info endpoint %s failed: %s", key, exc.reason)
+            return {}, {}
+
+    @classmethod
+    def user_info_extra_needed(cls, key: str, data: Dict) -> bool:  # pylint: disable=unused-argument
+        """Check if profile ``data`` needs the answer of endpoint ``key`` of ``user_info_extra_urls``."""
+        return True
+
+    def _speculative_extras(self, validators: Mapping, extra_validators: Mapping) -> List[str]:
+        if validators or extra_validators:
+            # the previous answer tells which endpoints the profile needs
+            return [key for key in self.user_info_extra_urls if key in extra_validators]
+        # nothing is known yet, a login waits for the slower request instead of both in turn
+        return list(self.user_info_extra_urls) if self.priority == INTERACTIVE else []
+
+    @classmethod
+    def membership_parse(cls, data) -> List[str]:  # pylint: disable=unused-argument
+        """Parse group names from membership endpoint answer, providers with ``membership_url`` override it."""
+        return []
+
+    async def memberships(self, max_pages: int = 50) -> List[str]:
+        """Load names of groups / organizations the user belongs to, following ``Link`` pagination."""
+        if not self.membership_url:
+            raise NotImplementedError('The provider doesnt support memberships.')
+        data, url = [], self.membership_url
+        for _page in range(max_pages):
+            async with self.managed_request('GET', url, hedged=True) as response:
+                self._check_part_status(response)
+                data.extend(await response.json() or [])
+                url = next_page_url(response.headers)
+            if url is None:
+                break
+        return self.membership_parse(data)
+
+    async def conditional_user_info(
+            self, validators: Mapping = None,
+            **kwargs) -> Tuple[Optional[UserInfo], Optional[Dict], Dict]:
+        """Load user information unless it is unchanged since ``validators`` were received.
+
+        Endpoints from ``user_info_extra_urls`` complement the profile: when
+        ``user_info_extra_needed`` their answers are merged into provider data under
+        their keys before ``user_parse``. They are requested concurrently with
+        ``user_info_url`` when the previous answer needed them or on an interactive
+        first load, otherwise only once the profile shows they are needed.
+        A profile that is not modified keeps the stored extras.
+        :returns: (user, provider_data, validators), user and data are ``None`` when not modified
+        """
+        if not self.user_info_url:
+            raise NotImplementedError('The provider doesnt support user_info method.')
+
+        validators = dict(validators or {})
+        extra_validators = validators.pop('extra', {})
+        speculative = {}
+        for key in self._speculative_extras(validators, extra_validators):
+            task = speculative[key] = asyncio.ensure_future(self._user_info_extra(key, extra_validators.get(key, {})))
+            # answers of requests the profile turns out not to need are dropped
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        try:
+            data, validators = await self._user_info_part(self.user_info_url, validators, **kwargs)
+            if data is None:
+                if extra_validators:
+                    validators['extra'] = extra_validators
+                return None, None, validators
+            extras = {}
+            for key in self.user_info_extra_urls:
+                if not self.user_info_extra_needed(key, data):
+                    continue
+                task = speculative.pop(key, None)
+                part = await task if task is not None else (None, {})
+                if part[0] is None:
+                    # unchanged since the previous answer, the full one is needed to parse the profile
+                    part = await self._user_info_extra(key, {})
+                data[key], extras[key] = part
+            if extras:
+                validators['extra'] = extras
+        finally:
+            for task in speculative.values():
+                task.cancel()
         user = self.user_parse(data)
-        return user, data
+        return user, data, validators
 
     @classmethod
     @abc.abstractmethod
@@ -187,8 +534,8 @@ class OAuth1Client(Client):  # pylint: disable=abstract-method
 
     def get_authorize_url(self, request_token: str = None, **params) -> str:
         """Return formatted authorization URL."""
-        params.update({'oauth_token': request_token or self.oauth_token})
-        return self.authorize_url + '?' + urlencode(params)
+        params.pop('oauth_token', None)
+        return self.authorize_url + '?' + encode_query(params, {'oauth_token': request_token or self.oauth_token})
 
     async def request(
             self, method: str, url: str, params: Dict[str, str] = None,
@@ -214,18 +561,17 @@ class OAuth1Client(Client):  # pylint: disable=abstract-method
         oparams['oauth_signature'] = self.signature.sign(
             self.consumer_secret, method, url,
             oauth_token_secret=self.oauth_token_secret, **oparams)
-        _log.debug("%s %s", url, oparams)
-        return await self.aiohttp_session.request(
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("%s %s", url, redact(oparams))
+        return await self._send(
             method, url, params=oparams, headers=headers, **aio_kwargs
         )
 
     async def get_request_token(self, **params) -> Tuple[str, str, Dict]:
         """Get a request_token and request_token_secret from OAuth1 provider."""
         params = dict(self.params, **params)
-        response = await self.request('GET', self.request_token_url, params=params)
-
-        data = await response.text()
-        response.close()
+        async with self.managed_request('GET', self.request_token_url, params=params) as response:
+            data = await response.text()
 
         if response.status != 200:
             raise HTTPBadRequest(
@@ -253,20 +599,14 @@ class OAuth1Client(Client):  # pylint: disable=abstract-method
                 reason='Failed to obtain OAuth 1.0 access token. Request token is invalid'
             )
 
-        response = await self.request(
-            'POST',
-            self.access_token_url,
-            params={'oauth_verifier': oauth_verifier, 'oauth_token': request_token}
-        )
-        if response.status != 200:
-            raise HTTPBadRequest(
-                reason=f'Failed to obtain OAuth 1.0 access token. HTTP status code: {response.status}'
-            )
-
-        data = await response.text()
-        data = dict(parse_qsl(data))
-
-        response.close()
+        async with self.managed_request(
+                'POST', self.access_token_url,
+                params={'oauth_verifier': oauth_verifier, 'oauth_token': request_token}) as response:
+            if response.status != 200:
+                raise HTTPBadRequest(
+                    reason=f'Failed to obtain OAuth 1.0 access token. HTTP status code: {response.status}'
+                )
+            data = dict(parse_qsl(await response.text()))
 
         self.oauth_token = data.get('oauth_token')
         self.oauth_token_secret = data.get('oauth_token_secret')
@@ -279,6 +619,11 @@ class OAuth2Client(Client):  # pylint: disable=abstract-method
 
     name = 'oauth2'
     shared_key = 'code'
+    # authorize parameters that change on every redirect
+    dynamic_authorize_params: Tuple[str, ...] = ('state',)
+    # parameters fixed by provider configuration, encoded once by ProviderConfig, see prepared_queries
+    authorize_query: Optional[PreparedQuery] = None
+    token_query: Optional[PreparedQuery] = None
 
     def __init__(
             self, aiohttp_session: ClientSession, client_id: str,
@@ -296,11 +641,38 @@ class OAuth2Client(Client):  # pylint: disable=abstract-method
         self.client_secret = client_secret
         self.params = params
 
-    def get_authorize_url(self, **params) -> str:
-        """Return formatted authorize URL."""
+    def _authorize_params(self, params: Mapping) -> Dict:
         params = dict(self.params, **params)
         params.update({'client_id': self.client_id, 'response_type': 'code'})
-        return self.authorize_url + '?' + urlencode(params)
+        return params
+
+    def _token_payload(self, redirect_uri: Optional[str], payload: Dict) -> Dict:
+        payload.setdefault('grant_type', 'authorization_code')
+        payload.update({
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+        })
+        if redirect_uri:
+            payload['redirect_uri'] = redirect_uri
+        return payload
+
+    def prepared_queries(self, scope: str, redirect_uri: str) -> Dict[str, PreparedQuery]:
+        """Encode authorize and token parameters that provider configuration fixes, keyed by client attribute."""
+        arguments = {'scope': scope, 'redirect_uri': redirect_uri}
+        token_redirect_uri = redirect_uri or self.params.get('redirect_uri')
+        return {
+            'authorize_query': PreparedQuery(arguments, encode_query(self._authorize_params(arguments))),
+            'token_query': PreparedQuery(
+                {'redirect_uri': token_redirect_uri}, encode_query(self._token_payload(token_redirect_uri, {}))
+            ),
+        }
+
+    def get_authorize_url(self, **params) -> str:
+        """Return formatted authorize URL."""
+        dynamic = {key: params.pop(key) for key in self.dynamic_authorize_params if key in params}
+        if self.authorize_query is not None and params == self.authorize_query.arguments:
+            return self.authorize_url + '?' + self.authorize_query.extend(dynamic)
+        return self.authorize_url + '?' + encode_query(self._authorize_params(params), dynamic)
 
     async def request(
             self, method: str, url: str,
@@ -312,11 +684,8 @@ class OAuth2Client(Client):  # pylint: disable=abstract-method
         if self.access_token:
             params[self.access_token_key] = self.access_token
 
-        headers = headers or {
-            'Accept': 'application/json',
-            'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
-        }
-        return await self.aiohttp_session.request(
+        headers = headers or dict(FORM_HEADERS)
+        return await self._send(
             method, url, params=params, headers=headers, **aio_kwargs
         )
 
@@ -327,29 +696,42 @@ class OAuth2Client(Client):  # pylint: disable=abstract-method
         # Possibility to provide REQUEST DATA to the method
         if not isinstance(code, str) and self.shared_key in code:
             code = code[self.shared_key]
-        payload.setdefault('grant_type', 'authorization_code')
+        redirect_uri = redirect_uri or self.params.get('redirect_uri')
+        if not payload and self.token_query is not None and self.token_query.arguments == {'redirect_uri': redirect_uri}:
+            body = self.token_query.extend({'code': code})
+        else:
+            body = encode_query(self._token_payload(redirect_uri, payload), {'code': code})
+
+        data = await self._request_token(body)
+        self.access_token = data['access_token']
+        return self.access_token, data
+
+    async def get_client_credentials_token(self, scope: str = None, **payload) -> Tuple[str, Dict]:
+        """Get an application access_token with client credentials grant.
+        :returns: (access_token, provider_data)
+        """
+        payload.setdefault('grant_type', 'client_credentials')
         payload.update({
             'client_id': self.client_id,
             'client_secret': self.client_secret,
-            'code': code,
         })
-
-        redirect_uri = redirect_uri or self.params.get('redirect_uri')
-        if redirect_uri:
-            payload['redirect_uri'] = redirect_uri
-
-        response = await self.request('POST', self.access_token_url, data=payload)
-        if 'json' in response.headers.get('CONTENT-TYPE'):
-            data = await response.json()
-
-        else:
-            data = await response.text()
-            data = dict(parse_qsl(data))
-        try:
-            self.access_token = data['access_token']
-        except KeyError:
+        if scope:
+            payload['scope'] = scope
+        data = await self._request_token(encode_query(payload))
+        return data['access_token'], data
+
+    async def _request_token(self, body: str) -> Dict:
+        async with self.managed_request(
+                'POST', self.access_token_url, data=body, headers=dict(FORM_HEADERS)) as response:
+            if response.status >= 500:
+                raise ProviderUnavailable(
+                    parse_retry_after(response.headers) or DEFAULT_RETRY_AFTER,
+                    reason=f'Provider is unavailable. HTTP status code: {response.status}'
+                )
+            if 'json' in response.headers.get('CONTENT-TYPE', ''):
+                data = await response.json()
+            else:
+                data = dict(parse_qsl(await response.text()))
+        if 'access_token' not in data:
             raise HTTPBadRequest(reason='Failed to obtain OAuth access token.')
-        finally:
-            response.close()
-
-        return self.access_token, data
+        return data
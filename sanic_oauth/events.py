@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import random
+import typing
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+SECRET_FIELDS = frozenset({
+    'access_token', 'access_token_secret', 'client_secret', 'code', 'consumer_secret', 'oauth_signature',
+    'oauth_token', 'oauth_token_secret', 'oauth_verifier', 'password', 'refresh_token', 'token',
+})
+
+
+def fingerprint(secret: typing.Any) -> str:
+    """Return short hash that correlates log lines of one secret without revealing it."""
+    return 'sha256:' + hashlib.sha256(str(secret).encode()).hexdigest()[:12]
+
+
+def redact(fields: typing.Mapping[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Return copy of ``fields`` with values of ``SECRET_FIELDS`` replaced by their fingerprints."""
+    return {
+        name: fingerprint(value) if name in SECRET_FIELDS and value is not None else value
+        for name, value in fields.items()
+    }
+
+
+class EventFields(dict):
+
+    """Fields of one auth event, rendered as ``name=value`` pairs only when a handler formats the record."""
+
+    def __str__(self) -> str:
+        return ' '.join(f'{name}={value}' for name, value in self.items())
+
+
+class _DeferredQueueHandler(QueueHandler):
+
+    # records stay in this process, so formatting is left to the listener thread
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class AuthEventLogger:
+
+    """Structured events of the auth flow (logins, logouts, revocations, user info fetches).
+
+    Events are logged to ``sanic_oauth.events`` with fields in the
+    ``auth_event`` record attribute; secret fields are redacted and the
+    level is checked before anything is built. ``sample_rates`` maps event
+    names to the share of them that is logged, for high-volume events.
+
+    When ``handlers`` are given, ``start`` routes all ``sanic_oauth``
+    records through a queue to a thread that formats and writes them with
+    these handlers, so the event loop never waits for their I/O. Records
+    still propagate to the application's own handlers unless ``exclusive``
+    is set; levels are left to the application's logging configuration.
+    """
+
+    def __init__(
+            self, *handlers: logging.Handler, sample_rates: typing.Mapping[str, float] = None,
+            logger: logging.Logger = None, exclusive: bool = False) -> None:
+        self.handlers = handlers
+        self.exclusive = exclusive
+        self.sample_rates = dict(sample_rates or {})
+        self.logger = logger or logging.getLogger('sanic_oauth.events')
+        self._listener: typing.Optional[QueueListener] = None
+        self._queue_handler: typing.Optional[QueueHandler] = None
+
+    def event(self, name: str, level: int = logging.INFO, **fields) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = self.sample_rates.get(name)
+        if rate is not None and random.random() >= rate:
+            return
+        fields = EventFields(redact(fields))
+        self.logger.log(level, "%s %s", name, fields, extra={'auth_event': {'event': name, **fields}})
+
+    def start(self) -> None:
+        if not self.handlers or self._listener is not None:
+            return
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        self._listener = QueueListener(records, *self.handlers, respect_handler_level=True)
+        self._queue_handler = _DeferredQueueHandler(records)
+        package_logger = logging.getLogger('sanic_oauth')
+        package_logger.addHandler(self._queue_handler)
+        if self.exclusive:
+            package_logger.propagate = False
+        self._listener.start()
+
+    async def stop(self) -> None:
+        if self._listener is None:
+            return
+        package_logger = logging.getLogger('sanic_oauth')
+        package_logger.removeHandler(self._queue_handler)
+        if self.exclusive:
+            package_logger.propagate = True
+        listener, self._listener, self._queue_handler = self._listener, None, None
+        # writes what is still queued and joins the thread, off the event loop
+        await asyncio.get_event_loop().run_in_executor(None, listener.stop)
+
+
+DEFAULT_EVENTS = AuthEventLogger()
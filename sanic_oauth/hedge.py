@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import time
+import typing
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+Response = typing.TypeVar('Response')
+
+
+class Hedger:  # pylint: disable=too-many-instance-attributes
+
+    """Hedged sending of idempotent requests to one provider.
+
+    When a request has not answered after the ``percentile`` of recently
+    observed latencies, the same request is sent once more; the first answer
+    wins and the other request is cancelled. Hedges are paid from a budget
+    that every request refills by ``max_ratio`` up to ``burst`` hedges, so
+    over any run of requests provider load grows by at most that fraction
+    plus ``burst``, however long the provider was healthy before.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, percentile: float = 0.95, max_ratio: float = 0.05, window: int = 1000,
+            min_samples: int = 20, min_delay: float = 0.005, burst: float = 10.0) -> None:
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.burst = burst
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._budget = 0.0
+        self._latencies: typing.Deque[float] = collections.deque(maxlen=window)
+        self._delay: typing.Optional[float] = None
+        self._stale = 0
+
+    def record(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._stale += 1
+
+    @property
+    def delay(self) -> typing.Optional[float]:
+        """Seconds to wait before hedging, ``None`` until enough latencies are observed."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        # sorting the window on every request would cost more than the tail it saves
+        if self._delay is None or self._stale >= max(self.min_samples, len(self._latencies) // 10):
+            latencies = sorted(self._latencies)
+            index = min(int(len(latencies) * self.percentile), len(latencies) - 1)
+            self._delay, self._stale = max(latencies[index], self.min_delay), 0
+        return self._delay
+
+    def _take_hedge(self) -> bool:
+        if self._budget < 1:
+            return False
+        self._budget -= 1
+        self.hedged += 1
+        return True
+
+    async def run(
+            self, send: typing.Callable[[], typing.Awaitable[Response]],
+            discard: typing.Callable[[Response], None]) -> Response:
+        """Return the first answer of ``send()``, ``discard`` receives the answer that lost."""
+        self.requests += 1
+        self._budget = min(self._budget + self.max_ratio, max(self.burst, 1.0))
+        delay = self.delay
+        started = time.monotonic()
+        if delay is None:
+            response = await send()
+            self.record(time.monotonic() - started)
+            return response
+        first = asyncio.ensure_future(send())
+        try:
+            done, _pending = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done or not self._take_hedge():
+            response = await first
+            self.record(time.monotonic() - started)
+            return response
+        hedge_started = time.monotonic()
+        second = asyncio.ensure_future(send())
+        winner = await _race(first, second, discard)
+        if winner is None:
+            return first.result()
+        if winner is second:
+            self.hedge_wins += 1
+            self.record(time.monotonic() - hedge_started)
+        else:
+            self.record(time.monotonic() - started)
+        return winner.result()
+
+
+async def _race(first: asyncio.Task, second: asyncio.Task, discard: typing.Callable) -> typing.Optional[asyncio.Task]:
+    """Return the first of both tasks that answered without error, ``None`` when both failed."""
+    pending = {first, second}
+    winner = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                if winner is None:
+                    winner = task
+                else:
+                    discard(task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+            task.add_done_callback(lambda task: _discard_result(task, discard))
+    return winner
+
+
+def _discard_result(task: asyncio.Task, discard: typing.Callable) -> None:
+    # the losing request may have been answered before it was cancelled
+    if not task.cancelled() and task.exception() is None:
+        discard(task.result())
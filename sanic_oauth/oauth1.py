@@ -0,0 +1,104 @@
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+from aiohttp import ClientError
+from aiohttp.web_exceptions import HTTPBadRequest
+
+from .core import BACKGROUND, INTERACTIVE, OAuth1Client, ProviderOverloaded
+from .store import AuthStateStore, LocalCache, token_key
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+PoolKey = typing.Tuple[typing.Optional[str], typing.Optional[str]]
+# builds provider client with given priority
+ClientFactory = typing.Callable[[int], OAuth1Client]
+
+
+class RequestTokenSecrets:
+
+    """Secrets of issued OAuth1 request tokens until the provider redirects back.
+
+    Kept in shared ``store`` when given, so the callback may reach any
+    worker, otherwise in a local cache of at most ``max_size`` entries.
+    Secrets expire after ``ttl`` seconds and can be taken only once.
+    """
+
+    def __init__(self, store: AuthStateStore = None, ttl: float = 600.0, max_size: int = 10000) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.local = LocalCache(max_size)
+
+    async def put(self, request_token: str, secret: str) -> None:
+        if self.store is not None:
+            await self.store.set(token_key('request_token', request_token), secret, ttl=self.ttl)
+        else:
+            self.local.put(request_token, secret, self.ttl)
+
+    async def pop(self, request_token: str) -> typing.Optional[str]:
+        if self.store is not None:
+            return await self.store.pop(token_key('request_token', request_token))
+        _found, secret = self.local.lookup(request_token)
+        self.local.discard(request_token)
+        return secret
+
+
+class RequestTokenPool:
+
+    """Request tokens fetched ahead of logins, per provider and tenant.
+
+    Logins take a ready token instead of waiting for the request token round
+    trip; taking one starts a background refill up to ``size`` tokens.
+    Tokens older than ``ttl`` seconds are dropped, providers expire them.
+    """
+
+    def __init__(self, size: int = 10, ttl: float = 300.0) -> None:
+        self.size = size
+        self.ttl = ttl
+        self._tokens: typing.Dict[PoolKey, typing.Deque[typing.Tuple[str, str, float]]] = {}
+        self._refills: typing.Dict[PoolKey, asyncio.Task] = {}
+
+    async def take(
+            self, key: PoolKey, client_factory: ClientFactory,
+            callback: str) -> typing.Tuple[str, str]:
+        """Return request token and its secret, fetched now when the pool is empty."""
+        tokens = self._tokens.setdefault(key, collections.deque())
+        now = time.monotonic()
+        while tokens and tokens[0][2] <= now:
+            tokens.popleft()
+        ready = tokens.popleft() if tokens else None
+        self._refill(key, client_factory, callback)
+        if ready is not None:
+            return ready[0], ready[1]
+        request_token, secret, _data = await client_factory(INTERACTIVE).get_request_token(oauth_callback=callback)
+        return request_token, secret
+
+    def _refill(self, key: PoolKey, client_factory: ClientFactory, callback: str) -> None:
+        if key not in self._refills and len(self._tokens[key]) < self.size:
+            self._refills[key] = asyncio.ensure_future(self._fill(key, client_factory, callback))
+
+    async def _fill(self, key: PoolKey, client_factory: ClientFactory, callback: str) -> None:
+        tokens = self._tokens[key]
+        try:
+            while len(tokens) < self.size:
+                request_token, secret, _data = await client_factory(BACKGROUND).get_request_token(oauth_callback=callback)
+                tokens.append((request_token, secret, time.monotonic() + self.ttl))
+        except (ProviderOverloaded, HTTPBadRequest, ClientError, asyncio.TimeoutError) as exc:
+            _log.warning("Failed to prefetch OAuth1 request tokens: %s", exc)
+        finally:
+            del self._refills[key]
+
+    async def stop(self) -> None:
+        for task in list(self._refills.values()):
+            task.cancel()
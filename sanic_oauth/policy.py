@@ -0,0 +1,56 @@
+import re
+import typing
+
+from .core import UserInfo
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+
+class Policy:
+
+    """Authorization rules for ``login_required``, compiled once.
+
+    ``emails`` and ``domains`` form one allowlist: the user passes with a
+    listed address or an address in a listed domain. Every other configured
+    rule must pass as well: ``email_regex``, Google Workspace
+    ``hosted_domains`` and ``memberships`` (GitHub organizations, GitLab
+    groups), of which the user needs at least one. Memberships are loaded
+    from the provider and cached for ``ttl`` seconds.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, emails: typing.Iterable[str] = (), domains: typing.Iterable[str] = (),
+            email_regex: typing.Union[str, typing.Pattern] = None, hosted_domains: typing.Iterable[str] = (),
+            memberships: typing.Iterable[str] = (), ttl: float = 300.0) -> None:
+        self.emails = frozenset(email.lower() for email in emails)
+        self.domains = frozenset(domain.lower() for domain in domains)
+        self.email_regex = re.compile(email_regex) if isinstance(email_regex, str) else email_regex
+        self.hosted_domains = frozenset(domain.lower() for domain in hosted_domains)
+        self.memberships = frozenset(memberships)
+        self.ttl = ttl
+
+    @classmethod
+    def compile(cls, policy: typing.Union['Policy', typing.Mapping, None]) -> typing.Optional['Policy']:
+        """Accept ready policy or its keyword arguments."""
+        if policy is None or isinstance(policy, Policy):
+            return policy
+        return cls(**policy)
+
+    def allows(self, user: UserInfo, memberships: typing.Iterable[str] = ()) -> bool:
+        email = (user.email or '').lower()
+        if (self.emails or self.domains) and email not in self.emails and email.rpartition('@')[2] not in self.domains:
+            return False
+        if self.email_regex and not self.email_regex.match(user.email or ''):
+            return False
+        if self.hosted_domains and (getattr(user, 'hosted_domain', None) or '').lower() not in self.hosted_domains:
+            return False
+        if self.memberships and self.memberships.isdisjoint(memberships or ()):
+            return False
+        return True
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+import typing
+import weakref
+
+from aiohttp import ClientResponse, TraceConfig
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+
+class PoolMonitor:
+
+    """Connection reuse statistics and detection of responses holding pooled connections.
+
+    Pass ``trace_config()`` to ``aiohttp.ClientSession`` to count new and
+    reused connections. Responses received by provider clients are tracked
+    until released: ones held longer than ``hold_threshold`` seconds are
+    reported by ``check`` and ones garbage collected without release are
+    counted as leaked.
+    """
+
+    def __init__(self, hold_threshold: float = 10.0, interval: float = None) -> None:
+        self.hold_threshold = hold_threshold
+        self.interval = interval
+        self.created = 0
+        self.reused = 0
+        self.leaked = 0
+        self._held: typing.Dict[int, typing.Tuple[float, str]] = {}
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_create)
+        trace_config.on_connection_reuseconn.append(self._on_reuse)
+        return trace_config
+
+    async def _on_create(self, _session, _context, _params) -> None:
+        self.created += 1
+
+    async def _on_reuse(self, _session, _context, _params) -> None:
+        self.reused += 1
+
+    def acquired(self, response: ClientResponse, method: str, url: str) -> None:
+        key = id(response)
+        self._held[key] = (time.monotonic(), f'{method} {url}')
+        weakref.finalize(response, self._collected, key)
+
+    def released(self, response: ClientResponse) -> None:
+        self._held.pop(id(response), None)
+
+    def _collected(self, key: int) -> None:
+        entry = self._held.pop(key, None)
+        if entry is not None:
+            self.leaked += 1
+            _log.warning("Response of %s was garbage collected without release", entry[1])
+
+    def long_held(self) -> typing.List[typing.Tuple[str, float]]:
+        """Return requests whose responses hold connection longer than threshold."""
+        now = time.monotonic()
+        return [
+            (request, now - acquired_at) for acquired_at, request in self._held.values()
+            if now - acquired_at >= self.hold_threshold
+        ]
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        opened = self.created + self.reused
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'reuse_ratio': self.reused / opened if opened else None,
+            'held': len(self._held),
+            'leaked': self.leaked,
+        }
+
+    def check(self) -> None:
+        for request, held_for in self.long_held():
+            _log.warning("Response of %s holds pooled connection for %.1fs", request, held_for)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    def start(self) -> None:
+        if self.interval and self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,8 +1,8 @@
-from typing import Dict, Tuple
+from typing import Dict, List, Mapping, Optional, Tuple
 
 from aiohttp import ClientResponse, BasicAuth
 
-from .core import OAuth2Client, UserInfo, OAuth1Client
+from .core import FORM_HEADERS, OAuth2Client, UserInfo, OAuth1Client
 
 __author__ = "Bogdan Gladyshev"
 __copyright__ = "Copyright 2017, Bogdan Gladyshev"
@@ -39,6 +39,7 @@ class GoogleClient(OAuth2Client):
             first_name=data.get('given_name'),
             last_name=data.get('family_name'),
             picture=data.get('picture'),
+            hosted_domain=data.get('hd'),
         )
 
 
@@ -55,6 +56,7 @@ class GitlabClient(OAuth2Client):
     base_url = 'https://gitlab.com/api/v4'
     name = 'gitlab'
     user_info_url = 'https://gitlab.com/api/v4/user'
+    membership_url = 'https://gitlab.com/api/v4/groups?min_access_level=10&per_page=100'
 
     @classmethod
     def user_parse(cls, data) -> UserInfo:
@@ -66,6 +68,10 @@ class GitlabClient(OAuth2Client):
             link=data.get('web_url')
         )
 
+    @classmethod
+    def membership_parse(cls, data) -> List[str]:
+        return [group['full_path'] for group in data or []]
+
 
 class BitbucketClient(OAuth1Client):
 
@@ -133,11 +139,8 @@ class Bitbucket2Client(OAuth2Client):
             auth = None
         else:
             auth = BasicAuth(self.client_id, self.client_secret)
-            headers = headers or {
-                'Accept': 'application/json',
-                'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
-            }
-        return await self.aiohttp_session.request(
+            headers = headers or dict(FORM_HEADERS)
+        return await self._send(
             method, url, params=params, headers=headers, auth=auth, **aio_kwargs
         )
 
@@ -414,11 +417,13 @@ class FacebookClient(OAuth2Client):
     name = 'facebook'
     user_info_url = 'https://graph.facebook.com/me'
 
-    async def user_info(self, **kwargs) -> Tuple[UserInfo, Dict]:
+    async def conditional_user_info(
+            self, validators: Mapping[str, str] = None,
+            **kwargs) -> Tuple[Optional[UserInfo], Optional[Dict], Dict[str, str]]:
         """Facebook required fields-param."""
-        params = kwargs.get('params', {})
+        params = kwargs.pop('params', None) or {}
         params['fields'] = 'id,email,first_name,last_name,name,link,locale,gender,location'
-        return await super(FacebookClient, self).user_info(params=params, **kwargs)
+        return await super(FacebookClient, self).conditional_user_info(validators, params=params, **kwargs)
 
     @staticmethod
     def user_parse(data):
@@ -488,10 +493,28 @@ class GithubClient(OAuth2Client):
     base_url = 'https://api.github.com'
     name = 'github'
     user_info_url = 'https://api.github.com/user'
+    # private email is only available from emails endpoint
+    user_info_extra_urls = {'emails': 'https://api.github.com/user/emails'}
+    # needs read:org scope to see private memberships
+    membership_url = 'https://api.github.com/user/orgs?per_page=100'
+
+    @classmethod
+    def user_info_extra_needed(cls, key: str, data: Dict) -> bool:  # pylint: disable=unused-argument
+        return not data.get('email')
+
+    @classmethod
+    def membership_parse(cls, data) -> List[str]:
+        return [org['login'] for org in data or []]
 
     @classmethod
     def user_parse(cls, data) -> UserInfo:
         """Parse information from provider."""
+        email = data.get('email')
+        if not email:
+            email = next((
+                item.get('email') for item in data.get('emails') or []
+                if item.get('primary') and item.get('verified')
+            ), None)
         first_name, _, last_name = (data.get('name') or '').partition(' ')
         location = data.get('location', '')
         city, country = '', ''
@@ -502,7 +525,7 @@ class GithubClient(OAuth2Client):
                 city = split_location[1].strip()
         return UserInfo(
             id=data.get('id'),
-            email=data.get('email'),
+            email=email,
             first_name=first_name,
             last_name=last_name,
             username=data.get('login'),
@@ -690,7 +713,7 @@ class DiscordClient(OAuth2Client):
         if self.access_token:
             headers = headers or {}
             headers['Authorization'] = "Bearer {}".format(self.access_token)
-        return await self.aiohttp_session.request(
+        return await self._send(
             method, url, params=params, headers=headers, **aio_kwargs
         )
 
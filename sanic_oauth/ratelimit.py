@@ -0,0 +1,91 @@
+import asyncio
+import time
+import typing
+
+from .core import BACKGROUND, DEFAULT_RETRY_AFTER, INTERACTIVE, RateLimitExceeded, parse_rate_limit, parse_retry_after
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+__all__ = ('BACKGROUND', 'INTERACTIVE', 'RateLimiter')
+
+
+class RateLimiter:  # pylint: disable=too-many-instance-attributes
+
+    """Token bucket for outbound calls to one provider.
+
+    The bucket refills at ``rate`` calls per second (unlimited when ``rate`` is None)
+    and additionally follows the quota the provider announces in its rate-limit
+    headers. A ``reserve`` share of both is kept for interactive calls, so
+    background work is delayed first and shed once it would wait longer than
+    ``background_max_wait``. Interactive calls fail fast after ``max_wait``.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, rate: float = None, burst: int = None, reserve: float = 0.2,
+            max_wait: float = 5.0, background_max_wait: float = 30.0,
+            default_window: float = 60.0) -> None:
+        self.rate = rate
+        self.burst = burst or max(int(rate or 1), 1)
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.background_max_wait = background_max_wait
+        self.default_window = default_window
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.limit: typing.Optional[float] = None
+        self.remaining: typing.Optional[float] = None
+        self.reset_at = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _reserve(self, priority: int) -> float:
+        """Take one call from the bucket or return how long to wait for it."""
+        now = time.monotonic()
+        if self.remaining is not None and now >= self.reset_at:
+            self.remaining = None
+        floor = 0.0 if priority == INTERACTIVE else self.reserve
+        if self.remaining is not None and self.remaining <= (self.limit or 0) * floor:
+            return max(self.reset_at - now, DEFAULT_RETRY_AFTER / 10)
+        if self.rate is not None:
+            self._refill(now)
+            needed = 1 + self.burst * floor
+            if self.tokens < needed:
+                return (needed - self.tokens) / self.rate
+            self.tokens -= 1
+        if self.remaining is not None:
+            self.remaining -= 1
+        return 0.0
+
+    async def acquire(self, priority: int = INTERACTIVE) -> None:
+        """Wait for permission to make one call."""
+        max_wait = self.max_wait if priority == INTERACTIVE else self.background_max_wait
+        while True:
+            delay = self._reserve(priority)
+            if delay <= 0:
+                return
+            if delay > max_wait:
+                raise RateLimitExceeded(delay, reason='Provider rate limit exhausted, call was not sent')
+            await asyncio.sleep(delay)
+
+    def update(self, headers: typing.Mapping[str, str]) -> None:
+        """Learn remaining quota and reset time from provider response headers."""
+        retry_after = parse_retry_after(headers)
+        limit, remaining, reset_after = parse_rate_limit(headers)
+        now = time.monotonic()
+        if limit is not None:
+            self.limit = limit
+        if retry_after is not None:
+            self.remaining = 0
+            self.reset_at = now + retry_after
+        elif remaining is not None:
+            self.remaining = remaining
+            self.reset_at = now + (reset_after if reset_after is not None else self.default_window)
@@ -0,0 +1,65 @@
+from functools import lru_cache
+import importlib
+import typing
+
+from .core import Client, OAuthConfigurationException
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+# short provider names, resolved to classes only when configured
+PROVIDERS: typing.Dict[str, str] = {
+    'amazon': 'sanic_oauth.providers.AmazonClient',
+    'bitbucket': 'sanic_oauth.providers.BitbucketClient',
+    'bitbucket2': 'sanic_oauth.providers.Bitbucket2Client',
+    'discord': 'sanic_oauth.providers.DiscordClient',
+    'eventbrite': 'sanic_oauth.providers.EventbriteClient',
+    'facebook': 'sanic_oauth.providers.FacebookClient',
+    'flickr': 'sanic_oauth.providers.Flickr',
+    'foursquare': 'sanic_oauth.providers.FoursquareClient',
+    'github': 'sanic_oauth.providers.GithubClient',
+    'gitlab': 'sanic_oauth.providers.GitlabClient',
+    'google': 'sanic_oauth.providers.GoogleClient',
+    'linkedin': 'sanic_oauth.providers.LinkedinClient',
+    'meetup': 'sanic_oauth.providers.Meetup',
+    'odnoklassniki': 'sanic_oauth.providers.OdnoklassnikiClient',
+    'pinterest': 'sanic_oauth.providers.PinterestClient',
+    'plurk': 'sanic_oauth.providers.Plurk',
+    'tumblr': 'sanic_oauth.providers.TumblrClient',
+    'twitter': 'sanic_oauth.providers.TwitterClient',
+    'vimeo': 'sanic_oauth.providers.VimeoClient',
+    'vk': 'sanic_oauth.providers.VKClient',
+    'yahoo': 'sanic_oauth.providers.YahooClient',
+    'yandex': 'sanic_oauth.providers.YandexClient',
+}
+
+
+def register_provider(name: str, class_link: str) -> None:
+    """Make provider class available by short name."""
+    PROVIDERS[name] = class_link
+    resolve_provider_class.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def resolve_provider_class(class_link: str) -> typing.Type[Client]:
+    """Resolve provider class by short name or by full dotted path."""
+    class_link = PROVIDERS.get(class_link, class_link)
+    module_path, _, class_name = class_link.rpartition('.')
+    if not module_path:
+        raise OAuthConfigurationException(f"Unknown OAuth provider {class_link}")
+    try:
+        module_obj = importlib.import_module(module_path)
+    except ImportError as exc:
+        raise OAuthConfigurationException(f"Cannot find module {module_path} to import OAuth provider") from exc
+    provider_class = getattr(module_obj, class_name, None)
+    if provider_class is None:
+        raise OAuthConfigurationException(f"Cannot find class {class_name} in module {module_path}")
+    if not isinstance(provider_class, type) or not issubclass(provider_class, Client):
+        raise OAuthConfigurationException("Class must be a child of sanic_oauth.core.Client class")
+    return provider_class
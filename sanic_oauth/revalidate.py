@@ -0,0 +1,124 @@
+import asyncio
+from functools import partial
+import logging
+import time
+import typing
+
+from .bulk import bulk_user_info
+from .core import Client, TokenRejected, UserInfo
+from .store import AuthStateStore, token_key
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+
+def user_info_record(user: UserInfo, validators: typing.Mapping[str, str] = None) -> typing.Dict[str, typing.Any]:
+    """Return store representation of freshly fetched or confirmed user information."""
+    return {'user_info': vars(user), 'fetched_at': time.time(), 'validators': dict(validators or {})}
+
+
+class UserInfoRevalidator:
+
+    """Refresh stale user information in background.
+
+    Each token is revalidated by one task at a time no matter how many
+    requests ask for it. Scheduled tokens are collected for ``interval``
+    seconds and fetched in batches through ``bulk_user_info``, so calls run
+    with background priority, bounded per-provider concurrency and respect
+    provider rate limits. Requests are conditional when provider sent
+    ``ETag`` or ``Last-Modified``, so unchanged user information is confirmed
+    with ``304`` instead of downloaded again. Results are written to ``store``
+    for requests to pick up; tokens rejected by provider are marked as revoked.
+    """
+
+    def __init__(
+            self, oauth_factory: typing.Callable[..., Client], store: AuthStateStore,
+            user_info_ttl: float = 300, interval: float = 0.5, batch_size: int = 100,
+            concurrency: int = 4, max_scheduled: int = 10000) -> None:
+        self.oauth_factory = oauth_factory
+        self.store = store
+        self.user_info_ttl = user_info_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_scheduled = max_scheduled
+        self._scheduled: typing.Dict[str, typing.Tuple[typing.Optional[str], typing.Optional[str]]] = {}
+        self._running: typing.Set[str] = set()
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def schedule(self, token: str, provider: str = None, tenant: str = None) -> None:
+        if token in self._scheduled or token in self._running or len(self._scheduled) >= self.max_scheduled:
+            return
+        self._scheduled[token] = (tenant, provider)
+
+    async def _publish(self, token: str, result: typing.Any, record: typing.Optional[typing.Mapping]) -> None:
+        key = token_key('user_info', token)
+        if isinstance(result, tuple):
+            user, _data, validators = result
+            if user is None:
+                user = UserInfo(**record['user_info'])
+            await self.store.set(key, user_info_record(user, validators), ttl=self.user_info_ttl)
+        elif isinstance(result, TokenRejected):
+            await self.store.set(key, {'revoked': True}, ttl=self.user_info_ttl)
+        else:
+            _log.warning("User info revalidation failed, serving stale data: %s", result)
+
+    async def _revalidate_tenant(self, tenant: typing.Optional[str], pairs: typing.List[typing.Tuple]) -> None:
+        async def produce():
+            for pair in pairs:
+                yield pair
+
+        tokens = [token for _provider, token in pairs]
+        stored = await self.store.get_many([token_key('user_info', token) for token in tokens])
+        records = {token: record for token, record in zip(tokens, stored) if record and 'user_info' in record}
+
+        async def call(client: Client, token: str):
+            record = records.get(token)
+            return await client.conditional_user_info(record.get('validators') if record else None)
+
+        factory = self.oauth_factory if tenant is None else partial(self.oauth_factory, tenant=tenant)
+        async for token, result in bulk_user_info(factory, produce(), concurrency=self.concurrency, call=call):
+            await self._publish(token, result, records.get(token))
+
+    async def revalidate(self) -> None:
+        """Fetch next batch of scheduled tokens."""
+        batch = list(self._scheduled.items())[:self.batch_size]
+        groups: typing.Dict[typing.Optional[str], typing.List[typing.Tuple]] = {}
+        for token, (tenant, provider) in batch:
+            del self._scheduled[token]
+            self._running.add(token)
+            groups.setdefault(tenant, []).append((provider, token))
+        try:
+            await asyncio.gather(*(self._revalidate_tenant(tenant, pairs) for tenant, pairs in groups.items()))
+        finally:
+            self._running.difference_update(token for token, _ in batch)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._scheduled:
+                try:
+                    await self.revalidate()
+                except Exception:  # pylint: disable=broad-except
+                    _log.exception("User info revalidation batch failed")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
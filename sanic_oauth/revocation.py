@@ -0,0 +1,149 @@
+import collections
+import math
+import time
+import typing
+
+from .store import AuthStateStore, InvalidationChannel, token_key
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+REVOKED_PREFIX = 'revoked:'
+
+
+class BloomFilter:
+
+    """Bit array answering "maybe present" or "surely absent" for sha256 hex keys."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: str) -> typing.Iterator[int]:
+        # keys are already uniform hashes, two slices give all probe positions
+        first, second = int(digest[:16], 16), int(digest[16:32], 16) | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, digest: str) -> None:
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+class RevocationList:
+
+    """Revoked access tokens known to every worker.
+
+    Revocations are broadcast through ``channel`` (``LocalChannel`` stands in
+    for ``RedisStore`` on one process). Each worker keeps token hashes in a
+    bloom filter sized for ``capacity`` tokens, so checking a valid token
+    costs a few bit lookups, and in an exact set that confirms filter hits.
+    Entries are dropped ``ttl`` seconds after revocation, when the token
+    would have expired anyway.
+
+    Broadcasts are not kept: a worker that starts or reconnects later does
+    not learn earlier revocations. The blueprint therefore requires
+    ``app.ctx.oauth_store``, from which ``revoke_token`` deletes the token:
+    ``is_active`` looks a token up in the store once per ``verify_ttl``
+    seconds, then answers from memory until a broadcast revokes it.
+    """
+
+    def __init__(
+            self, channel: InvalidationChannel = None, capacity: int = 100000,
+            error_rate: float = 0.001, ttl: float = 86400.0, verify_ttl: float = 60.0) -> None:
+        self.channel = channel
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.verify_ttl = verify_ttl
+        self.filter = BloomFilter(capacity, error_rate)
+        self._revoked: typing.Dict[str, float] = {}
+        # tokens found in the store by this worker, until when they are trusted without asking again
+        self._verified: typing.MutableMapping[str, float] = collections.OrderedDict()
+        self._subscribed = False
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return token_key('token', token).partition(':')[2]
+
+    async def start(self) -> None:
+        if self.channel is not None and not self._subscribed:
+            self._subscribed = True
+            await self.channel.subscribe(self._on_message)
+
+    def _on_message(self, key: str) -> None:
+        # the channel is shared with cache invalidations
+        if key.startswith(REVOKED_PREFIX):
+            self.add(key[len(REVOKED_PREFIX):])
+
+    def add(self, digest: str) -> None:
+        """Mark token hash as revoked in this worker only."""
+        if digest not in self._revoked and len(self._revoked) >= self.capacity:
+            self.compact()
+        self._revoked[digest] = time.monotonic() + self.ttl
+        self.filter.add(digest)
+
+    def compact(self) -> None:
+        """Forget expired revocations and rebuild the filter from the rest."""
+        now = time.monotonic()
+        self._revoked = {digest: expires_at for digest, expires_at in self._revoked.items() if expires_at > now}
+        # more live revocations than planned: grow instead of compacting on every add
+        self.capacity = max(self.capacity, len(self._revoked) * 2)
+        self.filter = BloomFilter(self.capacity, self.error_rate)
+        for digest in self._revoked:
+            self.filter.add(digest)
+
+    async def revoke_digest(self, digest: str) -> None:
+        """Revoke token by its SHA-256 hex digest on every worker."""
+        self.add(digest)
+        if self.channel is not None:
+            await self.channel.publish(REVOKED_PREFIX + digest)
+
+    async def revoke(self, token: str) -> None:
+        await self.revoke_digest(self.digest(token))
+
+    def is_revoked(self, token: str) -> bool:
+        digest = self.digest(token)
+        return digest in self.filter and self._is_revoked_digest(digest)
+
+    def _is_revoked_digest(self, digest: str) -> bool:
+        expires_at = self._revoked.get(digest)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    async def is_active(self, token: str, store: typing.Optional[AuthStateStore]) -> bool:
+        """Check if token is not revoked and, when ``store`` is given, still stored.
+
+        A token verified in the store within ``verify_ttl`` is checked by filter
+        lookup only; the store is asked on a cache miss or a filter false positive.
+        """
+        digest = self.digest(token)
+        now = time.monotonic()
+        if digest not in self.filter and self._verified.get(digest, 0) > now:
+            return True
+        if self._is_revoked_digest(digest):
+            return False
+        if store is None:
+            return True
+        record = await store.get(token_key('token', token))
+        if record is None:
+            # expired, or revoked while this worker was not listening
+            self._verified.pop(digest, None)
+            return False
+        trusted_for = self.verify_ttl
+        if record.get('expires_at'):
+            trusted_for = min(trusted_for, record['expires_at'] - time.time())
+        self._verified[digest] = now + trusted_for
+        self._verified.move_to_end(digest)
+        if len(self._verified) > self.capacity:
+            self._verified.popitem(last=False)
+        return True
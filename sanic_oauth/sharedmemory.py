@@ -0,0 +1,195 @@
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+import typing
+
+from .core import OAuthConfigurationException
+from .store import AuthStateStore
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_MAGIC = b'SOAUTH01'
+_HEADER = struct.Struct('<8sII')
+_HEADER_SIZE = 64
+# sequence, key digest, expiration timestamp (0 - never), data length
+_SEQUENCE = struct.Struct('<Q')
+_SLOT = struct.Struct('<Q16sdI')
+_EMPTY = bytes(16)
+
+
+def default_path(name: str) -> str:
+    """Return cache file path of application ``name``, so applications of one host do not share it."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f'sanic_oauth.{name}.cache')
+
+
+def _digest(key: str) -> bytes:
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+class SharedMemoryStore(AuthStateStore):  # pylint: disable=too-many-instance-attributes
+
+    """Cache shared by all worker processes of one host through mmap'ed file.
+
+    The file holds ``slots`` fixed size slots addressed by key hash with
+    ``probes`` long linear probing. Readers take no lock: every slot carries
+    a sequence number that writers make odd while they change the slot, and
+    a read is retried when the number changed under it. Writers serialize
+    through ``flock`` on a descriptor opened by each process, so the store
+    may be created before workers fork. Values that do not fit into a slot are not cached, the
+    least lasting entry is evicted when all probed slots are taken.
+    """
+
+    def __init__(
+            self, path: str, slots: int = 4096, slot_size: int = 1024,
+            probes: int = 8, read_retries: int = 16) -> None:
+        if slot_size <= _SLOT.size:
+            raise OAuthConfigurationException(f"Slot size must be greater than {_SLOT.size} bytes")
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - _SLOT.size
+        self.probes = min(probes, slots)
+        self.read_retries = read_retries
+        self._size = _HEADER_SIZE + slots * slot_size
+        self._pid = 0
+        self._open()
+
+    def _open(self) -> None:
+        handle = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                if os.fstat(handle).st_size == 0:
+                    os.ftruncate(handle, self._size)
+                    os.pwrite(handle, _HEADER.pack(_MAGIC, self.slots, self.slot_size), 0)
+                header = _HEADER.unpack(os.pread(handle, _HEADER.size, 0))
+                if header != (_MAGIC, self.slots, self.slot_size) or os.fstat(handle).st_size != self._size:
+                    raise OAuthConfigurationException(f"{self.path} has different layout, remove it or use another path")
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            self._mmap = mmap.mmap(handle, self._size)
+        except BaseException:
+            os.close(handle)
+            raise
+        self._fd, self._pid = handle, os.getpid()
+
+    def _attach(self) -> None:
+        # flock excludes open file descriptions, not processes: a descriptor inherited through fork
+        # is shared with the parent and would not exclude it, so each process opens its own
+        if self._pid != os.getpid():
+            inherited_mmap, inherited_fd = self._mmap, self._fd
+            self._open()
+            inherited_mmap.close()
+            os.close(inherited_fd)
+
+    @contextmanager
+    def _locked(self) -> typing.Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offsets(self, digest: bytes) -> typing.Iterator[int]:
+        start = int.from_bytes(digest[:8], 'little')
+        for probe in range(self.probes):
+            yield _HEADER_SIZE + (start + probe) % self.slots * self.slot_size
+
+    def _read(self, offset: int) -> typing.Optional[typing.Tuple[bytes, float, bytes]]:
+        for _ in range(self.read_retries):
+            sequence = _SEQUENCE.unpack_from(self._mmap, offset)[0]
+            if sequence & 1:
+                continue
+            raw = self._mmap[offset:offset + self.slot_size]
+            if _SEQUENCE.unpack_from(self._mmap, offset)[0] == sequence:
+                _sequence, digest, expires_at, length = _SLOT.unpack_from(raw)
+                return digest, expires_at, raw[_SLOT.size:_SLOT.size + length]
+        return None
+
+    def _write(self, offset: int, digest: bytes, expires_at: float, data: bytes) -> None:
+        sequence = _SEQUENCE.unpack_from(self._mmap, offset)[0] | 1
+        _SEQUENCE.pack_into(self._mmap, offset, sequence)
+        self._mmap[offset + _SLOT.size:offset + _SLOT.size + len(data)] = data
+        _SLOT.pack_into(self._mmap, offset, sequence, digest, expires_at, len(data))
+        _SEQUENCE.pack_into(self._mmap, offset, sequence + 1)
+
+    def lookup(self, key: str) -> typing.Tuple[bool, typing.Any]:
+        """Return ``(found, value)``, found ``None`` value is a cached miss."""
+        self._attach()
+        digest = _digest(key)
+        for offset in self._offsets(digest):
+            slot = self._read(offset)
+            if slot is not None and slot[0] == digest:
+                if slot[1] and slot[1] <= time.time():
+                    return False, None
+                return True, json.loads(slot[2]) if slot[2] else None
+        return False, None
+
+    def put(self, key: str, value: typing.Any, ttl: float = None) -> bool:
+        data = b'' if value is None else json.dumps(value).encode()
+        if len(data) > self.capacity:
+            self.discard(key)
+            return False
+        digest, now = _digest(key), time.time()
+        self._attach()
+        with self._locked():
+            self._write(self._target_slot(digest, now), digest, now + ttl if ttl else 0.0, data)
+        return True
+
+    def _target_slot(self, digest: bytes, now: float) -> int:
+        """Return offset of the slot of ``digest``, else of a free one, else of the least lasting entry."""
+        free, victim, victim_expires = None, None, float('inf')
+        for offset in self._offsets(digest):
+            _sequence, slot_digest, expires_at, _length = _SLOT.unpack_from(self._mmap, offset)
+            if slot_digest == digest:
+                return offset
+            if free is None and (slot_digest == _EMPTY or 0 < expires_at <= now):
+                free = offset
+            if victim is None or 0 < expires_at < victim_expires:
+                victim, victim_expires = offset, expires_at or float('inf')
+        return free or victim
+
+    def discard(self, key: str) -> None:
+        digest = _digest(key)
+        self._attach()
+        with self._locked():
+            for offset in self._offsets(digest):
+                if _SLOT.unpack_from(self._mmap, offset)[1] == digest:
+                    self._write(offset, _EMPTY, 0.0, b'')
+
+    async def get(self, key: str) -> typing.Any:
+        return self.lookup(key)[1]
+
+    async def set(self, key: str, value: typing.Any, ttl: float = None) -> None:
+        self.put(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self.discard(key)
+
+    async def ttl(self, key: str) -> typing.Optional[float]:
+        digest = _digest(key)
+        self._attach()
+        for offset in self._offsets(digest):
+            slot = self._read(offset)
+            if slot is not None and slot[0] == digest and slot[1]:
+                return max(slot[1] - time.time(), 0.0)
+        return None
+
+    async def close(self) -> None:
+        if self._pid == os.getpid() and not self._mmap.closed:
+            self._mmap.close()
+            os.close(self._fd)
@@ -0,0 +1,452 @@
+import abc
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import time
+import typing
+from urllib.parse import unquote, urlsplit
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+InvalidationCallback = typing.Callable[[str], None]
+
+
+def token_key(kind: str, token: str) -> str:
+    """Build store key for token related state without keeping the token itself in the key."""
+    return f'{kind}:{hashlib.sha256(token.encode()).hexdigest()}'
+
+
+def user_key(provider: str, user_id: typing.Any, tenant: str = None) -> str:
+    """Build store key of the index of tokens issued to one user of one provider."""
+    return f'user_tokens:{tenant or ""}:{provider}:{user_id}'
+
+
+class InvalidationChannel(abc.ABC):
+
+    """Broadcast of changed keys between workers and nodes."""
+
+    @abc.abstractmethod
+    async def publish(self, key: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def subscribe(self, callback: InvalidationCallback) -> None:
+        pass
+
+
+class LocalChannel(InvalidationChannel):
+
+    """In-process channel, local stand-in for a cluster-wide one."""
+
+    def __init__(self) -> None:
+        self.callbacks: typing.List[InvalidationCallback] = []
+
+    async def publish(self, key: str) -> None:
+        for callback in self.callbacks:
+            callback(key)
+
+    async def subscribe(self, callback: InvalidationCallback) -> None:
+        self.callbacks.append(callback)
+
+
+class AuthStateStore(abc.ABC):
+
+    """Storage of tokens, refresh tokens and user information.
+
+    Values are JSON serializable objects, ``ttl`` is given in seconds.
+    """
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> typing.Any:
+        pass
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: typing.Any, ttl: float = None) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def ttl(self, key: str) -> typing.Optional[float]:
+        """Return seconds left to live, ``None`` for missing key or key without expiration."""
+
+    async def get_many(self, keys: typing.Sequence[str]) -> typing.List[typing.Any]:
+        return list(await asyncio.gather(*(self.get(key) for key in keys)))
+
+    async def pop(self, key: str) -> typing.Any:
+        """Return value and delete it; stores shared by workers override it to do so atomically."""
+        value = await self.get(key)
+        await self.delete(key)
+        return value
+
+    async def index_add(self, key: str, member: str, ttl: float) -> None:
+        """Keep ``member`` in index ``key`` for ``ttl`` seconds, dropping expired members."""
+        now = time.time()
+        members = {name: expires_at for name, expires_at in (await self.get(key) or {}).items() if expires_at > now}
+        members[member] = now + ttl
+        await self.set(key, members, ttl=max(members.values()) - now)
+
+    async def index_remove(self, key: str, member: str) -> None:
+        now = time.time()
+        members = {name: expires_at for name, expires_at in (await self.get(key) or {}).items() if expires_at > now}
+        members.pop(member, None)
+        if members:
+            await self.set(key, members, ttl=max(members.values()) - now)
+        else:
+            await self.delete(key)
+
+    async def index_members(self, key: str) -> typing.List[str]:
+        now = time.time()
+        return [name for name, expires_at in (await self.get(key) or {}).items() if expires_at > now]
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStore(AuthStateStore):
+
+    """Store living in the memory of one process.
+
+    Use it with a single worker only: other workers do not see its tokens,
+    and ``login_required`` takes a missing token for a logout.
+    """
+
+    def __init__(self, purge_every: int = 1000) -> None:
+        self._data: typing.Dict[str, typing.Tuple[typing.Optional[float], str]] = {}
+        self._purge_every = purge_every
+        self._writes = 0
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._data.items() if expires_at is not None and expires_at <= now]:
+            del self._data[key]
+
+    def _entry(self, key: str) -> typing.Optional[typing.Tuple[typing.Optional[float], str]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> typing.Any:
+        entry = self._entry(key)
+        return None if entry is None else json.loads(entry[1])
+
+    async def get_many(self, keys: typing.Sequence[str]) -> typing.List[typing.Any]:
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: typing.Any, ttl: float = None) -> None:
+        self._writes += 1
+        if self._writes % self._purge_every == 0:
+            self._purge()
+        self._data[key] = (None if ttl is None else time.monotonic() + ttl, json.dumps(value))
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def pop(self, key: str) -> typing.Any:
+        entry = self._entry(key)
+        self._data.pop(key, None)
+        return None if entry is None else json.loads(entry[1])
+
+    async def ttl(self, key: str) -> typing.Optional[float]:
+        entry = self._entry(key)
+        if entry is None or entry[0] is None:
+            return None
+        return entry[0] - time.monotonic()
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RedisConnection:
+
+    """Single connection speaking RESP2."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def encode(args: typing.Sequence) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    async def read_reply(self) -> typing.Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('Redis connection closed')
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b'+':
+            return payload.decode()
+        if prefix == b'-':
+            raise RedisError(payload.decode())
+        if prefix == b':':
+            return int(payload)
+        if prefix == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if prefix == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise RedisError(f'Unexpected reply {line!r}')
+
+    async def execute(self, *args) -> typing.Any:
+        self.writer.write(self.encode(args))
+        await self.writer.drain()
+        return await self.read_reply()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisStore(AuthStateStore, InvalidationChannel):
+
+    """Store talking Redis protocol, also usable as invalidation channel.
+
+    No client library is needed: a small connection pool speaks RESP directly.
+    """
+
+    def __init__(
+            self, url: str = 'redis://localhost:6379/0', pool_size: int = 10,
+            prefix: str = 'sanic_oauth:', channel: str = 'sanic_oauth:invalidate') -> None:
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.database = int(parts.path.strip('/') or 0)
+        self.prefix = prefix
+        self.channel = channel
+        self._idle: typing.Deque[_RedisConnection] = collections.deque()
+        self._slots = asyncio.Semaphore(pool_size)
+        self._subscriptions: typing.List[asyncio.Task] = []
+
+    async def _connect(self) -> _RedisConnection:
+        connection = _RedisConnection(*await asyncio.open_connection(self.host, self.port))
+        if self.password:
+            await connection.execute('AUTH', self.password)
+        if self.database:
+            await connection.execute('SELECT', self.database)
+        return connection
+
+    async def execute(self, *args) -> typing.Any:
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                result = await connection.execute(*args)
+            except BaseException:
+                # reply state is unknown after failure or cancellation, do not reuse connection
+                connection.close()
+                raise
+            self._idle.append(connection)
+            return result
+
+    async def get(self, key: str) -> typing.Any:
+        value = await self.execute('GET', self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    async def get_many(self, keys: typing.Sequence[str]) -> typing.List[typing.Any]:
+        if not keys:
+            return []
+        values = await self.execute('MGET', *(self.prefix + key for key in keys))
+        return [None if value is None else json.loads(value) for value in values]
+
+    async def set(self, key: str, value: typing.Any, ttl: float = None) -> None:
+        args = ['SET', self.prefix + key, json.dumps(value)]
+        if ttl is not None:
+            args += ['PX', max(int(ttl * 1000), 1)]
+        await self.execute(*args)
+
+    async def delete(self, key: str) -> None:
+        await self.execute('DEL', self.prefix + key)
+
+    async def pop(self, key: str) -> typing.Any:
+        # Redis 6.2+, one command so concurrent callers cannot both get the value
+        value = await self.execute('GETDEL', self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    async def ttl(self, key: str) -> typing.Optional[float]:
+        milliseconds = await self.execute('PTTL', self.prefix + key)
+        return None if milliseconds < 0 else milliseconds / 1000
+
+    async def index_add(self, key: str, member: str, ttl: float) -> None:
+        # sorted set scored by expiration time, updated atomically by concurrent logins
+        key, now = self.prefix + key, time.time()
+        await self.execute('ZADD', key, now + ttl, member)
+        await self.execute('ZREMRANGEBYSCORE', key, '-inf', now)
+        last = await self.execute('ZRANGE', key, -1, -1, 'WITHSCORES')
+        if last:
+            await self.execute('PEXPIREAT', key, int(float(last[1]) * 1000))
+
+    async def index_remove(self, key: str, member: str) -> None:
+        await self.execute('ZREM', self.prefix + key, member)
+
+    async def index_members(self, key: str) -> typing.List[str]:
+        members = await self.execute('ZRANGEBYSCORE', self.prefix + key, time.time(), '+inf')
+        return [member.decode() for member in members]
+
+    async def publish(self, key: str) -> None:
+        await self.execute('PUBLISH', self.channel, key)
+
+    async def _listen(self, callback: InvalidationCallback) -> None:
+        while True:
+            try:
+                connection = await self._connect()
+                try:
+                    await connection.execute('SUBSCRIBE', self.channel)
+                    while True:
+                        message = await connection.read_reply()
+                        if message and message[0] == b'message':
+                            callback(message[2].decode())
+                finally:
+                    connection.close()
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, RedisError) as exc:
+                _log.warning("Redis invalidation subscription lost: %s", exc)
+                await asyncio.sleep(1)
+
+    async def subscribe(self, callback: InvalidationCallback) -> None:
+        self._subscriptions.append(asyncio.ensure_future(self._listen(callback)))
+
+    async def close(self) -> None:
+        for task in self._subscriptions:
+            task.cancel()
+        self._subscriptions.clear()
+        while self._idle:
+            self._idle.pop().close()
+
+
+class LocalCache:
+
+    """Bounded in-process LRU with per-entry expiration, ``None`` marks cached miss."""
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self._entries: typing.MutableMapping[str, typing.Tuple[float, typing.Any]] = collections.OrderedDict()
+
+    def lookup(self, key: str) -> typing.Tuple[bool, typing.Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        return True, entry[1]
+
+    def put(self, key: str, value: typing.Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+class NearCache(AuthStateStore):
+
+    """Per-worker cache in front of a shared store.
+
+    Entries (misses included) are served from ``local`` cache for at most
+    ``ttl`` seconds. Writes go to the shared store and are announced through
+    ``channel`` so other workers drop their copies right away; ``ttl`` bounds
+    staleness when an announcement is lost. ``local`` defaults to process
+    memory, ``SharedMemoryStore`` shares it between workers of one host.
+    """
+
+    def __init__(
+            self, store: AuthStateStore, channel: InvalidationChannel = None,
+            ttl: float = 5.0, max_size: int = 10000, local=None) -> None:
+        self.store = store
+        self.channel = channel
+        self.cache_ttl = ttl
+        self.local = local if local is not None else LocalCache(max_size)
+        self._subscribed = False
+
+    async def _ensure_subscribed(self) -> None:
+        if self.channel is not None and not self._subscribed:
+            self._subscribed = True
+            await self.channel.subscribe(self.invalidate)
+
+    def invalidate(self, key: str) -> None:
+        self.local.discard(key)
+
+    async def get(self, key: str) -> typing.Any:
+        await self._ensure_subscribed()
+        found, value = self.local.lookup(key)
+        if found:
+            return value
+        value = await self.store.get(key)
+        self.local.put(key, value, self.cache_ttl)
+        return value
+
+    async def get_many(self, keys: typing.Sequence[str]) -> typing.List[typing.Any]:
+        await self._ensure_subscribed()
+        values, missed = {}, []
+        for key in keys:
+            found, values[key] = self.local.lookup(key)
+            if not found:
+                missed.append(key)
+        if missed:
+            for key, value in zip(missed, await self.store.get_many(missed)):
+                self.local.put(key, value, self.cache_ttl)
+                values[key] = value
+        return [values[key] for key in keys]
+
+    async def set(self, key: str, value: typing.Any, ttl: float = None) -> None:
+        await self._ensure_subscribed()
+        await self.store.set(key, value, ttl)
+        if self.channel is not None:
+            await self.channel.publish(key)
+        self.local.put(key, value, self.cache_ttl if ttl is None else min(ttl, self.cache_ttl))
+
+    async def delete(self, key: str) -> None:
+        await self._ensure_subscribed()
+        await self.store.delete(key)
+        self.invalidate(key)
+        if self.channel is not None:
+            await self.channel.publish(key)
+
+    async def pop(self, key: str) -> typing.Any:
+        await self._ensure_subscribed()
+        value = await self.store.pop(key)
+        self.invalidate(key)
+        if self.channel is not None:
+            await self.channel.publish(key)
+        return value
+
+    async def ttl(self, key: str) -> typing.Optional[float]:
+        return await self.store.ttl(key)
+
+    async def index_add(self, key: str, member: str, ttl: float) -> None:
+        await self.store.index_add(key, member, ttl)
+
+    async def index_remove(self, key: str, member: str) -> None:
+        await self.store.index_remove(key, member)
+
+    async def index_members(self, key: str) -> typing.List[str]:
+        return await self.store.index_members(key)
+
+    async def close(self) -> None:
+        await self.store.close()
@@ -0,0 +1,222 @@
+import abc
+import asyncio
+import collections
+import json
+import logging
+import os
+import typing
+
+from .config import ProviderConfig, build_runtime, compile_provider, provider_defaults
+from .core import INTERACTIVE, Client, OAuthConfigurationException
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+TenantKey = typing.Tuple[str, str]
+TenantsSettings = typing.Mapping[str, typing.Mapping[str, typing.Mapping]]
+
+
+class ProviderSource(abc.ABC):
+
+    """Source of per-tenant provider settings."""
+
+    @abc.abstractmethod
+    async def load(self) -> TenantsSettings:
+        """Return ``{tenant: {provider: settings}}``, settings use ``OAUTH_PROVIDERS`` format."""
+
+    async def save(self, tenant: str, provider: str, settings: typing.Mapping) -> None:
+        raise NotImplementedError('The source is read-only.')
+
+    async def delete(self, tenant: str, provider: str) -> None:
+        raise NotImplementedError('The source is read-only.')
+
+
+class MemorySource(ProviderSource):
+
+    """Settings kept in process memory, handy for tests and as local stand-in."""
+
+    def __init__(self, tenants: TenantsSettings = None) -> None:
+        self.tenants: typing.Dict[str, typing.Dict[str, typing.Mapping]] = {
+            tenant: dict(providers) for tenant, providers in (tenants or {}).items()
+        }
+
+    def set(self, tenant: str, provider: str, settings: typing.Mapping) -> None:
+        self.tenants.setdefault(tenant, {})[provider] = settings
+
+    def remove(self, tenant: str, provider: str = None) -> None:
+        if provider is None:
+            self.tenants.pop(tenant, None)
+        else:
+            self.tenants.get(tenant, {}).pop(provider, None)
+
+    async def load(self) -> TenantsSettings:
+        return {tenant: dict(providers) for tenant, providers in self.tenants.items()}
+
+    async def save(self, tenant: str, provider: str, settings: typing.Mapping) -> None:
+        self.set(tenant, provider, settings)
+
+    async def delete(self, tenant: str, provider: str) -> None:
+        self.remove(tenant, provider)
+
+
+class FileSource(ProviderSource):
+
+    """Settings stored in JSON file, read in executor to keep event loop free."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _read(self) -> TenantsSettings:
+        with open(self.path, encoding='utf-8') as source_file:
+            return json.load(source_file)
+
+    async def load(self) -> TenantsSettings:
+        return await asyncio.get_event_loop().run_in_executor(None, self._read)
+
+    def _update(self, tenant: str, provider: str, settings: typing.Optional[typing.Mapping]) -> None:
+        tenants = self._read() if os.path.exists(self.path) else {}
+        if settings is None:
+            tenants.get(tenant, {}).pop(provider, None)
+        else:
+            tenants.setdefault(tenant, {})[provider] = dict(settings)
+        # readers never see half written file
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as source_file:
+            json.dump(tenants, source_file)
+        os.replace(temporary, self.path)
+
+    async def save(self, tenant: str, provider: str, settings: typing.Mapping) -> None:
+        await asyncio.get_event_loop().run_in_executor(None, self._update, tenant, provider, settings)
+
+    async def delete(self, tenant: str, provider: str) -> None:
+        await asyncio.get_event_loop().run_in_executor(None, self._update, tenant, provider, None)
+
+
+class TenantRegistry:
+
+    """Provider settings of many tenants with constant time lookup.
+
+    ``reload`` compiles changed entries only and swaps the whole table at once,
+    so lookups never see half applied state. Rate and concurrency limiters are
+    built lazily on first use and at most ``max_runtimes`` of them are kept.
+    """
+
+    def __init__(
+            self, source: ProviderSource, config: typing.Mapping = None,
+            max_runtimes: int = 1024, reload_interval: float = None) -> None:
+        self.source = source
+        self.defaults = provider_defaults(config or {})
+        self.max_runtimes = max_runtimes
+        self.reload_interval = reload_interval
+        self._providers: typing.Dict[TenantKey, ProviderConfig] = {}
+        self._settings: typing.Dict[TenantKey, typing.Mapping] = {}
+        self._runtimes: typing.MutableMapping[TenantKey, typing.Tuple[ProviderConfig, typing.Dict]] = collections.OrderedDict()
+        self._task: typing.Optional[asyncio.Task] = None
+        self._writes = 0
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+    def _compile(self, key: TenantKey, settings: typing.Mapping) -> typing.Optional[ProviderConfig]:
+        previous = self._providers.get(key)
+        if previous is not None and self._settings.get(key) == settings:
+            return previous
+        try:
+            return compile_provider(key[1], settings, **self.defaults)
+        except OAuthConfigurationException as exc:
+            _log.error("Invalid OAuth provider %s of tenant %s: %s", key[1], key[0], exc)
+            return previous
+
+    async def reload(self) -> None:
+        """Load all settings from source and atomically replace the table."""
+        while True:
+            writes = self._writes
+            tenants = await self.source.load()
+            # load may predate a concurrent set / remove, read the source again to include it
+            if writes == self._writes:
+                break
+        providers, settings = {}, {}
+        for tenant, tenant_providers in tenants.items():
+            for provider, provider_settings in tenant_providers.items():
+                key = (tenant, provider)
+                provider_conf = self._compile(key, provider_settings)
+                if provider_conf is not None:
+                    providers[key] = provider_conf
+                    settings[key] = dict(provider_settings)
+        self._providers, self._settings = providers, settings
+
+    async def set(self, tenant: str, provider: str, settings: typing.Mapping) -> ProviderConfig:
+        """Add or replace one provider, written through to the source so reloads keep it."""
+        key = (tenant, provider)
+        provider_conf = compile_provider(provider, settings, **self.defaults)
+        self._writes += 1
+        await self.source.save(tenant, provider, settings)
+        self._settings[key] = dict(settings)
+        self._providers[key] = provider_conf
+        return provider_conf
+
+    async def remove(self, tenant: str, provider: str) -> None:
+        key = (tenant, provider)
+        self._writes += 1
+        await self.source.delete(tenant, provider)
+        self._providers.pop(key, None)
+        self._settings.pop(key, None)
+        self._runtimes.pop(key, None)
+
+    def get(self, tenant: str, provider: str = None) -> ProviderConfig:
+        try:
+            return self._providers[(tenant, provider or 'default')]
+        except KeyError as exc:
+            raise OAuthConfigurationException(f"No provider named {provider} configured for tenant {tenant}") from exc
+
+    def runtime(self, tenant: str, provider: str = None) -> typing.Dict:
+        """Return shared limiters of the provider, building them on first use."""
+        key = (tenant, provider or 'default')
+        provider_conf = self.get(*key)
+        cached = self._runtimes.get(key)
+        if cached is not None and cached[0] is provider_conf:
+            self._runtimes.move_to_end(key)
+            return cached[1]
+        runtime = build_runtime(provider_conf.runtime_options)
+        self._runtimes[key] = (provider_conf, runtime)
+        self._runtimes.move_to_end(key)
+        while len(self._runtimes) > self.max_runtimes:
+            self._runtimes.popitem(last=False)
+        return runtime
+
+    def create_client(  # pylint: disable=too-many-arguments
+            self, session, tenant: str, provider: str = None,
+            access_token: str = None, priority: int = INTERACTIVE, access_token_secret: str = None) -> Client:
+        return self.get(tenant, provider).create_client(
+            session, self.runtime(tenant, provider), access_token=access_token, priority=priority,
+            access_token_secret=access_token_secret
+        )
+
+    async def _reload_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception:  # pylint: disable=broad-except
+                _log.exception("Cannot reload OAuth tenants, keeping previous settings")
+
+    def start(self) -> None:
+        if self.reload_interval and self._task is None:
+            self._task = asyncio.ensure_future(self._reload_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,231 @@
+import abc
+import asyncio
+import json
+import typing
+from urllib.parse import urlencode
+
+from aiohttp import BasicAuth, ClientSession
+from multidict import CIMultiDict
+import yarl
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+
+class Transport(abc.ABC):
+
+    """HTTP transport used by clients to send requests to providers.
+
+    ``request`` accepts aiohttp style keyword arguments (``params``,
+    ``headers``, ``data``, ``json``, ``auth``) and returns response with
+    ``status``, ``headers``, ``json()``, ``text()`` and ``release()``.
+    """
+
+    @abc.abstractmethod
+    async def request(self, method: str, url: str, **kwargs) -> typing.Any:
+        pass
+
+
+class AiohttpTransport(Transport):
+
+    """Transport over shared ``aiohttp.ClientSession``."""
+
+    def __init__(self, session: ClientSession) -> None:
+        self.session = session
+
+    async def request(self, method: str, url: str, **kwargs) -> typing.Any:
+        return await self.session.request(method, url, **kwargs)
+
+
+class InMemoryRequest:  # pylint: disable=too-few-public-methods
+
+    """Request passed to in-memory transport handler."""
+
+    def __init__(self, method: str, url: yarl.URL, headers: CIMultiDict, body: bytes) -> None:
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+    @property
+    def query(self) -> typing.Mapping[str, str]:
+        return self.url.query
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body)
+
+    def form(self) -> typing.Dict[str, str]:
+        return dict(yarl.URL('?' + self.body.decode()).query)
+
+
+class InMemoryResponse:
+
+    """Response of in-memory transport."""
+
+    def __init__(self, status: int = 200, body: bytes = b'', headers: typing.Mapping[str, str] = None) -> None:
+        self.status = status
+        self.body = body
+        self.headers = CIMultiDict(headers or {})
+        self.released = False
+
+    @classmethod
+    def from_json(cls, data: typing.Any, status: int = 200, headers: typing.Mapping[str, str] = None) -> 'InMemoryResponse':
+        response = cls(status, json.dumps(data).encode(), headers)
+        response.headers.setdefault('Content-Type', 'application/json')
+        return response
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self, encoding: str = 'utf-8') -> str:
+        return self.body.decode(encoding)
+
+    async def json(self, **_kwargs) -> typing.Any:
+        return json.loads(self.body) if self.body else None
+
+    def release(self) -> None:
+        self.released = True
+
+    def close(self) -> None:
+        self.released = True
+
+
+Handler = typing.Callable[[InMemoryRequest], typing.Awaitable[InMemoryResponse]]
+
+
+class InMemoryTransport(Transport):
+
+    """Transport calling Python handler directly, without sockets.
+
+    ``handler`` is coroutine function receiving ``InMemoryRequest`` and
+    returning ``InMemoryResponse``; use ``InMemoryTransport.asgi`` to route
+    requests to ASGI application (Sanic included) instead, and ``start`` /
+    ``stop`` it (or use transport as async context manager) to run the
+    application lifespan. Meant for load and correctness tests of the whole
+    OAuth flow at CPU speed.
+    """
+
+    def __init__(self, handler: Handler, app: typing.Callable = None) -> None:
+        self.handler = handler
+        self.app = app
+        self.requests = 0
+        self._lifespan: typing.Optional[asyncio.Task] = None
+        self._lifespan_events: typing.Optional[asyncio.Queue] = None
+        self._lifespan_replies: typing.Optional[asyncio.Queue] = None
+
+    @classmethod
+    def asgi(cls, app: typing.Callable) -> 'InMemoryTransport':
+        async def handler(request: InMemoryRequest) -> InMemoryResponse:
+            return await _call_asgi(app, request)
+        return cls(handler, app)
+
+    async def _lifespan_event(self, event: str) -> None:
+        await self._lifespan_events.put({'type': f'lifespan.{event}'})
+        reply = await self._lifespan_replies.get()
+        if reply['type'] != f'lifespan.{event}.complete':
+            raise RuntimeError(f"ASGI application {event} failed: {reply.get('message', '')}")
+
+    async def start(self) -> None:
+        """Run startup of ASGI application lifespan."""
+        if self.app is None or self._lifespan is not None:
+            return
+        self._lifespan_events, self._lifespan_replies = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'lifespan', 'asgi': {'version': '3.0'}}
+        self._lifespan = asyncio.ensure_future(
+            self.app(scope, self._lifespan_events.get, self._lifespan_replies.put)
+        )
+        await self._lifespan_event('startup')
+
+    async def stop(self) -> None:
+        """Run shutdown of ASGI application lifespan."""
+        if self._lifespan is None:
+            return
+        try:
+            await self._lifespan_event('shutdown')
+            await self._lifespan
+        finally:
+            self._lifespan = None
+
+    async def __aenter__(self) -> 'InMemoryTransport':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.stop()
+
+    @staticmethod
+    def build_request(  # pylint: disable=too-many-arguments
+            method: str, url: str, params: typing.Mapping[str, str] = None,
+            headers: typing.Mapping[str, str] = None, data: typing.Any = None,
+            json_data: typing.Any = None, auth: BasicAuth = None) -> InMemoryRequest:
+        request_url = yarl.URL(url)
+        if params:
+            request_url = request_url.extend_query({key: str(value) for key, value in params.items()})
+        request_headers = CIMultiDict(headers or {})
+        if auth is not None:
+            request_headers['Authorization'] = auth.encode()
+        if json_data is not None:
+            body = json.dumps(json_data).encode()
+            request_headers.setdefault('Content-Type', 'application/json')
+        elif isinstance(data, typing.Mapping):
+            body = urlencode(data).encode()
+            request_headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        elif isinstance(data, str):
+            body = data.encode()
+        else:
+            body = data or b''
+        return InMemoryRequest(method.upper(), request_url, request_headers, body)
+
+    async def request(self, method: str, url: str, **kwargs) -> InMemoryResponse:
+        self.requests += 1
+        request = self.build_request(
+            method, url, params=kwargs.get('params'), headers=kwargs.get('headers'),
+            data=kwargs.get('data'), json_data=kwargs.get('json'), auth=kwargs.get('auth'),
+        )
+        return await self.handler(request)
+
+
+async def _call_asgi(app: typing.Callable, request: InMemoryRequest) -> InMemoryResponse:
+    url = request.url
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': request.method,
+        'scheme': url.scheme or 'http',
+        'path': url.path,
+        'raw_path': url.raw_path.encode(),
+        'query_string': url.raw_query_string.encode(),
+        'root_path': '',
+        'headers': [
+            (key.lower().encode('latin-1'), value.encode('latin-1'))
+            for key, value in [('Host', url.raw_authority), *request.headers.items()]
+        ],
+        'server': (url.host, url.port),
+        'client': ('127.0.0.1', 0),
+    }
+    messages = [{'type': 'http.request', 'body': request.body, 'more_body': False}]
+    response = InMemoryResponse()
+    chunks: typing.List[bytes] = []
+
+    async def receive() -> typing.Dict[str, typing.Any]:
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message: typing.Dict[str, typing.Any]) -> None:
+        if message['type'] == 'http.response.start':
+            response.status = message['status']
+            response.headers = CIMultiDict(
+                (key.decode('latin-1'), value.decode('latin-1')) for key, value in message.get('headers', [])
+            )
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    response.body = b''.join(chunks)
+    return response
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import socket
+import typing
+from urllib.parse import urlsplit
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+__author__ = "Bogdan Gladyshev"
+__copyright__ = "Copyright 2017, Bogdan Gladyshev"
+__credits__ = ["Bogdan Gladyshev"]
+__license__ = "MIT"
+__version__ = "0.5.1"
+__maintainer__ = "Bogdan Gladyshev"
+__email__ = "siredvin.dark@gmail.com"
+__status__ = "Production"
+
+_log = logging.getLogger(__name__)
+
+
+def _origin(url: str) -> typing.Optional[str]:
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return None
+    return f'{parts.scheme}://{parts.netloc}/'
+
+
+class ProviderWarmup:
+
+    """Keep pooled connections to provider hosts open.
+
+    Connections are opened to token and user info endpoints; opening them
+    also fills the DNS cache of the session connector. ``authorize_url`` is
+    only visited by the user's browser, so its host is checked to resolve,
+    which reports misconfigured hosts at start, but not connected to.
+    """
+
+    def __init__(
+            self, session: ClientSession, server_urls: typing.Iterable[str],
+            browser_urls: typing.Iterable[str] = (), connections: int = 2,
+            interval: float = None, timeout: float = 5.0) -> None:
+        server_urls = [url for url in server_urls if url]
+        self.session = session
+        self.origins = sorted({origin for origin in map(_origin, server_urls) if origin})
+        self.hosts = sorted({
+            (parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+            for parts in map(urlsplit, list(server_urls) + [url for url in browser_urls if url])
+            if parts.hostname
+        })
+        self.connections = connections
+        self.interval = interval
+        self.timeout = ClientTimeout(total=timeout)
+        self._task: typing.Optional[asyncio.Task] = None
+
+    @classmethod
+    def for_providers(cls, session: ClientSession, provider_confs: typing.Iterable, **kwargs) -> 'ProviderWarmup':
+        """Collect endpoints of configured providers, honoring url overrides from settings."""
+        server_urls, browser_urls = [], []
+        for provider_conf in provider_confs:
+            provider_class, setting = provider_conf.provider_class, provider_conf.settings
+            server_urls.append(setting.get('access_token_url') or provider_class.access_token_url)
+            server_urls.append(setting.get('user_info_url') or provider_class.user_info_url)
+            browser_urls.append(setting.get('authorize_url') or provider_class.authorize_url)
+        return cls(session, server_urls, browser_urls, **kwargs)
+
+    async def resolve(self) -> None:
+        """Check that every provider host resolves, so failures show up at start.
+
+        Results are not cached, aiohttp resolves through its connector again.
+        """
+        loop = asyncio.get_event_loop()
+        results = await asyncio.gather(*(
+            loop.getaddrinfo(host, port, type=socket.SOCK_STREAM) for host, port in self.hosts
+        ), return_exceptions=True)
+        for (host, _port), result in zip(self.hosts, results):
+            if isinstance(result, Exception):
+                _log.warning("Cannot resolve OAuth provider host %s: %s", host, result)
+
+    async def _touch(self, origin: str) -> None:
+        try:
+            async with self.session.head(origin, allow_redirects=False, timeout=self.timeout):
+                pass
+        except (ClientError, asyncio.TimeoutError) as exc:
+            _log.debug("Warm-up request to %s failed: %s", origin, exc)
+
+    async def warm(self) -> None:
+        """Open ``connections`` concurrent keep-alive connections per provider origin."""
+        await asyncio.gather(*(
+            self._touch(origin) for origin in self.origins for _ in range(self.connections)
+        ))
+
+    async def run(self) -> None:
+        await self.resolve()
+        await self.warm()
+        while self.interval:
+            await asyncio.sleep(self.interval)
+            await self.warm()
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
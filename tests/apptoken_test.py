@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.apptoken import AppTokenCache
+from sanic_oauth.blueprint import app_client
+from sanic_oauth.core import OAuthConfigurationException
+from sanic_oauth.providers import TwitterClient
+
+
+class FakeClient:
+
+    client_id = 'id'
+    access_token_url = 'https://provider/token'
+    calls = 0
+    expires_in = 3600
+
+    def __init__(self):
+        self.access_token = None
+
+    async def get_client_credentials_token(self, scope=None):
+        FakeClient.calls += 1
+        await asyncio.sleep(0.01)
+        return f'token{FakeClient.calls}-{scope}', {'expires_in': FakeClient.expires_in}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_token():
+    FakeClient.calls, FakeClient.expires_in = 0, 3600
+    cache = AppTokenCache()
+    clients = await asyncio.gather(*(cache.authorize(FakeClient(), 'read') for _ in range(1000)))
+    assert {client.access_token for client in clients} == {'token1-read'}
+    assert await cache.get(FakeClient(), 'write') == 'token2-write'
+    assert FakeClient.calls == 2
+
+    cache.invalidate(FakeClient(), 'read')
+    assert await cache.get(FakeClient(), 'read') == 'token3-read'
+
+
+@pytest.mark.asyncio
+async def test_renewal_before_expiry():
+    FakeClient.calls, FakeClient.expires_in = 0, 30
+    cache = AppTokenCache(refresh_margin=60)
+    assert await cache.get(FakeClient()) == 'token1-None'
+    # token expires within margin: served at once, renewed once in background
+    assert await asyncio.gather(*(cache.get(FakeClient()) for _ in range(10))) == ['token1-None'] * 10
+    await asyncio.sleep(0.02)
+    assert FakeClient.calls == 2
+    FakeClient.expires_in = 3600
+    assert await cache.get(FakeClient()) == 'token2-None'
+
+
+@pytest.mark.asyncio
+async def test_oauth1_provider_has_no_application_token():
+    app = SimpleNamespace(ctx=SimpleNamespace(
+        oauth_factory=lambda **_: TwitterClient(None, consumer_key='key', consumer_secret='secret'),
+        oauth_app_tokens=AppTokenCache(),
+    ))
+    with pytest.raises(OAuthConfigurationException):
+        await app_client(app, 'twitter')
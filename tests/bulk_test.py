@@ -0,0 +1,57 @@
+import asyncio
+
+from aiohttp.web import HTTPBadRequest
+import pytest
+
+from sanic_oauth.bulk import bulk_user_info
+from sanic_oauth.core import RateLimitExceeded, UserInfo, parse_retry_after
+
+
+class FakeClient:
+
+    in_flight = 0
+    max_in_flight = 0
+    limited = set()
+
+    def __init__(self, access_token, provider=None):
+        self.access_token = access_token
+        self.provider = provider
+
+    async def user_info(self):
+        FakeClient.in_flight += 1
+        FakeClient.max_in_flight = max(FakeClient.max_in_flight, FakeClient.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            if self.access_token in FakeClient.limited:
+                FakeClient.limited.discard(self.access_token)
+                raise RateLimitExceeded(0.01)
+            if self.access_token == 'bad':
+                raise HTTPBadRequest(reason='bad token')
+            return UserInfo(id=self.access_token), {}
+        finally:
+            FakeClient.in_flight -= 1
+
+
+async def _pairs(tokens):
+    for token in tokens:
+        yield 'github', token
+
+
+@pytest.mark.asyncio
+async def test_bulk_user_info():
+    FakeClient.limited = {'t3'}
+    tokens = [f't{i}' for i in range(20)] + ['bad']
+    results = {}
+    async for token, result in bulk_user_info(FakeClient, _pairs(tokens), concurrency=3):
+        results[token] = result
+
+    assert set(results) == set(tokens)
+    assert results['t3'].id == 't3'
+    assert isinstance(results['bad'], HTTPBadRequest)
+    assert FakeClient.max_in_flight <= 3
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({'Retry-After': '7'}) == 7.0
+    assert parse_retry_after({'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': '1'}) is None
+    assert parse_retry_after({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '2.5'}) == 2.5
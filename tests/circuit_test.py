@@ -0,0 +1,102 @@
+import time
+from types import SimpleNamespace
+
+from aiohttp import ClientConnectionError
+import pytest
+
+from sanic_oauth.blueprint import login_required
+from sanic_oauth.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import ProviderUnavailable, RateLimitExceeded, UserInfo
+from sanic_oauth.providers import GithubClient
+
+
+class FailingSession:
+
+    calls = 0
+
+    async def request(self, *_args, **_kwargs):
+        FailingSession.calls += 1
+        raise ClientConnectionError('connection refused')
+
+
+def test_circuit_opens_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast():
+    client = GithubClient(FailingSession(), client_id='id', client_secret='secret', access_token='token')
+    client.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    with pytest.raises(ClientConnectionError):
+        await client.user_info()
+    with pytest.raises(ProviderUnavailable):
+        await client.user_info()
+    assert FailingSession.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_locally_rejected_call_gives_back_probe():
+    class ExhaustedQuota:
+        async def acquire(self, _priority):
+            raise RateLimitExceeded(30)
+
+    client = GithubClient(FailingSession(), client_id='id', client_secret='secret', access_token='token')
+    client.circuit_breaker = breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record(False)
+    breaker.opened_at -= 60
+    client.rate_limiter = ExhaustedQuota()
+    with pytest.raises(RateLimitExceeded):
+        await client.user_info()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_degraded_mode():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record(False)
+
+    class DownClient:
+        circuit_breaker = breaker
+
+        async def conditional_user_info(self, _validators=None):
+            raise ProviderUnavailable(breaker.retry_after)
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+        'OAUTH_USER_INFO_SOFT_TTL': 10, 'OAUTH_USER_INFO_HARD_TTL': 10, 'OAUTH_DEGRADED_GRACE': 3600,
+    })
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=lambda **_: DownClient()))
+
+    @login_required
+    async def handler(request, user):
+        return user.email, request.ctx.oauth_degraded
+
+    session = {'token': 'token', 'user_info': UserInfo(email='user@example.com'), 'user_info_fetched_at': time.time() - 60}
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session=session), path='/private')
+    assert await handler(request) == ('user@example.com', True)
+
+    session['user_info_fetched_at'] = time.time() - 7200
+    assert (await handler(request)).status == 503
+
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session={}), path='/private')
+    response = await handler(request)
+    assert response.status == 503
+    assert int(response.headers['Retry-After']) > 1
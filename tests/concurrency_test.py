@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.blueprint import login_required
+from sanic_oauth.concurrency import ConcurrencyLimiter
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import BACKGROUND, ProviderOverloaded
+
+
+@pytest.mark.asyncio
+async def test_queue_overflow_fails_fast():
+    limiter = ConcurrencyLimiter(initial_limit=1, max_queue=1, queue_timeout=1.0)
+    await limiter.acquire()
+    queued = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(ProviderOverloaded):
+        await limiter.acquire()
+
+    limiter.release(0.01)
+    await queued
+    assert limiter.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_interactive_calls_are_served_first():
+    limiter = ConcurrencyLimiter(initial_limit=4, background_share=0.5)
+    await limiter.acquire(BACKGROUND)
+    await limiter.acquire(BACKGROUND)
+    background = asyncio.ensure_future(limiter.acquire(BACKGROUND))
+    await asyncio.sleep(0)
+    assert not background.done()
+
+    await limiter.acquire()
+    await limiter.acquire()
+    interactive = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.release(priority=BACKGROUND)
+    await interactive
+    assert not background.done()
+
+    limiter.release()
+    await background
+    assert (limiter.in_flight, limiter.background_in_flight) == (4, 2)
+
+
+def test_limit_adapts_to_latency():
+    limiter = ConcurrencyLimiter(initial_limit=10)
+    limiter.in_flight = 2
+    limiter.release(0.1)
+    assert limiter.limit > 10
+    limiter.release(1.0)
+    assert limiter.limit < 10
+
+
+@pytest.mark.asyncio
+async def test_login_required_sheds_load():
+    class OverloadedClient:
+        async def conditional_user_info(self, _validators=None):
+            raise ProviderOverloaded(2.5)
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=lambda **_: OverloadedClient()))
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required
+    async def handler(_request, _user):
+        raise AssertionError('handler must not be called')
+
+    response = await handler(request)
+    assert response.status == 503
+    assert response.headers['Retry-After'] == '3'
@@ -0,0 +1,49 @@
+import copy
+
+import pytest
+
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import OAuthConfigurationException
+from sanic_oauth.providers import DiscordClient, GitlabClient
+
+
+def test_compile_does_not_modify_config():
+    discord = {
+        'PROVIDER_CLASS': 'sanic_oauth.providers.DiscordClient',
+        'SCOPE': 'identify email',
+        'CLIENT_ID': 'discord-id',
+        'CLIENT_SECRET': 'discord-secret',
+        'RATE_LIMIT': 5,
+    }
+    config = {
+        'OAUTH_REDIRECT_URI': 'http://localhost/oauth',
+        'OAUTH_SCOPE': 'email',
+        'OAUTH_EMAIL_REGEX': r'.*@example\.com',
+        'OAUTH_PROVIDERS': {
+            'discord': discord,
+            'gitlab': {'PROVIDER_CLASS': 'gitlab', 'CLIENT_ID': 'gitlab-id', 'CLIENT_SECRET': 'gitlab-secret'},
+            'default': discord,
+        },
+    }
+    original = copy.deepcopy(config)
+
+    oauth_config = compile_oauth_config(config)
+
+    assert config == original
+    assert oauth_config.provider('default').provider_class is DiscordClient
+    gitlab = oauth_config.provider('gitlab')
+    assert gitlab.provider_class is GitlabClient
+    assert gitlab.scope == 'email'
+    assert gitlab.endpoint_path == '/oauth'
+    assert gitlab.email_regex.match('user@example.com')
+    assert dict(oauth_config.provider('discord').settings) == {'client_id': 'discord-id', 'client_secret': 'discord-secret'}
+    assert oauth_config.provider('discord').runtime_options['RATE_LIMIT'] == 5
+    with pytest.raises(TypeError):
+        gitlab.settings['client_id'] = 'changed'
+
+
+def test_compile_validates_config():
+    with pytest.raises(OAuthConfigurationException):
+        compile_oauth_config({'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'email'})
+    with pytest.raises(OAuthConfigurationException):
+        compile_oauth_config({'OAUTH_PROVIDERS': {'gitlab': {'PROVIDER_CLASS': 'gitlab', 'SCOPE': 'email'}}})
@@ -0,0 +1,177 @@
+import asyncio
+from urllib.parse import urlencode
+
+from multidict import CIMultiDict
+import pytest
+
+from sanic_oauth import core
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.providers import GithubClient, TwitterClient
+
+
+class FakeResponse:
+
+    status = 200
+    headers = CIMultiDict({'Content-Type': 'application/json'})
+
+    async def json(self):
+        return {'access_token': 'token'}
+
+    def release(self):
+        pass
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.calls = []
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return FakeResponse()
+
+
+def test_authorize_url():
+    github = GithubClient(None, client_id='id', client_secret='secret')
+    url = github.get_authorize_url(scope='user:email', redirect_uri='http://localhost/oauth', state='xyz')
+    assert url == (
+        'https://github.com/login/oauth/authorize?scope=user%3Aemail&redirect_uri=http%3A%2F%2Flocalhost%2Foauth'
+        '&client_id=id&response_type=code&state=xyz'
+    )
+    assert github.get_authorize_url(state='abc').endswith('&state=abc')
+
+    twitter = TwitterClient(None, consumer_key='key', consumer_secret='secret')
+    assert twitter.get_authorize_url('rtoken') == 'https://api.twitter.com/oauth/authorize?oauth_token=rtoken'
+
+
+@pytest.mark.asyncio
+async def test_access_token_form_body():
+    session = FakeSession()
+    github = GithubClient(session, client_id='id', client_secret='secret')
+
+    token, _data = await github.get_access_token('a code', redirect_uri='http://localhost/oauth')
+
+    assert token == 'token'
+    _method, _url, kwargs = session.calls[0]
+    assert kwargs['data'] == (
+        'grant_type=authorization_code&client_id=id&client_secret=secret'
+        '&redirect_uri=http%3A%2F%2Flocalhost%2Foauth&code=a+code'
+    )
+    assert kwargs['headers']['Content-Type'].startswith('application/x-www-form-urlencoded')
+
+
+@pytest.mark.asyncio
+async def test_client_credentials_token():
+    session = FakeSession()
+    github = GithubClient(session, client_id='id', client_secret='secret')
+
+    token, _data = await github.get_client_credentials_token('read write')
+
+    assert token == 'token'
+    assert github.access_token is None
+    assert session.calls[0][2]['data'] == 'grant_type=client_credentials&client_id=id&client_secret=secret&scope=read+write'
+
+
+class ProfileResponse(FakeResponse):
+
+    def __init__(self, status, data, etag):
+        self.status, self.data = status, data
+        self.headers = CIMultiDict({'ETag': etag})
+
+    async def json(self):
+        return self.data
+
+
+class ProfileSession(FakeSession):
+
+    profiles = {
+        'https://api.github.com/user': {'id': 1, 'login': 'octocat', 'email': None},
+        'https://api.github.com/user/emails': [
+            {'email': 'old@example.com', 'primary': False, 'verified': True},
+            {'email': 'octocat@example.com', 'primary': True, 'verified': True},
+        ],
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = self.max_in_flight = 0
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        etag = f'"{url}"'
+        if (kwargs.get('headers') or {}).get('If-None-Match') == etag:
+            return ProfileResponse(304, None, etag)
+        return ProfileResponse(200, self.profiles[url], etag)
+
+
+@pytest.mark.asyncio
+async def test_conditional_user_info():
+    session = ProfileSession()
+    github = GithubClient(session, client_id='id', client_secret='secret', access_token='token')
+
+    user, data, validators = await github.conditional_user_info()
+    assert user.email == 'octocat@example.com'
+    assert data['emails'][1]['primary']
+    assert session.max_in_flight == 2
+    assert validators == {
+        'etag': '"https://api.github.com/user"',
+        'extra': {'emails': {'etag': '"https://api.github.com/user/emails"'}},
+    }
+
+    user, data, same_validators = await github.conditional_user_info(validators)
+    assert user is None and data is None
+    assert same_validators == validators
+    assert session.calls[2][2]['headers']['Accept'] == 'application/json'
+    # revalidation of profile and emails is concurrent too
+    assert len(session.calls) == 4 and session.max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_public_email_skips_emails_endpoint():
+    session = ProfileSession()
+    session.profiles = dict(session.profiles, **{'https://api.github.com/user': {'id': 1, 'email': 'public@example.com'}})
+    github = GithubClient(session, client_id='id', client_secret='secret', access_token='token')
+
+    github.priority = core.BACKGROUND
+    user, data, validators = await github.conditional_user_info()
+    assert user.email == 'public@example.com'
+    assert 'emails' not in data and 'extra' not in validators
+
+    github.priority = core.INTERACTIVE
+    assert await github.conditional_user_info(validators) == (None, None, validators)
+    assert [call[1] for call in session.calls] == ['https://api.github.com/user'] * 2
+
+
+@pytest.mark.asyncio
+async def test_unmodified_profile_keeps_stored_emails():
+    session = ProfileSession()
+    github = GithubClient(session, client_id='id', client_secret='secret', access_token='token')
+    _user, _data, validators = await github.conditional_user_info()
+
+    session.profiles = dict(session.profiles, **{'https://api.github.com/user/emails': []})
+    validators['extra']['emails'] = {'etag': '"stale"'}
+    assert await github.conditional_user_info(validators) == (None, None, validators)
+
+
+@pytest.mark.asyncio
+async def test_configured_queries_are_encoded_once(monkeypatch):
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+        'OAUTH_CLIENT_ID': 'id', 'OAUTH_CLIENT_SECRET': 'secret',
+    })
+    session = FakeSession()
+    github = oauth_config.default.create_client(session, {})
+    expected = GithubClient(None, client_id='id', client_secret='secret').get_authorize_url(
+        scope='user:email', redirect_uri='http://localhost/oauth', state='xyz'
+    )
+
+    encoded = []
+    monkeypatch.setattr(core, 'urlencode', lambda query: encoded.append(query) or urlencode(query))
+    assert github.get_authorize_url(scope='user:email', redirect_uri='http://localhost/oauth', state='xyz') == expected
+    await github.get_access_token('a code', redirect_uri='http://localhost/oauth')
+    assert encoded == [{'state': 'xyz'}, {'code': 'a code'}]
+    assert session.calls[0][2]['data'].startswith('grant_type=authorization_code&client_id=id&client_secret=secret')
@@ -0,0 +1,56 @@
+import logging
+import threading
+
+import pytest
+
+from sanic_oauth.events import AuthEventLogger, fingerprint
+from sanic_oauth.providers import TwitterClient
+from sanic_oauth.transport import InMemoryResponse, InMemoryTransport
+
+
+class Collect(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.lines, self.events, self.threads = [], [], set()
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.events.append(record.auth_event)
+        self.threads.add(threading.get_ident())
+
+
+@pytest.mark.asyncio
+async def test_events_are_redacted_sampled_and_written_off_the_loop(caplog):
+    caplog.set_level(logging.INFO, logger='sanic_oauth')
+    handler = Collect()
+    events = AuthEventLogger(handler, sample_rates={'user_info.fetch': 0})
+    events.start()
+    try:
+        events.event('login.completed', provider='github', token='secret-token')
+        events.event('user_info.fetch', provider='github', token='secret-token')
+        events.event('token.refreshed', logging.DEBUG, token='secret-token')
+    finally:
+        await events.stop()
+
+    assert handler.events == [{'event': 'login.completed', 'provider': 'github', 'token': fingerprint('secret-token')}]
+    assert handler.lines == [f'login.completed provider=github token={fingerprint("secret-token")}']
+    assert threading.get_ident() not in handler.threads
+    # application handlers still receive library records
+    assert [record.getMessage() for record in caplog.records] == handler.lines
+
+
+@pytest.mark.asyncio
+async def test_oauth1_request_log_has_no_secrets(caplog):
+    async def twitter(_request):
+        return InMemoryResponse.from_json({'id': 7, 'name': 'Jack Dorsey', 'screen_name': 'jack'})
+
+    client = TwitterClient(
+        InMemoryTransport(twitter), consumer_key='key', consumer_secret='secret',
+        oauth_token='user-token', oauth_token_secret='user-secret'
+    )
+    with caplog.at_level(logging.DEBUG, logger='sanic_oauth.core'):
+        user, _data = await client.user_info()
+    assert user.username == 'jack'
+    assert 'oauth_consumer_key' in caplog.text
+    assert 'user-token' not in caplog.text and fingerprint('user-token') in caplog.text
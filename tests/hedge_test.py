@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+from sanic_oauth.hedge import Hedger
+from sanic_oauth.providers import GithubClient
+from sanic_oauth.transport import InMemoryResponse, InMemoryTransport
+
+
+@pytest.mark.asyncio
+async def test_slow_user_info_is_hedged():
+    calls = []
+
+    async def provider(request):
+        if request.url.path == '/user/emails':
+            return InMemoryResponse.from_json([])
+        calls.append(request.url.path)
+        # one slow backend node answers the 21st request
+        await asyncio.sleep(5 if len(calls) == 21 else 0.001)
+        return InMemoryResponse.from_json({'id': 1, 'email': 'octocat@example.com'})
+
+    hedger = Hedger(min_samples=20)
+    github = GithubClient(InMemoryTransport(provider), client_id='id', client_secret='secret', access_token='token')
+    github.hedger = hedger
+
+    for _ in range(20):
+        await github.user_info()
+    assert hedger.hedged == 0
+
+    started = time.monotonic()
+    user, _data = await github.user_info()
+    assert user.email == 'octocat@example.com'
+    assert time.monotonic() - started < 1
+    assert (len(calls), hedger.hedged, hedger.hedge_wins) == (22, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_hedge_rate_is_capped():
+    sent, discarded = [], []
+
+    async def send():
+        number = len(sent)
+        sent.append(number)
+        await asyncio.sleep(0.05 if number == 0 else 0.001)
+        return number
+
+    capped = Hedger(max_ratio=0.0, min_samples=1)
+    capped.record(0.001)
+    assert await capped.run(send, discarded.append) == 0
+    assert (len(sent), capped.hedged) == (1, 0)
+
+    sent.clear()
+    hedger = Hedger(max_ratio=1.0, min_samples=1)
+    hedger.record(0.001)
+    assert await hedger.run(send, discarded.append) == 1
+    await asyncio.sleep(0.06)
+    assert (len(sent), hedger.hedge_wins) == (2, 1)
+    assert discarded == []
+
+
+@pytest.mark.asyncio
+async def test_hedge_budget_is_not_saved_up():
+    slow = False
+
+    async def send():
+        await asyncio.sleep(0.01 if slow else 0)
+        return None
+
+    hedger = Hedger(max_ratio=0.05, min_samples=1, burst=5)
+    hedger.record(0.001)
+    for _ in range(1000):
+        await hedger.run(send, lambda _response: None)
+    assert hedger.hedged == 0
+
+    slow = True
+    for _ in range(40):
+        await hedger.run(send, lambda _response: None)
+    assert 0 < hedger.hedged <= 5 + 40 * 0.05
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from sanic_oauth.blueprint import create_oauth_factory, fetch_user_info, oauth, stop_background_tasks
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.oauth1 import RequestTokenSecrets
+from sanic_oauth.store import MemoryStore
+from sanic_oauth.transport import InMemoryResponse, InMemoryTransport
+
+
+class Twitter:
+
+    def __init__(self):
+        self.request_tokens = 0
+
+    async def __call__(self, request):
+        if request.url.path == '/oauth/request_token':
+            assert request.query['oauth_callback'] == 'http://localhost/oauth'
+            self.request_tokens += 1
+            return InMemoryResponse(body=f'oauth_token=rt{self.request_tokens}&oauth_token_secret=rs'.encode())
+        if request.url.path == '/oauth/access_token':
+            assert request.query['oauth_verifier'] == 'verifier'
+            return InMemoryResponse(body=f'oauth_token=at-{request.query["oauth_token"]}&oauth_token_secret=as'.encode())
+        assert request.query['oauth_token'].startswith('at-')
+        return InMemoryResponse.from_json({'id': 7, 'name': 'Jack Dorsey', 'screen_name': 'jack'})
+
+
+def login_request(app, session, **args):
+    return SimpleNamespace(app=app, ctx=SimpleNamespace(session=session), args=args, path='/oauth')
+
+
+@pytest.mark.asyncio
+async def test_oauth1_login_with_prefetched_request_tokens():
+    twitter = Twitter()
+    app = SimpleNamespace(ctx=SimpleNamespace(
+        oauth_transport=InMemoryTransport(twitter),
+        oauth_config=compile_oauth_config({
+            'OAUTH_PROVIDER': 'twitter', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': '',
+            'OAUTH_CONSUMER_KEY': 'key', 'OAUTH_CONSUMER_SECRET': 'secret', 'OAUTH_REQUEST_TOKEN_POOL': 3,
+        }),
+    ))
+    await create_oauth_factory(app, None)
+    try:
+        session = {'after_auth_redirect': '/private'}
+        response = await oauth(login_request(app, session))
+        authorize = urlsplit(response.headers['Location'])
+        request_token = dict(parse_qsl(authorize.query))['oauth_token']
+        assert request_token == 'rt1'
+
+        await asyncio.sleep(0.01)
+        assert twitter.request_tokens == 4
+        other_session = {}
+        response = await oauth(login_request(app, other_session))
+        assert response.headers['Location'].endswith('oauth_token=rt2')
+
+        # request token is bound to the session that started the login
+        stolen = await oauth(login_request(app, other_session, oauth_token=request_token, oauth_verifier='verifier'))
+        assert stolen.status == 400
+        response = await oauth(login_request(app, session, oauth_token=request_token, oauth_verifier='verifier'))
+        assert response.headers['Location'] == '/private'
+        assert (session['token'], session['oauth_token_secret']) == ('at-rt1', 'as')
+        user = await fetch_user_info(login_request(app, session), None, '/oauth', None)
+        assert user.username == 'jack'
+
+        replayed = await oauth(login_request(app, session, oauth_token=request_token, oauth_verifier='verifier'))
+        assert replayed.status == 400
+        response = await oauth(login_request(app, other_session, oauth_token='rt2', oauth_verifier='verifier'))
+        assert other_session['token'] == 'at-rt2'
+    finally:
+        await stop_background_tasks(app, None)
+
+
+@pytest.mark.asyncio
+async def test_request_token_secret_is_taken_once():
+    secrets = RequestTokenSecrets(MemoryStore())
+    await secrets.put('rt', 'secret')
+    assert await asyncio.gather(secrets.pop('rt'), secrets.pop('rt')) in (['secret', None], [None, 'secret'])
+
+
+@pytest.mark.asyncio
+async def test_request_token_secrets_follow_configuration(caplog):
+    def app(**ctx):
+        return SimpleNamespace(state=SimpleNamespace(workers=2), ctx=SimpleNamespace(
+            oauth_transport=InMemoryTransport(Twitter()),
+            oauth_config=compile_oauth_config({
+                'OAUTH_PROVIDER': 'twitter', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': '',
+                'OAUTH_CONSUMER_KEY': 'key', 'OAUTH_CONSUMER_SECRET': 'secret', 'OAUTH_REQUEST_TOKEN_TTL': 120,
+            }), **ctx,
+        ))
+
+    local = app()
+    await create_oauth_factory(local, None)
+    assert local.ctx.oauth_request_tokens.ttl == 120
+    assert 'callbacks reaching another worker fail' in caplog.text
+
+    caplog.clear()
+    shared = app(oauth_store=MemoryStore())
+    await create_oauth_factory(shared, None)
+    assert not caplog.records
+    await stop_background_tasks(local, None)
+    await stop_background_tasks(shared, None)
@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.blueprint import create_oauth_factory, login_required
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import OAuthConfigurationException, UserInfo
+from sanic_oauth.policy import Policy
+from sanic_oauth.providers import GithubClient
+from sanic_oauth.transport import InMemoryResponse, InMemoryTransport
+
+
+def test_policy_rules():
+    policy = Policy(emails=['Boss@Partner.org'], domains=['example.com'])
+    assert policy.allows(UserInfo(email='user@EXAMPLE.com'))
+    assert policy.allows(UserInfo(email='boss@partner.org'))
+    assert not policy.allows(UserInfo(email='other@partner.org'))
+    assert not policy.allows(UserInfo(email=None))
+
+    workspace = Policy.compile({'hosted_domains': ['example.com'], 'email_regex': r'.*@example\.com$'})
+    assert workspace.allows(UserInfo(email='user@example.com', hosted_domain='example.com'))
+    assert not workspace.allows(UserInfo(email='user@example.com'))
+
+    orgs = Policy(memberships=['acme'])
+    assert orgs.allows(UserInfo(email='user@example.com'), ['other', 'acme'])
+    assert not orgs.allows(UserInfo(email='user@example.com'), None)
+
+
+@pytest.mark.asyncio
+async def test_memberships_are_fetched_once():
+    class Client:
+        membership_calls = 0
+
+        async def conditional_user_info(self, _validators=None):
+            return UserInfo(id='1', email='user@example.com'), {}, {}
+
+        async def memberships(self):
+            Client.membership_calls += 1
+            return GithubClient.membership_parse([{'login': 'acme'}])
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'read:org',
+    })
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=lambda **_: Client()))
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required(policy={'memberships': ['acme'], 'domains': ['example.com']})
+    async def member(_request, user):
+        return user.email
+
+    @login_required(policy=Policy(memberships=['umbrella']), add_user_info=False)
+    async def outsider(_request):
+        raise AssertionError('handler must not be called')
+
+    assert await member(request) == 'user@example.com'
+    assert await member(request) == 'user@example.com'
+    assert (await outsider(request)).status == 403
+    assert Client.membership_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_memberships_follow_pagination():
+    async def github(request):
+        page = int(request.query.get('page', 1))
+        assert request.query['per_page'] == '100'
+        headers = {'Link': f'<https://api.github.com/user/orgs?per_page=100&page={page + 1}>; rel="next"'} if page < 3 else {}
+        return InMemoryResponse.from_json([{'login': f'org{page}-{number}'} for number in range(100 if page < 3 else 5)], headers=headers)
+
+    client = GithubClient(InMemoryTransport(github), client_id='id', client_secret='secret', access_token='token')
+    memberships = await client.memberships()
+    assert len(memberships) == 205 and memberships[-1] == 'org3-4'
+
+
+@pytest.mark.asyncio
+async def test_unavailable_membership_endpoint_answers_503():
+    async def github(request):
+        if request.url.path == '/user/orgs':
+            return InMemoryResponse(503, headers={'Retry-After': '7'})
+        return InMemoryResponse.from_json({'id': 1, 'login': 'octocat', 'email': 'octocat@example.com'})
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'read:org',
+        'OAUTH_CLIENT_ID': 'id', 'OAUTH_CLIENT_SECRET': 'secret',
+    })
+    transport = InMemoryTransport(github)
+    app = SimpleNamespace(ctx=SimpleNamespace(
+        oauth_config=oauth_config,
+        oauth_factory=lambda **kwargs: oauth_config.default.create_client(transport, {}, access_token=kwargs['access_token']),
+    ))
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required(policy={'memberships': ['acme']})
+    async def member(_request, user):
+        return user.email
+
+    response = await member(request)
+    assert response.status == 503
+    assert response.headers['Retry-After'] == '7'
+
+
+@pytest.mark.asyncio
+async def test_membership_policy_needs_provider_support():
+    @login_required(policy={'memberships': ['acme']})
+    async def member(_request, user):
+        return user.email
+
+    app = SimpleNamespace(
+        router=SimpleNamespace(routes=[SimpleNamespace(path='/private', handler=member)]),
+        ctx=SimpleNamespace(oauth_transport=InMemoryTransport(None), oauth_config=compile_oauth_config({
+            'OAUTH_PROVIDER': 'google', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'email',
+        })),
+    )
+    with pytest.raises(OAuthConfigurationException):
+        await create_oauth_factory(app, None)
@@ -0,0 +1,50 @@
+import gc
+
+from aiohttp import ClientSession, web
+import pytest
+
+from sanic_oauth.core import TokenRejected
+from sanic_oauth.pool import PoolMonitor
+from sanic_oauth.providers import GithubClient
+
+
+async def _user(request):
+    if request.query.get('access_token') == 'revoked':
+        return web.json_response({'message': 'Bad credentials'}, status=401)
+    return web.json_response({'id': 1, 'login': 'octocat', 'email': 'octocat@example.com'})
+
+
+@pytest.mark.asyncio
+async def test_connections_are_released_and_reused():
+    app = web.Application()
+    app.router.add_get('/user', _user)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+    monitor = PoolMonitor()
+    try:
+        async with ClientSession(trace_configs=[monitor.trace_config()]) as session:
+            def client(token):
+                github = GithubClient(
+                    session, client_id='id', client_secret='secret', access_token=token,
+                    user_info_url=f'http://127.0.0.1:{port}/user'
+                )
+                github.pool_monitor = monitor
+                return github
+
+            for _ in range(3):
+                user, _data = await client('token').user_info()
+                assert user.email == 'octocat@example.com'
+            with pytest.raises(TokenRejected):
+                await client('revoked').user_info()
+            assert monitor.stats()['held'] == 0
+            assert monitor.created == 1
+            assert monitor.reused == 3
+
+            await client('token').request('GET', f'http://127.0.0.1:{port}/user')
+            gc.collect()
+            assert monitor.leaked == 1
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,48 @@
+import pytest
+
+from sanic_oauth.core import RateLimitExceeded
+from sanic_oauth.providers import GithubClient
+from sanic_oauth.ratelimit import BACKGROUND, INTERACTIVE, RateLimiter
+
+
+class FakeResponse:
+
+    def __init__(self, headers):
+        self.status = 200
+        self.headers = headers
+
+
+class FakeSession:
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.calls = 0
+
+    async def request(self, method, url, **kwargs):
+        self.calls += 1
+        return FakeResponse(self.headers)
+
+
+@pytest.mark.asyncio
+async def test_background_is_shed_before_interactive():
+    limiter = RateLimiter(background_max_wait=0.0)
+    limiter.update({'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset-After': '60'})
+
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.acquire(BACKGROUND)
+    assert exc_info.value.retry_after > 50
+
+    await limiter.acquire(INTERACTIVE)
+    assert limiter.remaining == 9
+
+
+@pytest.mark.asyncio
+async def test_client_learns_quota_from_headers():
+    session = FakeSession({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': '60'})
+    github = GithubClient(session, client_id='id', client_secret='secret', access_token='token')
+    github.rate_limiter = RateLimiter(max_wait=1.0)
+
+    await github.request('GET', github.user_info_url)
+    with pytest.raises(RateLimitExceeded):
+        await github.request('GET', github.user_info_url)
+    assert session.calls == 1
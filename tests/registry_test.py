@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+import pytest
+
+from sanic_oauth.core import OAuthConfigurationException
+from sanic_oauth.registry import PROVIDERS, resolve_provider_class
+
+
+def test_resolve_provider_class():
+    from sanic_oauth.providers import GithubClient
+
+    assert resolve_provider_class('github') is GithubClient
+    assert resolve_provider_class('sanic_oauth.providers.GithubClient') is GithubClient
+    assert all(resolve_provider_class(name) for name in PROVIDERS)
+    with pytest.raises(OAuthConfigurationException):
+        resolve_provider_class('unknown')
+    with pytest.raises(OAuthConfigurationException):
+        resolve_provider_class('sanic_oauth.core.UserInfo')
+
+
+def test_lightweight_import():
+    code = (
+        "import sys, sanic_oauth.registry; "
+        "print(sorted(m for m in ('aiohttp.web', 'sanic', 'sanic_oauth.providers') if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    assert output.strip() == '[]'
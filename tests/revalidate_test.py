@@ -0,0 +1,93 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.blueprint import login_required
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import TokenRejected, UserInfo
+from sanic_oauth.revalidate import UserInfoRevalidator
+from sanic_oauth.store import MemoryStore, token_key
+
+
+class FakeClient:
+
+    calls = 0
+    not_modified = 0
+    email = 'new@example.com'
+    rejected = False
+
+    def __init__(self, **_kwargs):
+        self.priority = None
+
+    async def conditional_user_info(self, validators=None):
+        FakeClient.calls += 1
+        if FakeClient.rejected:
+            raise TokenRejected(reason='revoked')
+        if validators and validators['etag'] == FakeClient.email:
+            FakeClient.not_modified += 1
+            return None, None, validators
+        return UserInfo(id='1', email=FakeClient.email), {}, {'etag': FakeClient.email}
+
+    async def user_info(self):
+        user, data, _validators = await self.conditional_user_info()
+        return user, data
+
+
+def _request(fetched_at):
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+        'OAUTH_USER_INFO_SOFT_TTL': 10, 'OAUTH_USER_INFO_HARD_TTL': 100,
+    })
+    revalidator = UserInfoRevalidator(FakeClient, MemoryStore())
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=FakeClient, oauth_revalidator=revalidator))
+    session = {
+        'token': 'token', 'user_info': UserInfo(id='1', email='old@example.com'),
+        'user_info_fetched_at': time.time() - fetched_at,
+    }
+    return SimpleNamespace(app=app, ctx=SimpleNamespace(session=session), path='/private')
+
+
+@login_required
+async def handler(_request, user):
+    return user.email
+
+
+@pytest.mark.asyncio
+async def test_stale_user_info_is_revalidated_in_background():
+    FakeClient.calls, FakeClient.not_modified, FakeClient.rejected = 0, 0, False
+    request = _request(fetched_at=20)
+
+    assert await handler(request) == 'old@example.com'
+    assert await handler(request) == 'old@example.com'
+    assert FakeClient.calls == 0
+    assert len(request.app.ctx.oauth_revalidator._scheduled) == 1  # pylint: disable=protected-access
+
+    await request.app.ctx.oauth_revalidator.revalidate()
+    assert FakeClient.calls == 1
+    assert await handler(request) == 'new@example.com'
+    assert await handler(request) == 'new@example.com'
+    assert FakeClient.calls == 1
+
+    request.app.ctx.oauth_revalidator.schedule('token')
+    await request.app.ctx.oauth_revalidator.revalidate()
+    assert FakeClient.not_modified == 1
+    record = await request.app.ctx.oauth_revalidator.store.get(token_key('user_info', 'token'))
+    assert record['user_info']['email'] == 'new@example.com'
+    assert time.time() - record['fetched_at'] < 1
+
+
+@pytest.mark.asyncio
+async def test_hard_ttl_and_revocation():
+    FakeClient.calls, FakeClient.rejected = 0, False
+    request = _request(fetched_at=200)
+    assert await handler(request) == 'new@example.com'
+    assert FakeClient.calls == 1
+
+    FakeClient.rejected = True
+    request = _request(fetched_at=20)
+    assert await handler(request) == 'old@example.com'
+    await request.app.ctx.oauth_revalidator.revalidate()
+    response = await handler(request)
+    assert response.status == 302
+    assert 'token' not in request.ctx.session
@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.blueprint import create_oauth_factory, login_required, revoke_token
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import OAuthConfigurationException, UserInfo
+from sanic_oauth.revocation import RevocationList
+from sanic_oauth.store import LocalChannel, MemoryStore, token_key
+
+
+@pytest.mark.asyncio
+async def test_revocation_reaches_every_worker():
+    channel = LocalChannel()
+    first, second = RevocationList(channel, capacity=100), RevocationList(channel, capacity=100)
+    await first.start()
+    await second.start()
+
+    await first.revoke('stolen')
+    assert second.is_revoked('stolen')
+    assert not any(second.is_revoked(f'token-{number}') for number in range(1000))
+
+    for number in range(150):
+        second.add(RevocationList.digest(f'old-{number}'))
+    assert second.is_revoked('stolen') and second.is_revoked('old-149')
+    assert second.capacity >= 151
+
+
+@pytest.mark.asyncio
+async def test_login_required_rejects_revoked_token():
+    class Client:
+        async def conditional_user_info(self, _validators=None):
+            return UserInfo(id='1', email='user@example.com'), {}, {}
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    app = SimpleNamespace(ctx=SimpleNamespace(
+        oauth_config=oauth_config, oauth_factory=lambda **_: Client(), oauth_revocations=RevocationList(),
+    ))
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required
+    async def handler(_request, user):
+        return user.email
+
+    assert await handler(request) == 'user@example.com'
+    await revoke_token(app, digest=RevocationList.digest('token'))
+    response = await handler(request)
+    assert response.status == 302
+    assert 'token' not in request.ctx.session
+
+
+@pytest.mark.asyncio
+async def test_worker_started_after_revocation_rejects_token():
+    class Client:
+        circuit_breaker = None
+
+        async def conditional_user_info(self, _validators=None):
+            return UserInfo(id='1', email='user@example.com'), {}, {}
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    with pytest.raises(OAuthConfigurationException):
+        await create_oauth_factory(SimpleNamespace(ctx=SimpleNamespace(
+            oauth_config=oauth_config, oauth_transport=object(), oauth_revocations=RevocationList(),
+        )), None)
+
+    channel, store = LocalChannel(), MemoryStore()
+    await store.set(token_key('token', 'token'), {'provider': None}, ttl=60)
+    running = SimpleNamespace(ctx=SimpleNamespace(oauth_store=store, oauth_revocations=RevocationList(channel)))
+    await revoke_token(running, 'token')
+
+    late = SimpleNamespace(ctx=SimpleNamespace(
+        oauth_config=oauth_config, oauth_factory=lambda **_: Client(), oauth_store=store, oauth_revocations=RevocationList(channel),
+    ))
+    request = SimpleNamespace(app=late, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required
+    async def handler(_request, user):
+        return user.email
+
+    assert (await handler(request)).status == 302
+
+
+@pytest.mark.asyncio
+async def test_verified_token_is_checked_from_memory():
+    class CountingStore(MemoryStore):
+        token_reads = 0
+
+        async def get(self, key):
+            if key.startswith('token:'):
+                CountingStore.token_reads += 1
+            return await super().get(key)
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    channel, store = LocalChannel(), CountingStore()
+    await store.set(token_key('token', 'token'), {'provider': None}, ttl=60)
+
+    def worker(verify_ttl):
+        revocations = RevocationList(channel, verify_ttl=verify_ttl)
+        app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_store=store, oauth_revocations=revocations))
+        return SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required(add_user_info=False)
+    async def handler(_request):
+        return 'ok'
+
+    listening, deaf = worker(60), worker(0)
+    await listening.app.ctx.oauth_revocations.start()
+    for _ in range(10):
+        assert await handler(listening) == 'ok'
+    assert CountingStore.token_reads == 1
+
+    # the second worker never subscribed, it finds the token missing from the store
+    await revoke_token(listening.app, 'token')
+    assert (await handler(listening)).status == 302
+    assert (await handler(deaf)).status == 302
@@ -0,0 +1,80 @@
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.blueprint import configuration_check
+from sanic_oauth.core import OAuthConfigurationException
+from sanic_oauth.sharedmemory import SharedMemoryStore
+from sanic_oauth.store import MemoryStore, NearCache
+
+
+def _worker_write(path):
+    SharedMemoryStore(path, slots=64, slot_size=256).put('user_info:abc', {'email': 'user@example.com'}, ttl=60)
+
+
+def _forked_worker_write(store, inherited_fd):
+    store.put('forked', 1)
+    assert store._fd != inherited_fd  # pylint: disable=protected-access
+
+
+@pytest.mark.asyncio
+async def test_workers_share_entries(tmp_path):
+    path = str(tmp_path / 'cache')
+    store = SharedMemoryStore(path, slots=64, slot_size=256)
+    process = multiprocessing.get_context('fork').Process(target=_worker_write, args=(path,))
+    process.start()
+    process.join()
+
+    assert await store.get('user_info:abc') == {'email': 'user@example.com'}
+    assert 0 < await store.ttl('user_info:abc') <= 60
+    await store.delete('user_info:abc')
+    assert store.lookup('user_info:abc') == (False, None)
+
+    # store created before workers fork opens its own lock descriptor in each of them
+    process = multiprocessing.get_context('fork').Process(
+        target=_forked_worker_write, args=(store, store._fd)  # pylint: disable=protected-access
+    )
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert await store.get('forked') == 1
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_slot_limits(tmp_path):
+    path = str(tmp_path / 'cache')
+    store = SharedMemoryStore(path, slots=4, slot_size=128, probes=2)
+    assert not store.put('large', 'x' * 200)
+    store.put('miss', None, ttl=60)
+    assert store.lookup('miss') == (True, None)
+    for index in range(20):
+        store.put(f'key{index}', index)
+    assert await store.get('key19') == 19
+    with pytest.raises(OAuthConfigurationException):
+        SharedMemoryStore(path, slots=8, slot_size=128)
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_near_cache_with_shared_local_tier(tmp_path):
+    shared = MemoryStore()
+    local = SharedMemoryStore(str(tmp_path / 'cache'), slots=64, slot_size=256)
+    first, second = NearCache(shared, local=local), NearCache(shared, local=local)
+
+    await first.set('key', 'value')
+    await shared.delete('key')
+    assert await second.get('key') == 'value'
+    await local.close()
+
+
+@pytest.mark.asyncio
+async def test_not_accepted_as_authoritative_store(tmp_path):
+    store = SharedMemoryStore(str(tmp_path / 'cache'), slots=64, slot_size=256)
+    app = SimpleNamespace(ctx=SimpleNamespace(async_session=None, session_interface=None, oauth_store=store))
+    with pytest.raises(OAuthConfigurationException):
+        await configuration_check(app, None)
+    app.ctx.oauth_store = NearCache(MemoryStore(), local=store)
+    await configuration_check(app, None)
+    await store.close()
@@ -0,0 +1,156 @@
+import collections
+import gc
+import json
+import logging
+import os
+import tracemalloc
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import pytest
+
+from sanic_oauth.blueprint import create_oauth_factory, login_required, logout, oauth, stop_background_tasks
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.events import AuthEventLogger
+from sanic_oauth.pool import PoolMonitor
+from sanic_oauth.store import MemoryStore, user_key
+from sanic_oauth.transport import InMemoryResponse, InMemoryTransport
+
+# simulated logins, raise for long runs: SANIC_OAUTH_SOAK=200000 pytest tests/soak_test.py
+LOGINS = int(os.environ.get('SANIC_OAUTH_SOAK', 2000))
+SAMPLES = 10
+
+
+class GrowthDetector:
+
+    """Samples live objects per type, traced memory and custom gauges over a run.
+
+    A metric grows when every sample of the second half of the run (after
+    ``warmup`` samples) is above every sample of the first half by more than
+    its slack, which ignores noise and one-off allocations of caches.
+    """
+
+    def __init__(self, warmup: int = 2, object_slack: int = 50, memory_slack: int = 512 * 1024) -> None:
+        self.warmup = warmup
+        self.object_slack = object_slack
+        self.memory_slack = memory_slack
+        self.samples = []
+        self.snapshots = []
+
+    def sample(self, **gauges) -> None:
+        gc.collect()
+        counts = collections.Counter(type(obj).__qualname__ for obj in gc.get_objects())
+        memory, _peak = tracemalloc.get_traced_memory()
+        self.samples.append({'traced memory': memory, **gauges, **{f'objects {name}': count for name, count in counts.items()}})
+        if len(self.samples) in (self.warmup + 1, SAMPLES):
+            self.snapshots.append(tracemalloc.take_snapshot())
+
+    def _slack(self, metric: str) -> int:
+        if metric == 'traced memory':
+            return self.memory_slack
+        return self.object_slack if metric.startswith('objects ') else 0
+
+    def growth(self):
+        series = self.samples[self.warmup:]
+        first, second = series[:len(series) // 2], series[len(series) // 2:]
+        grown = {}
+        for metric in set().union(*series):
+            before = max(sample.get(metric, 0) for sample in first)
+            after = min(sample.get(metric, 0) for sample in second)
+            if after - before > self._slack(metric):
+                grown[metric] = (before, after)
+        return grown
+
+    def report(self) -> str:
+        lines = [f'{metric}: {before} -> {after}' for metric, (before, after) in sorted(self.growth().items())]
+        if len(self.snapshots) == 2:
+            # leave out samples kept by the detector itself
+            first, last = (snapshot.filter_traces([tracemalloc.Filter(False, __file__)]) for snapshot in self.snapshots)
+            lines.extend(str(stat) for stat in last.compare_to(first, 'lineno')[:10])
+        return '\n'.join(lines)
+
+
+async def github(request):
+    if request.url.path == '/login/oauth/access_token':
+        return InMemoryResponse.from_json({'access_token': 'token-' + request.form()['code']})
+    user_id = request.query['access_token'].rpartition('-')[2]
+    if request.url.path == '/user':
+        return InMemoryResponse.from_json({'id': user_id, 'login': f'user{user_id}', 'email': f'user{user_id}@example.com'})
+    if request.url.path == '/user/emails':
+        return InMemoryResponse.from_json([{'email': f'user{user_id}@example.com', 'primary': True, 'verified': True}])
+    if request.url.path == '/user/orgs':
+        return InMemoryResponse.from_json([{'login': 'staff'}])
+    return InMemoryResponse(404)
+
+
+def roundtrip(session):
+    # sessions leave the worker between requests, nothing may stay referenced from them
+    return json.loads(json.dumps(session, default=vars))
+
+
+@pytest.mark.asyncio
+async def test_auth_flow_does_not_grow_memory():
+    monitor, store = PoolMonitor(), MemoryStore()
+    app = SimpleNamespace(ctx=SimpleNamespace(
+        oauth_transport=InMemoryTransport(github), oauth_store=store, oauth_pool_monitor=monitor,
+        oauth_events=AuthEventLogger(logging.NullHandler(), exclusive=True),
+        oauth_config=compile_oauth_config({
+            'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'read:org',
+            'OAUTH_CLIENT_ID': 'id', 'OAUTH_CLIENT_SECRET': 'secret',
+        }),
+    ))
+
+    @login_required(policy={'memberships': ['staff']})
+    async def private(_request, user):
+        return user.email
+
+    def request(session, path='/private', **args):
+        return SimpleNamespace(app=app, ctx=SimpleNamespace(session=session), args=args, path=path)
+
+    async def visit(number):
+        session = {}
+        response = await private(request(session))
+        assert response.headers['Location'] == '/oauth'
+        session = roundtrip(session)
+        response = await oauth(request(session, '/oauth'))
+        assert urlsplit(response.headers['Location']).netloc == 'github.com'
+        # every login gets a new token, users come back so their token indexes are updated too
+        response = await oauth(request(session, '/oauth', code=f'{number}-{number % 100}'))
+        assert response.headers['Location'] == '/private'
+        for _ in range(3):
+            session = roundtrip(session)
+            assert await private(request(session)) == f'user{number % 100}@example.com'
+        await logout(request(session))
+
+    detector = GrowthDetector()
+    tracemalloc.start()
+    await create_oauth_factory(app, None)
+    try:
+        for number in range(LOGINS):
+            await visit(number)
+            if (number + 1) % max(1, LOGINS // SAMPLES) == 0:
+                indexed = [await store.index_members(user_key('github', str(user))) for user in range(100)]
+                detector.sample(
+                    store_keys=len(store._data), indexed_tokens=sum(map(len, indexed)),  # pylint: disable=protected-access
+                    held_responses=monitor.stats()['held'],
+                )
+    finally:
+        await stop_background_tasks(app, None)
+        tracemalloc.stop()
+
+    assert monitor.leaked == 0
+    assert not detector.growth(), detector.report()
+
+
+def test_growth_detector_finds_leak():
+    leaked = []
+    detector = GrowthDetector()
+    tracemalloc.start()
+    try:
+        for number in range(SAMPLES):
+            leaked.extend(SimpleNamespace() for _ in range(100))
+            detector.sample(queue=number % 2)
+    finally:
+        tracemalloc.stop()
+    assert set(detector.growth()) == {'objects SimpleNamespace'}
+    assert 'objects SimpleNamespace' in detector.report()
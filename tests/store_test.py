@@ -0,0 +1,147 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from sanic_oauth.blueprint import complete_login, login_required, logout, logout_everywhere
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.core import UserInfo
+from sanic_oauth.store import LocalChannel, MemoryStore, NearCache, _RedisConnection, token_key, user_key
+
+
+@pytest.mark.asyncio
+async def test_memory_store_expiration():
+    store = MemoryStore()
+    await store.set('short', {'a': 1}, ttl=0.01)
+    await store.set('long', [1, 2])
+    assert await store.get_many(['short', 'long', 'missing']) == [{'a': 1}, [1, 2], None]
+    assert await store.ttl('long') is None
+    await asyncio.sleep(0.02)
+    assert await store.get('short') is None
+
+
+@pytest.mark.asyncio
+async def test_near_cache_invalidation_between_workers():
+    shared, channel = MemoryStore(), LocalChannel()
+    first = NearCache(shared, channel, ttl=60)
+    second = NearCache(shared, channel, ttl=60)
+
+    await first.set('key', 'old')
+    assert await second.get('key') == 'old'
+    await shared.set('key', 'changed behind cache')
+    assert await second.get('key') == 'old'
+
+    await first.set('key', 'new')
+    assert await second.get('key') == 'new'
+    await first.delete('key')
+    assert await second.get_many(['key']) == [None]
+
+
+@pytest.mark.asyncio
+async def test_redis_protocol():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b'+OK\r\n$5\r\nvalue\r\n$-1\r\n*2\r\n:1\r\n$1\r\nx\r\n')
+    connection = _RedisConnection(reader, None)
+    assert _RedisConnection.encode(['SET', 'key', 10]) == b'*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$2\r\n10\r\n'
+    assert await connection.read_reply() == 'OK'
+    assert await connection.read_reply() == b'value'
+    assert await connection.read_reply() is None
+    assert await connection.read_reply() == [1, b'x']
+
+
+@pytest.mark.asyncio
+async def test_logout_propagates_through_store():
+    class Client:
+        name = 'github'
+        circuit_breaker = None
+        calls = 0
+
+        async def conditional_user_info(self, _validators=None):
+            Client.calls += 1
+            return UserInfo(id='1', email='user@example.com'), {}, {}
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    shared, channel = MemoryStore(), LocalChannel()
+    await shared.set(token_key('token', 'token'), {'provider': None})
+
+    def node():
+        store = NearCache(shared, channel)
+        app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=lambda **_: Client(), oauth_store=store))
+        return SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': 'token'}), path='/private')
+
+    @login_required
+    async def handler(_request, user):
+        return user.email
+
+    first, second = node(), node()
+    assert await handler(first) == 'user@example.com'
+    assert await handler(second) == 'user@example.com'
+    assert Client.calls == 1
+
+    await logout(first)
+    second.ctx.session.pop('user_info')
+    response = await handler(second)
+    assert response.status == 302
+    assert 'token' not in second.ctx.session
+
+
+@pytest.mark.asyncio
+async def test_logout_everywhere():
+    class Client:
+        name = 'github'
+        circuit_breaker = None
+
+        async def conditional_user_info(self, _validators=None):
+            return UserInfo(id=42, email='user@example.com'), {}, {}
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    store = MemoryStore()
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=lambda **_: Client(), oauth_store=store))
+
+    @login_required
+    async def handler(_request, user):
+        return user.email
+
+    requests = []
+    for token in ('laptop', 'phone'):
+        await store.set(token_key('token', token), {'provider': None}, ttl=60)
+        requests.append(SimpleNamespace(app=app, ctx=SimpleNamespace(session={'token': token}), path='/private'))
+        assert await handler(requests[-1]) == 'user@example.com'
+    assert len(await store.index_members(user_key('github', 42))) == 2
+    await logout(requests[0])
+    assert len(await store.index_members(user_key('github', 42))) == 1
+
+    assert await logout_everywhere(app, 'github', 42) == 1
+    for request in requests:
+        assert (await handler(request)).status == 302
+
+
+@pytest.mark.asyncio
+async def test_login_indexes_token_without_user_info():
+    class Client:
+        name = 'github'
+        circuit_breaker = None
+
+        async def conditional_user_info(self, _validators=None):
+            return UserInfo(id=42, email='user@example.com'), {}, {}
+
+    oauth_config = compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'user:email',
+    })
+    store = MemoryStore()
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_config=oauth_config, oauth_factory=lambda **_: Client(), oauth_store=store))
+    request = SimpleNamespace(app=app, ctx=SimpleNamespace(session={'after_auth_redirect': '/private'}), path='/oauth')
+
+    @login_required(add_user_info=False)
+    async def handler(_request):
+        return 'ok'
+
+    response = await complete_login(request, None, None, oauth_config.provider(None), 'tablet', {})
+    assert response.headers['Location'] == '/private'
+    assert await handler(request) == 'ok'
+    assert await logout_everywhere(app, 'github', 42) == 1
+    assert (await handler(request)).status == 302
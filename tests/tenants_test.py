@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+
+from sanic_oauth.core import OAuthConfigurationException
+from sanic_oauth.providers import GithubClient, GitlabClient
+from sanic_oauth.tenants import FileSource, MemorySource, TenantRegistry
+
+CONFIG = {'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': 'email'}
+
+
+def _github(client_id):
+    return {'PROVIDER_CLASS': 'github', 'CLIENT_ID': client_id, 'CLIENT_SECRET': 'secret'}
+
+
+@pytest.mark.asyncio
+async def test_reload_swaps_changed_entries():
+    source = MemorySource({f'tenant{i}': {'default': _github(f'id{i}')} for i in range(1000)})
+    registry = TenantRegistry(source, CONFIG, max_runtimes=10)
+    await registry.reload()
+    assert len(registry) == 1000
+    unchanged = registry.get('tenant1')
+
+    source.set('tenant2', 'default', _github('changed'))
+    source.set('tenant2', 'gitlab', {'PROVIDER_CLASS': 'gitlab', 'CLIENT_ID': 'id', 'CLIENT_SECRET': 'secret'})
+    source.set('tenant3', 'broken', {'CLIENT_ID': 'no class'})
+    source.remove('tenant4')
+    await registry.reload()
+
+    assert registry.get('tenant1') is unchanged
+    assert registry.get('tenant2').settings['client_id'] == 'changed'
+    assert registry.get('tenant2', 'gitlab').provider_class is GitlabClient
+    with pytest.raises(OAuthConfigurationException):
+        registry.get('tenant3', 'broken')
+    with pytest.raises(OAuthConfigurationException):
+        registry.get('tenant4')
+
+    for i in range(20):
+        client = registry.create_client(None, f'tenant{i + 10}', access_token='token')
+        assert isinstance(client, GithubClient)
+        assert client.rate_limiter is registry.runtime(f'tenant{i + 10}')['rate_limiter']
+    assert len(registry._runtimes) == 10  # pylint: disable=protected-access
+
+
+@pytest.mark.asyncio
+async def test_file_source(tmp_path):
+    path = tmp_path / 'tenants.json'
+    path.write_text(json.dumps({'acme': {'default': _github('acme-id')}}))
+
+    registry = TenantRegistry(FileSource(str(path)), CONFIG)
+    await registry.reload()
+
+    assert registry.get('acme').settings['client_id'] == 'acme-id'
+
+    # changes made through the registry survive reloads, also one already in flight
+    await asyncio.gather(registry.reload(), registry.set('acme', 'gitlab', {'PROVIDER_CLASS': 'gitlab', 'CLIENT_ID': 'id'}))
+    await registry.remove('acme', 'default')
+    await registry.reload()
+    assert registry.get('acme', 'gitlab').provider_class is GitlabClient
+    with pytest.raises(OAuthConfigurationException):
+        registry.get('acme')
+    assert list(json.loads(path.read_text())['acme']) == ['gitlab']
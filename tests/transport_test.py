@@ -0,0 +1,71 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from aiohttp import BasicAuth
+import pytest
+
+from sanic_oauth.blueprint import create_oauth_factory, stop_background_tasks
+from sanic_oauth.config import compile_oauth_config
+from sanic_oauth.providers import Bitbucket2Client, GithubClient
+from sanic_oauth.transport import InMemoryResponse, InMemoryTransport
+
+
+async def github(request):
+    if request.url.path == '/login/oauth/access_token':
+        form = request.form()
+        return InMemoryResponse.from_json({'access_token': 'token-' + form['code']})
+    if request.url.path == '/user':
+        token = request.query['access_token']
+        return InMemoryResponse.from_json({'id': token, 'login': 'octocat', 'email': f'{token}@example.com'})
+    return InMemoryResponse(404)
+
+
+@pytest.mark.asyncio
+async def test_oauth_flow_without_sockets():
+    transport = InMemoryTransport(github)
+
+    async def login(code):
+        client = GithubClient(transport, client_id='id', client_secret='secret')
+        token, _data = await client.get_access_token(code)
+        user, _data = await client.user_info()
+        return token, user.email
+
+    results = await asyncio.gather(*(login(str(code)) for code in range(1000)))
+    assert results[7] == ('token-7', 'token-7@example.com')
+    assert transport.requests == 2000
+
+
+@pytest.mark.asyncio
+async def test_asgi_application():
+    seen = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        seen.append((scope['method'], scope['path'], scope['query_string'], dict(scope['headers']), message['body']))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps({'uuid': '1', 'username': 'user'}).encode()})
+
+    client = Bitbucket2Client(InMemoryTransport.asgi(app), client_id='id', client_secret='secret', access_token='token')
+    response = await client.request('GET', 'user', params={'fields': 'uuid'})
+    assert response.status == 200
+    assert await response.json() == {'uuid': '1', 'username': 'user'}
+    method, path, query, headers, _body = seen[0]
+    assert (method, path, query) == ('GET', '/2.0/user', b'fields=uuid')
+    assert headers[b'authorization'] == b'Bearer token'
+    assert headers[b'host'] == b'api.bitbucket.org'
+
+    request = InMemoryTransport.build_request('POST', 'http://host/', data={'a': '1'}, auth=BasicAuth('id', 'secret'))
+    assert request.form() == {'a': '1'}
+    assert request.headers['Authorization'] == BasicAuth('id', 'secret').encode()
+
+
+@pytest.mark.asyncio
+async def test_transport_without_aiohttp_session_skips_warmup():
+    app = SimpleNamespace(ctx=SimpleNamespace(oauth_transport=InMemoryTransport(github), oauth_config=compile_oauth_config({
+        'OAUTH_PROVIDER': 'github', 'OAUTH_REDIRECT_URI': 'http://localhost/oauth', 'OAUTH_SCOPE': '',
+        'OAUTH_WARMUP_CONNECTIONS': 2,
+    })))
+    await create_oauth_factory(app, None)
+    assert not hasattr(app.ctx, 'oauth_warmup')
+    await stop_background_tasks(app, None)
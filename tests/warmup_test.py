@@ -0,0 +1,27 @@
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from sanic_oauth.warmup import ProviderWarmup
+
+
+@pytest.mark.asyncio
+async def test_warm_opens_pooled_connections():
+    peers = set()
+
+    async def root(request):
+        peers.add(request.transport.get_extra_info('peername'))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_route('HEAD', '/', root)
+    async with TestServer(app) as server, ClientSession() as session:
+        warmup = ProviderWarmup(
+            session, [str(server.make_url('/token')), str(server.make_url('/user'))],
+            browser_urls=['https://localhost/authorize'], connections=3
+        )
+        assert warmup.origins == [str(server.make_url('/'))]
+        await warmup.resolve()
+        await warmup.warm()
+
+    assert len(peers) == 3